@@ -1,22 +1,47 @@
+import time
+import_start = time.perf_counter() # startup_seconds["import"] counts from here
+
 import re
 
 import dash
+import flask
 from dash import dcc, html, dash_table
 from dash.exceptions import PreventUpdate
 from dash.dependencies import Input, Output, State
-import plotly.graph_objects as go
-import plotly.express as px
 
 import utils.dash_reusable_components as drc
 import utils.mathutils as mu
+import utils.datacache as dc
+import utils.table_query as tq
+import utils.sidecar as sc
+import utils.typeinfer as ti
+import utils.aggcache as ac
+import utils.session as ss
+import utils.chunked as ck
+import utils.jobs as jobs
+import utils.figures as fg
+import utils.export as ex
+import utils.catalog as cg
+import utils.sampling as sp
+import utils.engines as en
+import utils.metrics as mt
+import utils.wire as wr
+import utils.colstats as cs
+import utils.shards as sh
+import utils.excel as xl
+import utils.tail as tl
+import utils.partialagg as pa
 
 import os
 import sys
+import json
 import pandas as pd
 import copy
 import webbrowser
 from datetime import datetime
 from warnings import warn
+import threading
+import gc
 from threading import Timer
 
 
@@ -33,21 +58,52 @@ server = app.server
 
 title_text = "Data Exploration Viewer"
 default_page_size = 25 # Default number of table rows to display
+row_height = '30px' # Table row height, and column width and table height, when the rows are virtualized
+column_width = '180px'
+table_height = '750px'
+table_style_data = {
+    'whiteSpace': 'normal',
+    'height': 'auto',
+    # 'color': 'white',
+    'backgroundColor': '#2A2E3C'
+}
 max_num_bars = 50 # The maximum number of bars to display on the bar plots
-
-# Use these to track current application state
-full_data_path = None
-full_data_prefix = None
-global_page_current = None
-global_page_size_table = None
-global_sort_by = None
-global_filter_query = None
-global_page_size = None
+table_backend = os.environ.get("DATA_EXPLORER_TABLE_BACKEND", "custom") # "custom" pages/sorts/filters server-side, "native" in the browser
+dataset_cache_max_bytes = int(os.environ.get("DATA_EXPLORER_CACHE_BYTES", 2 * 1024**3)) # Memory budget for loaded datasets
+aggregation_cache_max_bytes = int(os.environ.get("DATA_EXPLORER_AGG_CACHE_BYTES", 512 * 1024**2)) # Memory budget for group-by results
+sidecar_cache_dir = os.environ.get("DATA_EXPLORER_SIDECAR_DIR", os.path.join(os.path.expanduser("~"), ".data_explorer_cache")) # Empty to disable
+sidecar_format = os.environ.get("DATA_EXPLORER_SIDECAR_FORMAT", "feather") # "feather" or "parquet"
+streaming_threshold_bytes = int(os.environ.get("DATA_EXPLORER_STREAMING_BYTES", 1024**3)) # CSV files larger than this are streamed in chunks
+streaming_chunk_rows = int(os.environ.get("DATA_EXPLORER_CHUNK_ROWS", 250000)) # Rows per chunk when streaming
+load_worker_threads = int(os.environ.get("DATA_EXPLORER_LOAD_WORKERS", 2)) # Background threads loading datasets
+session_state_dir = os.environ.get("DATA_EXPLORER_SESSION_DIR", os.path.join(sidecar_cache_dir, "sessions") if sidecar_cache_dir else "") # Shared by worker processes, empty keeps sessions in-process
+aggregation_state_dir = os.environ.get("DATA_EXPLORER_STATE_DIR", os.path.join(sidecar_cache_dir, "states") if sidecar_cache_dir else "") # Group-by states saved for other worker processes and later runs, empty to disable
+session_ttl_seconds = int(os.environ.get("DATA_EXPLORER_SESSION_TTL", 12 * 3600)) # Idle sessions are dropped after this long
+export_chunk_rows = int(os.environ.get("DATA_EXPLORER_EXPORT_CHUNK_ROWS", 50000)) # Rows serialized at a time when streaming a download
+catalog_recursive = os.environ.get("DATA_EXPLORER_CATALOG_RECURSIVE", "0") == "1" # List data files in subfolders of the Data Path too
+catalog_glob = os.environ.get("DATA_EXPLORER_CATALOG_GLOB", "") # Only list files matching this pattern, e.g. "sales_*.csv"
+catalog_poll_seconds = float(os.environ.get("DATA_EXPLORER_CATALOG_POLL", 5)) # How often folders are checked for new files, 0 to never
+fast_preview_default = os.environ.get("DATA_EXPLORER_FAST_PREVIEW", "0") == "1" # Start with Fast Preview switched on
+sp.sample_rows = int(os.environ.get("DATA_EXPLORER_SAMPLE_ROWS", sp.sample_rows)) # Rows sampled for Fast Preview estimates
+query_engine = os.environ.get("DATA_EXPLORER_ENGINE", "pandas") # "pandas" or "duckdb", runs the group-bys and table filters / sorts
+group_by_warn_distinct = int(os.environ.get("DATA_EXPLORER_GROUP_BY_WARN_DISTINCT", 100000)) # Group By columns with more distinct values are flagged in the dropdown
+group_by_max_distinct = int(os.environ.get("DATA_EXPLORER_GROUP_BY_MAX_DISTINCT", 1000000)) # and columns with more than this can't be grouped by
+sh.workers = int(os.environ.get("DATA_EXPLORER_SHARD_WORKERS", sh.workers)) # Threads reading the files of a folder / glob dataset in parallel
+xl.workers = int(os.environ.get("DATA_EXPLORER_EXCEL_WORKERS", xl.workers)) # Worker processes parsing the sheets of a workbook, 1 to parse in-process
+tl.enabled = os.environ.get("DATA_EXPLORER_TAIL_FOLLOW", "0") == "1" # Append-only CSV files: parse only the lines added since the last read
+auto_refresh_seconds = float(os.environ.get("DATA_EXPLORER_AUTO_REFRESH", 10)) # How often Auto Refresh checks the open dataset for changes
+max_visible_columns = int(os.environ.get("DATA_EXPLORER_MAX_COLUMNS", 50)) # Wider datasets open with only their first columns shown, see the Columns dropdown
+virtualize_page_size = int(os.environ.get("DATA_EXPLORER_VIRTUALIZE_ROWS", 100)) # Pages of at least this many rows only render the rows scrolled into view, 0 to never
+preload_datasets = [p for p in os.environ.get("DATA_EXPLORER_PRELOAD", "").split(",") if p] # Datasets loaded at startup, comma-separated full paths, see preload()
+compress_algorithms = [a for a in os.environ.get("DATA_EXPLORER_COMPRESS", "br,gzip").split(",") if a] # Response compression in order of preference, empty to disable
+compress_level = int(os.environ.get("DATA_EXPLORER_COMPRESS_LEVEL", 6)) # 1 (fastest) to 9
+
+# Application state is kept per session, see session_store below
 
 # If Using Data Files with Known Structure, Can Define the Structure Like This
 # This will help the application use the proper dtypes for the given columns, and
 # help with column ordering in the displayed table
-# (These will be passed to the read_df() function when used)
+# (These will be passed to the load_df() function when used)
 # selected_earning_data_usable_cols = [
 #     'Category',
 #     'Name',
@@ -121,7 +177,8 @@ def table_type(df_column, col_name=None):
         if (str(df_column.dtype).startswith('date')):
             t = 'datetime'
         elif (str(df_column.dtype).startswith('object') or
-                str(df_column.dtype).startswith('str')):
+                str(df_column.dtype).startswith('str') or
+                str(df_column.dtype) == 'category'):
             t = 'text'
         elif (str(df_column.dtype).startswith('int') or
                 str(df_column.dtype).startswith('float')):
@@ -135,41 +192,40 @@ def table_type(df_column, col_name=None):
 
 
 
-def read_df(path, dtype_dict=None, col_order=None):
+def read_df(path, dtype_dict=None, col_order=None, date_formats=None, nrows=None, parsed=None):
+    # parsed: the raw frame when the file was already parsed, e.g. a sheet parsed with the rest of its workbook
 
-    if(path.endswith('.csv')):
-        df = pd.read_csv(path, sep=",", encoding='Latin-1')
-    elif(path.endswith('.xls') or path.endswith('.xlsm') or path.endswith('.xlsx')):
-        df = pd.read_excel(path)
+    with mt.timed("parse"):
+        if(parsed is not None):
+            df = parsed
+        elif(path.endswith('.csv')):
+            job = jobs.current_job()
+            if(job is None):
+                df = pd.read_csv(path, sep=",", encoding='Latin-1', nrows=nrows)
+            else:
+                # Inside a background load: read in chunks to report progress and allow cancelling
+                df = ck.read_csv_chunked(path, streaming_chunk_rows, nrows=nrows,
+                                         progress=job_progress("Reading " + os.path.basename(path)),
+                                         cancelled=job.cancelled)
+        elif(xl.is_excel(path)):
+            # "book.xlsx::Sales" reads that sheet, a plain workbook path its first sheet
+            workbook, sheet = xl.split_sheet(path)
+            df = xl.parse_sheet(workbook, sheet, nrows=nrows)
 
     # REMOVE UNNAMED COLUMNS
     df = df[[c for c in df.columns if not c.lower().startswith("unnamed")]]
 
 
-    if dtype_dict is None:
-        warn("READING WITHOUT DTYPES ---" + str(path))
-        # One last try to convert date strings to datetime
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                try:
-                    df[col] = pd.to_datetime(df[col])
-                except ValueError:
-                    pass
+    with mt.timed("dtypes"):
+        if dtype_dict is None:
+            warn("READING WITHOUT DTYPES, INFERRING FROM A SAMPLE ---" + str(path))
+            # Inferred schemas are cached per file, see ti.cached_schemas() / the /schema route
+            schema = ti.get_schema(path, df)
+            df = ti.apply_dtypes(df, schema['dtype_dict'], schema['date_formats'], downcast=True)
 
 
-    else:
-        for k, v in dtype_dict.items():
-            try:
-                if(v == 'string'):
-                    df[k] = df[k].astype('string')
-                elif(v in ['int64', 'float64', 'int32', 'float32', 'double']):
-                    df[k] = pd.to_numeric(df[k], errors='coerce')
-                elif('date' in v):
-                    df[k] = pd.to_datetime(df[k], errors='coerce')
-                else:
-                    raise Exception("INVALID DTYPE GIVEN FOR COLUMN --- " + str(k))
-            except Exception as e:
-                warn(str(e))
+        else:
+            df = ti.apply_dtypes(df, dtype_dict, date_formats)
 
 
     if(col_order is None):
@@ -183,12 +239,482 @@ def read_df(path, dtype_dict=None, col_order=None):
     return df
 
 
+def is_streaming(path):
+    return path.endswith('.csv') and not sh.is_sharded(path) and os.path.getsize(path) > streaming_threshold_bytes
+
+
+def is_followed(path):
+    return tl.enabled and path.endswith('.csv') and not sh.is_sharded(path) and not is_streaming(path)
+
+
+def load_df(path, dtype_dict=None, col_order=None, date_formats=None):
+    if(xl.is_excel(path)):
+        return load_excel(path, dtype_dict=dtype_dict, col_order=col_order, date_formats=date_formats)
+    if(is_streaming(path)):
+        # Too big to hold in memory, keep the first chunk as a preview, group-bys stream the whole file
+        return read_df(path, dtype_dict=dtype_dict, col_order=col_order, date_formats=date_formats, nrows=streaming_chunk_rows)
+
+    # Goes through a typed columnar copy of the file when one is fresh, see utils/sidecar.py
+    return sc.read_through(path,
+                           lambda p: read_df(p, dtype_dict=dtype_dict, col_order=col_order, date_formats=date_formats),
+                           sidecar_cache_dir,
+                           fmt=sidecar_format,
+                           variant=(dtype_dict, col_order) if date_formats is None else (dtype_dict, col_order, date_formats))
+
+
+def load_excel(path, dtype_dict=None, col_order=None, date_formats=None):
+    # Every sheet without a fresh sidecar is parsed at once, in parallel worker processes, and gets
+    # its own sidecar, so the workbook's other sheets open straight from their sidecars later
+    workbook, sheet = xl.split_sheet(path)
+    sheets = xl.sheet_names(workbook)
+    path = xl.sheet_path(workbook, sheet or sheets[0])
+    variant = (dtype_dict, col_order) if date_formats is None else (dtype_dict, col_order, date_formats)
+    read = lambda p, parsed=None: read_df(p, dtype_dict=dtype_dict, col_order=col_order, date_formats=date_formats, parsed=parsed)
+
+    parsed = {}
+    if(sidecar_cache_dir and sc.available()):
+        stale = [s for s in sheets if not sc.is_fresh(xl.sheet_path(workbook, s),
+                                                      sc.sidecar_path(xl.sheet_path(workbook, s), sidecar_cache_dir, sidecar_format, variant),
+                                                      sidecar_format)]
+        if(xl.split_sheet(path)[1] in stale and len(stale) > 1):
+            with mt.timed("parse_workbook"):
+                parsed = xl.parse_sheets(workbook, stale)
+            for s, raw in parsed.items():
+                if(xl.sheet_path(workbook, s) != path):
+                    try:
+                        sc.read_through(xl.sheet_path(workbook, s), lambda p, raw=raw: read(p, raw), sidecar_cache_dir,
+                                        fmt=sidecar_format, variant=variant)
+                    except Exception as e:
+                        warn("COULDN'T CACHE SHEET --- " + str(s) + " --- " + str(e))
+
+    return sc.read_through(path, lambda p: read(p, parsed.get(xl.split_sheet(p)[1])), sidecar_cache_dir,
+                           fmt=sidecar_format, variant=variant)
+
+
+def dataset_file(file, sheet):
+    # The dataset name of a workbook's sheet, e.g. "book.xlsx::Sales", other files are their own dataset
+    if(file and sheet and xl.is_excel(file)):
+        return xl.sheet_path(file, sheet)
+    return file
+
+
+def dataset_exists(full_data_path):
+    # A file, a sheet of a workbook, or a folder / glob with at least one data file
+    if(xl.is_sheet_path(full_data_path)):
+        return xl.exists(full_data_path)
+    return sh.exists(full_data_path)
+
+
+def load_sharded(path, previous=None):
+    # A folder / glob of files as one dataset, see utils/shards.py. Every shard is read with the
+    # first shard's schema so their columns line up, but with 64-bit numbers: a later shard's values
+    # may not fit the first one's downcast types. sh.load narrows them once for the whole dataset.
+    shards = sh.shard_paths(path)
+    if(len(shards) == 0):
+        raise FileNotFoundError("NO DATA FILES MATCH --- " + str(path))
+    schema = ti.get_schema(shards[0])
+    first = None
+    if(schema is None):
+        first = load_df(shards[0])
+        schema = ti.get_schema(shards[0], first)
+    columns = schema['col_order']
+    dtype_dict = {c: ('int64' if v.startswith('int') else 'float64' if v in ['float32', 'double'] else v)
+                  for c, v in schema['dtype_dict'].items()}
+
+    def read_shard(shard):
+        if(first is not None and shard == shards[0]):
+            return first
+        return load_df(shard, dtype_dict=dtype_dict, col_order=columns, date_formats=schema['date_formats'])
+
+    job = jobs.current_job()
+    return sh.load(path, read_shard, previous,
+                   progress=job_progress("Reading " + str(len(shards)) + " files of " + os.path.basename(os.path.normpath(path))),
+                   cancelled=job.cancelled if job is not None else None)
+
+
+# Data files per folder, listed once and kept up to date in the background, see utils/catalog.py
+catalogs = cg.CatalogRegistry(recursive=catalog_recursive, poll_seconds=catalog_poll_seconds)
+
+
 def get_file_path_options(path):
-    return [{"label": x, "value": x} for x in [file for file in os.listdir(path) if
-                                                   file.endswith('.csv') or
-                                                   file.endswith('.xls') or
-                                                   file.endswith('.xlsm') or
-                                                   file.endswith('.xlsx')]]
+    files = catalogs.get(path or os.getcwd()).files(catalog_glob)
+    # Folders and runs of similarly named files (e.g. daily exports) can be opened as one dataset
+    patterns, folders = sh.group_options([x["name"] for x in files])
+    return ([{"label": p + " (" + str(n) + " files)", "value": p} for p, n in sorted(patterns.items())] +
+            [{"label": f + " (" + str(n) + " files)", "value": f} for f, n in sorted(folders.items())] +
+            [{"label": x["name"], "value": x["name"]} for x in files])
+
+
+def load_and_catalog(path, previous=None):
+    # Only runs on a dataset cache miss, previous is the outdated frame of a file / folder that changed
+    with mt.timed("load"):
+        if(sh.is_sharded(path)):
+            df = load_sharded(path, previous)
+        elif(is_followed(path)):
+            # Only the lines appended since previous was read are parsed, see utils/tail.py
+            df = tl.load(path, load_df, previous)
+        else:
+            df = load_df(path)
+    with mt.timed("profile"):
+        profile = cs.profile_frame(df, table_type)
+        # Streamed files are profiled on their preview only
+        profile['partial'] = is_streaming(path)
+        cs.cache_profile(path, profile)
+    # Streamed files only hold a preview, their row count isn't known
+    catalogs.record(path, rows=None if is_streaming(path) else len(df), columns=len(df.columns),
+                    dtypes=df.dtypes.astype(str).to_dict())
+    return df
+
+
+def column_profile(full_data_path):
+    # Column statistics of a loaded dataset, None until it's loaded, see utils/colstats.py
+    if(not dataset_cache.contains(full_data_path)):
+        return None
+    return cs.cached_profile(full_data_path, lambda p: dict(cs.profile_frame(load_dataset(p), table_type),
+                                                            partial=is_streaming(p)))
+
+
+def blocked_group_by(profile, group_by):
+    # Columns with too many distinct values to group by
+    if(profile is None):
+        return []
+    return [c for c in group_by or [] if profile['columns'].get(c, {}).get('distinct', 0) > group_by_max_distinct]
+
+
+# Group-bys and table queries run on this, see utils/engines.py
+engine = en.get_engine(query_engine)
+
+# gzip / brotli responses, see utils/wire.py
+wr.compress(server, compress_algorithms, compress_level)
+
+# Loaded datasets are shared by every callback, so treat frames returned from here as read-only
+dataset_cache = dc.DatasetCache(dataset_cache_max_bytes, pass_previous=True)
+aggregation_cache = ac.AggregationCache(aggregation_cache_max_bytes)
+
+# Datasets each session served by this process has open, so shared frames aren't evicted under them
+session_pins = {}
+session_pins_lock = threading.Lock()
+
+
+def unpin_session(session_id, state=None):
+    with session_pins_lock:
+        old_path = session_pins.pop(session_id, None)
+    if old_path is not None:
+        dataset_cache.release(old_path)
+
+
+session_store = ss.SessionStore(session_state_dir or None, session_ttl_seconds, on_expire=unpin_session)
+
+
+# Loads run on background threads (not processes) so the frames land in this process's caches.
+# A session waiting on a load has its key in state['load_job']. Progress, completion and
+# cancellation go through the session state, so the polling callback can run on any worker.
+load_jobs = jobs.JobQueue(load_worker_threads)
+
+
+def job_progress(label):
+    # Progress callback for code running inside a background load, None outside of one
+    job = jobs.current_job()
+    if job is None:
+        return None
+    return lambda fraction, rows=None: job.report(fraction, label + (" --- " + "{:,}".format(rows) + " rows" if rows is not None else "") +
+                                                  " (" + str(int(100 * fraction)) + "%)")
+
+
+def load_abandoned(job):
+    # Every session that wanted this load has cancelled it or moved on to another one
+    return len(job.sessions) > 0 and all(session_store.get(s).get('load_job') != job.key for s in list(job.sessions))
+
+
+def on_load_progress(job, fraction, text):
+    # Only sessions still waiting on this job, checked and written in one step so a load started
+    # in the meantime isn't overwritten
+    for s in list(job.sessions):
+        session_store.modify(s, lambda state: {"progress": {"fraction": fraction, "text": text}}
+                             if state.get('load_job') == job.key else None)
+
+
+def on_load_done(job):
+    for s in list(job.sessions):
+        session_store.modify(s, lambda state: dict(load_job=None, progress=None, load_error=job.error,
+                                                   load_token=state.get('load_token', 0) + 1)
+                             if state.get('load_job') == job.key else None)
+
+
+def load_key(full_data_path, group_by):
+    return json.dumps([full_data_path, list(group_by or [])])
+
+
+def start_load(session_id, path, file, group_by, aggregation_method, label="Loading "):
+    # Concurrent requests for the same dataset and group-by share one in-flight job
+    key = load_key(os.path.join(path, file), group_by)
+    session_store.update(session_id, load_job=key, load_cancelled=None, load_error=None,
+                         progress={"fraction": 0.0, "text": label + str(file)})
+    load_jobs.submit(key,
+                     lambda: get_filtered_df(path, file, group_by, aggregation_method),
+                     session_id=session_id,
+                     check=load_abandoned,
+                     on_progress=on_load_progress,
+                     on_done=on_load_done)
+
+
+def sampled_dataset(full_data_path):
+    # (sample, estimated total rows) without reading the whole file, None when there's no cheap way to get one
+    def sample_csv(p):
+        sample, total_rows = sp.sample_csv(p)
+        sample = sample[[c for c in sample.columns if not c.lower().startswith("unnamed")]]
+        # Not ti.get_schema(): a schema inferred from the sample mustn't be cached for the whole file,
+        # whose full load would then narrow its numbers to the sample's ranges
+        schema = ti.infer_schema(sample)
+        return ti.apply_dtypes(sample, schema['dtype_dict'], schema['date_formats'], downcast=True), total_rows
+
+    if(dataset_cache.contains(full_data_path) and not is_streaming(full_data_path)):
+        return sp.cached_sample(full_data_path, lambda p: sp.sample_frame(dataset_cache.get(p, load_and_catalog)))
+    if(full_data_path.endswith('.csv') and not sh.is_sharded(full_data_path)):
+        return sp.cached_sample(full_data_path, sample_csv)
+    return None
+
+
+def get_preview_df(path, file, group_by, aggregation_method):
+    # Estimated group-by shown while the exact one loads, returns (estimate, sample, sample total rows) or None
+    if(group_by is None or len(group_by) == 0 or not aggregation_method):
+        return None
+    try:
+        sampled = sampled_dataset(os.path.join(path, file))
+        if(sampled is None):
+            return None
+        sample, total_rows = sampled
+        estimate = sp.cached_estimate(os.path.join(path, file), sample, total_rows, group_by, aggregation_method)
+        return estimate, sample, total_rows
+    except Exception as e:
+        warn("COULDN'T SAMPLE --- " + str(e))
+        return None
+
+
+def data_ready(full_data_path, group_by, aggregation_method):
+    if (not dataset_cache.contains(full_data_path)):
+        return False
+    if (group_by is None or len(group_by) == 0 or not aggregation_method):
+        return True
+    return aggregation_cache.contains(dc.file_key(full_data_path), group_by, aggregation_method)
+
+
+def loads_in_background(full_data_path, group_by, aggregation_method):
+    # Only work that reads the file goes to the background: loading a dataset that isn't cached, or a
+    # group-by of a streamed file. Group-bys of a cached frame are computed in the request.
+    if (data_ready(full_data_path, group_by, aggregation_method)):
+        return False
+    if (not dataset_cache.contains(full_data_path)):
+        return True
+    return is_streaming(full_data_path)
+
+
+def load_dataset(full_data_path, session_id=None):
+    if session_id is None:
+        return dataset_cache.get(full_data_path, load_and_catalog)
+
+    with session_pins_lock:
+        old_path = session_pins.get(session_id)
+        if old_path == full_data_path:
+            return dataset_cache.get(full_data_path, load_and_catalog)
+        session_pins[session_id] = full_data_path
+    df = dataset_cache.acquire(full_data_path, load_and_catalog)
+    if old_path is not None:
+        dataset_cache.release(old_path)
+    return df
+
+
+@server.route("/cache-stats")
+def cache_stats():
+    return server.response_class(json.dumps({"datasets": dataset_cache.stats(),
+                                             "aggregations": aggregation_cache.stats(),
+                                             "shard_states": sh.states_stats(),
+                                             "tail_states": tl.states_stats()}),
+                                 mimetype="application/json")
+
+
+# Inferred schemas, usable as the dtype_dict / col_order / date_formats arguments of load_df()
+@server.route("/schema")
+def inferred_schemas():
+    return server.response_class(json.dumps(ti.cached_schemas(), indent=2), mimetype="application/json")
+
+
+# Column statistics of a loaded dataset, e.g. /column-profile?path=/data/sales.csv
+@server.route("/column-profile")
+def column_profile_json():
+    path = flask.request.args.get("path", "")
+    profile = column_profile(path) if dataset_exists(path) else None
+    if (profile is None):
+        return server.response_class("Not loaded: " + path, status=404, mimetype="text/plain")
+    return server.response_class(json.dumps(profile, indent=2), mimetype="application/json")
+
+
+# Catalog of a folder as JSON, e.g. /catalog?path=/data&search=sales&glob=*.csv
+@server.route("/catalog")
+def catalog():
+    args = flask.request.args
+    try:
+        files = catalogs.get(args.get("path") or os.getcwd()).files(args.get("glob") or catalog_glob, args.get("search"))
+    except OSError as e:
+        return server.response_class(str(e), status=404, mimetype="text/plain")
+    for f in files:
+        del f["dir"]
+    return server.response_class(json.dumps(files), mimetype="application/json")
+
+
+def export_filename(file, fmt, suffix=""):
+    workbook, sheet = xl.split_sheet(file)
+    name, _ = os.path.splitext(os.path.basename(os.path.normpath(workbook)))
+    # Sheets, e.g. "book.xlsx::Sales" -> "book_Sales"
+    if(sheet):
+        name += "_" + re.sub(r"[^\w\-]+", "_", sheet)
+    # Folder / glob datasets, e.g. "orders_*.csv" -> "orders_all"
+    name = re.sub(r"[*?\[\]]", "all", name)
+    return name + '___' + datetime.now().strftime("%Y_%m_%d_%H_%M_%S") + suffix + ex.formats[fmt][1]
+
+
+def export_frame(export):
+    # The filtered / sorted table, recomputed from the cached frames rather than sent up by the browser
+    df_tmp, _ = get_filtered_df(export['path'], export['file'], export['group_by'], export['aggregation'])
+    return tq.query_frame(df_tmp, export['filter_query'], export['sort_by'], run=engine.query)
+
+
+def export_file_frames(full_data_path, columns, filter_query):
+    # Every row of a streamed file, filtered one chunk at a time, in the table's columns
+    columns = list(columns)
+    exported = False
+    for chunk in ck.stream_frames(full_data_path, export_chunk_rows, schema=ti.get_schema(full_data_path)):
+        exported = True
+        yield engine.query(chunk[columns], filter_query, [])
+    if (not exported):
+        yield pd.DataFrame(columns=columns)
+
+
+# Streams the download requested with the Download button, see on_download_filter_data_button_pressed
+@server.route("/export")
+def export_data():
+    fmt = flask.request.args.get("format", "csv")
+    try:
+        export = session_store.get(flask.request.args.get("session")).get('export')
+    except ValueError:
+        export = None
+    if (export is None or fmt not in ex.available_formats()):
+        return server.response_class("Nothing to export", status=404, mimetype="text/plain")
+
+    try:
+        with mt.timed("export_query"):
+            df_tmp = export_frame(export)
+    except tq.FilterQueryError as e:
+        return server.response_class(str(e), status=400, mimetype="text/plain")
+    except PreventUpdate:
+        return server.response_class("Dataset not found", status=404, mimetype="text/plain")
+
+    full_data_path = os.path.join(export['path'], export['file'])
+    suffix = ""
+    chunks = None
+    if (is_streaming(full_data_path) and len(export['group_by']) == 0):
+        # The table only holds a preview of the file
+        if (len(export['sort_by']) == 0):
+            chunks = ex.iter_export_frames(export_file_frames(full_data_path, df_tmp.columns, export['filter_query']), fmt)
+        else:
+            # Sorting needs every row at once, the export is the sorted preview and its name says so
+            suffix = "_first_" + str(streaming_chunk_rows) + "_rows"
+    if (chunks is None):
+        chunks = ex.iter_export(df_tmp, fmt, export_chunk_rows)
+
+    def stream():
+        # Timed until the last chunk went out, including the time the client took to read them
+        with mt.timed("export", format=fmt):
+            for chunk in chunks:
+                mt.observe("export_chunk_bytes", len(chunk), format=fmt)
+                yield chunk
+
+    return server.response_class(stream(),
+                                 mimetype=ex.formats[fmt][0],
+                                 headers={"Content-Disposition": 'attachment; filename="' + export_filename(export['file'], fmt, suffix) + '"'})
+
+# Timing, payload size and cache metrics in the Prometheus text format, see utils/metrics.py
+mt.histogram("export_chunk_bytes", "Size of the chunks a download is streamed in", mt.bytes_buckets)
+mt.histogram("request_seconds", "Time to answer a Dash callback request, including JSON serialization")
+
+
+def cache_gauges(stat):
+    return lambda: {(("cache", name),): stats[stat] for name, stats in
+                    [("datasets", dataset_cache.stats()), ("aggregations", aggregation_cache.stats())]}
+
+
+for stat in ["hit_rate", "hits", "misses", "evictions", "entries", "current_bytes"]:
+    mt.gauge("cache_" + stat, "Cache " + stat.replace("_", " ") + ", per cache", cache_gauges(stat))
+mt.gauge("load_jobs", "Background loads in flight", lambda: {(): len(load_jobs)})
+
+
+def dash_callback_name():
+    # Name of the callback a /_dash-update-component request is for
+    try:
+        output = flask.request.get_json(silent=True)["output"]
+        return app.callback_map[output]["callback"].__name__
+    except (TypeError, KeyError):
+        return "unknown"
+
+
+@server.before_request
+def start_request_timer():
+    flask.g.request_start = time.perf_counter()
+
+
+@server.after_request
+def record_dash_request(response):
+    if (flask.request.path.endswith("/_dash-update-component")):
+        callback = dash_callback_name()
+        mt.observe("request_seconds", time.perf_counter() - flask.g.request_start, callback=callback)
+        mt.observe("request_bytes", flask.request.content_length or 0, callback=callback)
+        if (not response.is_streamed):
+            mt.observe("response_bytes", response.calculate_content_length() or 0, callback=callback)
+    return response
+
+
+def column_count_label(n):
+    # Few label values, so render times of wide and narrow tables can be told apart
+    for bound in [10, 50, 200]:
+        if (n <= bound):
+            return "<=" + str(bound)
+    return ">200"
+
+
+# Table render times measured in the browser, see wr.render_timing_js
+mt.histogram("render_seconds", "Time from a table page arriving in the browser to it being painted")
+
+
+@server.route("/render-timing", methods=["POST"])
+def render_timing():
+    try:
+        timing = json.loads(flask.request.get_data(as_text=True))
+        seconds, columns = float(timing["seconds"]), int(timing.get("columns", 0))
+    except (ValueError, KeyError, TypeError):
+        return server.response_class("Expected {\"seconds\": ..., \"columns\": ..., \"virtualized\": ...}", status=400,
+                                     mimetype="text/plain")
+    mt.observe("render_seconds", seconds, virtualized=str(bool(timing.get("virtualized"))).lower(),
+               columns=column_count_label(columns))
+    return server.response_class(status=204)
+
+
+@server.route("/metrics")
+def metrics():
+    return server.response_class(mt.render(), mimetype="text/plain; version=0.0.4")
+
+
+# Profiles the next `count` calls of a callback, e.g. /profile?callback=on_select_data&count=1,
+# then shows the cProfile stats of the last few profiled calls
+@server.route("/profile")
+def profile():
+    callback = flask.request.args.get("callback")
+    if (callback):
+        mt.arm_profile(callback, flask.request.args.get("count", 1))
+        return server.response_class("Profiling the next " + str(flask.request.args.get("count", 1)) + " call(s) of " + callback + "\n",
+                                     mimetype="text/plain")
+    text = "\n\n".join("=== " + p["callback"] + " at " + datetime.fromtimestamp(p["time"]).isoformat(timespec="seconds") +
+                        " (" + "{:.3f}".format(p["seconds"]) + " s)\n" + p["stats"] for p in reversed(mt.profiles()))
+    return server.response_class(text or "No profiles yet, arm one with /profile?callback=<callback name>\n", mimetype="text/plain")
 
 # END DATA LOADING
 #########################################################################################################################
@@ -196,255 +722,391 @@ def get_file_path_options(path):
 #########################################################################################################################
 
 
-df = pd.DataFrame.from_dict({})
-df_path = None
-global_group_by = None
-global_agg = None
-
-app.layout = html.Div(
-    children=[
-        # .container class is fixed, .container.scalable is scalable
-        html.Div(
-            className="banner",
-            children=[
-                # Change App Name here
-                html.Div(
-                    className="container scalable",
-                    children=[
-                        # Change App Name here
-                        html.H2(
-                            id="banner-title",
-                            children=[
-                                html.A(
-                                    title_text,
-                                    # href="",
-                                    style={
-                                        "text-decoration": "none",
-                                        "color": "inherit",
-                                    },
-                                )
-                            ],
-                        ),
-                        html.A(
-                            id="banner-logo",
-                            children=[
-                                html.Img(src=app.get_asset_url("dash-logo-new.png"))
-                            ],
-                            href="https://plot.ly/products/dash/",
-                        ),
-                    ],
-                )
-            ],
-        ),
-        html.Div(
-            id="body",
-            className="container scalable",
-            children=[
-                html.Div(
-                    id="app-container",
-                    # className="row",
-                    children=[
-                        html.Div(
-                            # className="three columns",
-                            id="left-column",
-                            style={"min-width": "25%", "max-width": "35%"},
-                            children=[
-                                drc.Card(
-                                    id="first-card",
-                                    children=[
-                                        drc.NamedInput(
-                                            name="Data Path",
-                                            id="data-path",
-                                            type="url",
-                                            placeholder=os.getcwd(),
-                                            debounce=True
-                                        ),
-                                        drc.NamedDropdown(
-                                            name="Select Dataset",
-                                            id="dropdown-select-dataset",
-                                            options=get_file_path_options(os.getcwd()),
-                                            clearable=False,
-                                            searchable=True,
-                                            value="",
-                                        ),
-                                        drc.NamedDropdown(
-                                            name="Group By",
-                                            id="group-by",
-                                            options=[],
-                                            value=None,
-                                            clearable=False,
-                                            searchable=False,
-                                            multi=True
-                                        ),
-                                        drc.NamedDropdown(
-                                            name="Aggregation Method",
-                                            id="aggregate",
-                                            options=["Count", "Sum", "Mean", "Standard Deviation", "Variance", "Min", "Max"],
-                                            value="Count",
-                                            clearable=False,
-                                            searchable=False,
-                                            multi=False,
-
-                                        ),
-                                        drc.NamedInput(
-                                            name="Page Size",
-                                            id="page-size-selection",
-                                            type="number",
-                                            placeholder=10,
-                                            value=10,
-                                            debounce=True,
-                                            min=1,
-                                            max=500
-                                        ),
-                                    ],
-                                ),
-                                drc.Card(
-                                    id="button-card",
-                                    children=[
-                                        drc.NamedSlider(
-                                            name="Max Number Plot Bars",
-                                            id="max-plot-bars",
-                                            min=0,
-                                            max=max_num_bars,
-                                            value=10,
-                                            step=1,
-                                            marks={
-                                                0: '0',
-                                                10: '10',
-                                                20: '20',
-                                                30: '30',
-                                                40: '40',
-                                                50: '50'
-                                            },
-                                            tooltip={"placement": "bottom", "always_visible": False}
-                                        ),
-                                    ],
-                                )
-                            ],
-                        ),
-                        html.Div([
-                            html.H3(
-                                "Select a Dataset",
-                                id="data-title",
-                                # href="",
-                                style={
-                                    "text-decoration": "none",
-                                    "color": "inherit",
-                                }
+def serve_layout():
+    # Built per page load so every browser tab gets its own session id
+    return html.Div(
+        children=[
+            # .container class is fixed, .container.scalable is scalable
+            html.Div(
+                className="banner",
+                children=[
+                    # Change App Name here
+                    html.Div(
+                        className="container scalable",
+                        children=[
+                            # Change App Name here
+                            html.H2(
+                                id="banner-title",
+                                children=[
+                                    html.A(
+                                        title_text,
+                                        # href="",
+                                        style={
+                                            "text-decoration": "none",
+                                            "color": "inherit",
+                                        },
+                                    )
+                                ],
                             ),
-                            html.Button(
-                                "Download Filtered Data",
-                                id="download-filtered-data-button",
-                                disabled=True,
-                                # style={"padding": "0px 10px 25px 25px"}
-                                style={"margin-right": "10px", "margin-bottom": "10px"}
+                            html.A(
+                                id="banner-logo",
+                                children=[
+                                    html.Img(src=app.get_asset_url("dash-logo-new.png"))
+                                ],
+                                href="https://plot.ly/products/dash/",
                             ),
+                        ],
+                    )
+                ],
+            ),
+            html.Div(
+                id="body",
+                className="container scalable",
+                children=[
+                    html.Div(
+                        id="app-container",
+                        # className="row",
+                        children=[
                             html.Div(
-                                html.A(
-                                    "",
-                                    id="data-filter-query",
+                                # className="three columns",
+                                id="left-column",
+                                style={"min-width": "25%", "max-width": "35%"},
+                                children=[
+                                    drc.Card(
+                                        id="first-card",
+                                        children=[
+                                            drc.NamedInput(
+                                                name="Data Path",
+                                                id="data-path",
+                                                type="url",
+                                                placeholder=os.getcwd(),
+                                                debounce=True
+                                            ),
+                                            drc.NamedDropdown(
+                                                name="Select Dataset",
+                                                id="dropdown-select-dataset",
+                                                options=get_file_path_options(os.getcwd()),
+                                                clearable=False,
+                                                searchable=True,
+                                                value="",
+                                            ),
+                                            drc.NamedDropdown(
+                                                name="Sheet",
+                                                id="sheet-select",
+                                                options=[],
+                                                value=None,
+                                                clearable=False,
+                                                searchable=True,
+                                                disabled=True
+                                            ),
+                                            drc.NamedDropdown(
+                                                name="Group By",
+                                                id="group-by",
+                                                options=[],
+                                                value=None,
+                                                clearable=False,
+                                                searchable=False,
+                                                multi=True
+                                            ),
+                                            drc.NamedDropdown(
+                                                name="Aggregation Method",
+                                                id="aggregate",
+                                                options=list(ac.methods),
+                                                value="Count",
+                                                clearable=False,
+                                                searchable=False,
+                                                multi=False,
+
+                                            ),
+                                            drc.NamedDropdown(
+                                                name="Columns",
+                                                id="column-select",
+                                                options=[],
+                                                value=[],
+                                                placeholder="All columns",
+                                                clearable=True,
+                                                searchable=True,
+                                                multi=True
+                                            ),
+                                            drc.NamedChecklist(
+                                                name="Fast Preview",
+                                                id="fast-preview",
+                                                options=[{"label": " Estimate Group By results from a sample while they load", "value": "on"}],
+                                                value=["on"] if fast_preview_default else []
+                                            ),
+                                            drc.NamedChecklist(
+                                                name="Auto Refresh",
+                                                id="auto-refresh",
+                                                options=[{"label": " Reload the dataset in the background when its file changes", "value": "on"}],
+                                                value=[]
+                                            ),
+                                            drc.NamedInput(
+                                                name="Page Size",
+                                                id="page-size-selection",
+                                                type="number",
+                                                placeholder=10,
+                                                value=10,
+                                                debounce=True,
+                                                min=1,
+                                                max=500
+                                            ),
+                                        ],
+                                    ),
+                                    drc.Card(
+                                        id="button-card",
+                                        children=[
+                                            drc.NamedSlider(
+                                                name="Max Number Plot Bars",
+                                                id="max-plot-bars",
+                                                min=0,
+                                                max=max_num_bars,
+                                                value=10,
+                                                step=1,
+                                                marks={
+                                                    0: '0',
+                                                    10: '10',
+                                                    20: '20',
+                                                    30: '30',
+                                                    40: '40',
+                                                    50: '50'
+                                                },
+                                                tooltip={"placement": "bottom", "always_visible": False}
+                                            ),
+                                        ],
+                                    )
+                                ],
+                            ),
+                            html.Div([
+                                html.H3(
+                                    "Select a Dataset",
+                                    id="data-title",
                                     # href="",
                                     style={
                                         "text-decoration": "none",
                                         "color": "inherit",
                                     }
-                                )
-                            ),
-                            html.Div(
-                                html.A(
-                                    "Filtering Documentation",
-                                    id="data-filter-link",
-                                    href="https://dash.plotly.com/datatable/filtering",
-                                    style={
-                                        "text-decoration": "none",
-                                        "color": "blue",
-                                        "text-decoration": "underline",
-                                        "font-size": 12
-                                    }
-                                )
-                            ),
-                            dash_table.DataTable(
-                                id='datatable-interactivity',
-                                columns=[
-                                    {'name': i, 'id': i, 'deletable': False} for i in df.columns
-                                    # omit the id column
-                                    # if i != 'id'
-                                ],
-                                data=df.to_dict('records'),
-                                editable=True,
-                                filter_action="native",
-                                sort_action="native",
-                                sort_mode='multi',
-                                row_selectable=False,
-                                row_deletable=False,
-                                selected_rows=[],
-                                page_action='native',
-                                page_current=0,
-                                page_size=default_page_size,
-                                style_data={
-                                    'whiteSpace': 'normal',
-                                    'height': 'auto',
-                                    # 'color': 'white',
-                                    'backgroundColor': '#2A2E3C'
-                                },
-                                style_data_conditional=[
-                                    {
-                                        'if': {'row_index': 'odd'},
-                                        'backgroundColor': '#3B4052',
+                                ),
+                                html.Div(
+                                    id="load-progress-container",
+                                    style={"display": "none"},
+                                    children=[
+                                        html.Progress(id="load-progress", max=100, value=0, style={"width": "100%"}),
+                                        html.Div(id="load-progress-text", style={"font-size": 12}),
+                                        html.Button("Cancel", id="cancel-load-button", style={"margin-bottom": "10px"})
+                                    ]
+                                ),
+                                dcc.Interval(id="load-progress-interval", interval=1000),
+                                dcc.Store(id="load-refresh", data=0),
+                                dcc.Store(id="table-view"),
+                                dcc.Store(id="table-page"),
+                                dcc.Store(id="cancel-load-ack"),
+                                dcc.Interval(id="auto-refresh-interval", interval=int(1000 * auto_refresh_seconds), disabled=True),
+                                dcc.Store(id="auto-refresh-ack"),
+                                html.Button(
+                                    "Download Filtered Data",
+                                    id="download-filtered-data-button",
+                                    disabled=True,
+                                    # style={"padding": "0px 10px 25px 25px"}
+                                    style={"margin-right": "10px", "margin-bottom": "10px"}
+                                ),
+                                dcc.RadioItems(
+                                    id="download-format",
+                                    options=[{"label": {"csv": "CSV", "csv.gz": "CSV (gzip)", "parquet": "Parquet"}[f], "value": f}
+                                             for f in ex.available_formats()],
+                                    value="csv",
+                                    inline=True,
+                                    style={"display": "inline-block", "font-size": 12}
+                                ),
+                                html.Div(
+                                    html.A(
+                                        "",
+                                        id="data-filter-query",
+                                        # href="",
+                                        style={
+                                            "text-decoration": "none",
+                                            "color": "inherit",
+                                        }
+                                    )
+                                ),
+                                html.Div(
+                                    html.A(
+                                        "Filtering Documentation",
+                                        id="data-filter-link",
+                                        href="https://dash.plotly.com/datatable/filtering",
+                                        style={
+                                            "text-decoration": "none",
+                                            "color": "blue",
+                                            "text-decoration": "underline",
+                                            "font-size": 12
+                                        }
+                                    )
+                                ),
+                                html.Details(
+                                    id="column-summary",
+                                    children=[html.Summary("Column Summary")],
+                                    style={"font-size": 12, "margin-bottom": "10px"}
+                                ),
+                                dash_table.DataTable(
+                                    id='datatable-interactivity',
+                                    columns=[],
+                                    data=[],
+                                    editable=True,
+                                    filter_action=table_backend,
+                                    sort_action=table_backend,
+                                    sort_mode='multi',
+                                    row_selectable=False,
+                                    row_deletable=False,
+                                    selected_rows=[],
+                                    page_action=table_backend,
+                                    page_current=0,
+                                    page_size=default_page_size,
+                                    virtualization=is_virtualized(default_page_size),
+                                    style_data=table_style_data,
+                                    style_data_conditional=[
+                                        {
+                                            'if': {'row_index': 'odd'},
+                                            'backgroundColor': '#3B4052',
+                                        }
+                                    ],
+                                    style_header={
+                                        'backgroundColor': '#2A2E3C',
+                                        # 'color': 'black',
+                                        'fontWeight': 'bold'
                                     }
-                                ],
-                                style_header={
-                                    'backgroundColor': '#2A2E3C',
-                                    # 'color': 'black',
-                                    'fontWeight': 'bold'
-                                }
-                            ),
-                            html.Div(id='datatable-interactivity-container'),
-                            dcc.Download(id="download"),
-                            dcc.Download(id="download-selected")
-                        ])
-                    ],
-                ),
-            ]
-        )])
+                                ),
+                                html.Div(id='datatable-interactivity-container'),
+                                dcc.Location(id="download-location", refresh=True),
+                                dcc.Download(id="download-selected"),
+                                dcc.Store(id="render-timing"),
+                                dcc.Store(id="session-id", data=ss.new_session_id())
+                            ])
+                        ],
+                    ),
+                ]
+            )])
+
+
+app.layout = serve_layout
 
 
 
 @app.callback(
-    Output("download", "data"),
+    Output("download-location", "href"),
     Input("download-filtered-data-button", "n_clicks"),
     State("data-path", "value"),
     State("dropdown-select-dataset", "value"),
+    State("sheet-select", "value"),
     State("group-by", "value"),
     State("aggregate", "value"),
-    State("datatable-interactivity", "data"),
-    State("datatable-interactivity", "derived_virtual_indices")
+    State("datatable-interactivity", "filter_query"),
+    State("datatable-interactivity", "sort_by"),
+    State("download-format", "value"),
+    State("session-id", "data")
 )
-def on_download_filter_data_button_pressed(n_clicks, path, file, group_by, aggregation_method, data, virtual_row_ids):
+@mt.instrument
+def on_download_filter_data_button_pressed(n_clicks, path, file, sheet, group_by, aggregation_method, filter_query, sort_by, fmt, session_id):
+    # The export is recomputed and streamed by the /export route, the browser only navigates to it
+    if(n_clicks is None or path is None or file is None):
+        raise PreventUpdate
+    file = dataset_file(file, sheet)
 
-    if(virtual_row_ids is not None):
-        virtual_row_ids = [int(id) for id in virtual_row_ids]
-    else:
+    export = {'path': path, 'file': file, 'group_by': group_by or [], 'aggregation': aggregation_method,
+              'filter_query': filter_query or "", 'sort_by': sort_by or []}
+    if(loads_in_background(os.path.join(path, file), export['group_by'], aggregation_method)):
+        raise PreventUpdate
+    try:
+        # Also warms query_frame's memo for the /export request that follows
+        export_frame(export)
+    except tq.FilterQueryError as e:
+        warn(str(e))
         raise PreventUpdate
+    session_store.update(session_id, export=export)
 
+    # n_clicks keeps the URL changing, so pressing the button again downloads again
+    return "/export?session=" + str(session_id) + "&format=" + str(fmt or "csv") + "&n=" + str(n_clicks)
+
+
+
+@app.callback(
+    Output("load-progress-container", "style"),
+    Output("load-progress", "value"),
+    Output("load-progress-text", "children"),
+    Output("load-refresh", "data"),
+    Input("load-progress-interval", "n_intervals"),
+    State("session-id", "data"),
+    State("load-refresh", "data")
+)
+@mt.instrument
+def on_progress_interval(n_intervals, session_id, load_token):
+    state = session_store.get(session_id)
+
+    # A finished (or failed / cancelled) load bumps the token, which re-runs the table and graph callbacks
+    refresh = state.get('load_token', 0)
+    if(refresh == (load_token or 0)):
+        refresh = dash.no_update
+
+    progress = state.get('progress')
+    if(progress is None):
+        return {"display": "none"}, 0, "", refresh
+    return {"display": "block"}, int(100 * progress['fraction']), progress['text'], refresh
 
-    if(data is None or len(data) == 0):
-        raise PreventUpdate
 
 
-    df_tmp = pd.DataFrame.from_dict(data).iloc[virtual_row_ids]
+@app.callback(
+    Output("auto-refresh-interval", "disabled"),
+    Input("auto-refresh", "value")
+)
+@mt.instrument
+def on_auto_refresh_toggle(auto_refresh):
+    return not auto_refresh or auto_refresh_seconds <= 0
 
-    # def extract_hyperlink(s):
-    #     hyperlinked_text_re = re.compile(r'\[(?P<HyperlinkedText>.+)\]\(https://www.amazon.com/dp/.*\)')
-    #     m = hyperlinked_text_re.match(str(s))
-    #     if (m is not None):
-    #         s = m.group("HyperlinkedText")
-    #     return s
 
-    #df_tmp = df_tmp.applymap(extract_hyperlink)
 
-    filename = file[:-4] + '___' + datetime.now().strftime("%Y_%m_%d_%H_%M_%S") + file[4:]
-    return dcc.send_data_frame(df_tmp.to_csv, filename)
+@app.callback(
+    Output("auto-refresh-ack", "data"),
+    Input("auto-refresh-interval", "n_intervals"),
+    State("table-view", "data"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+@mt.instrument
+def on_auto_refresh(n_intervals, view, session_id):
+    # The table keeps showing the current version while the new one loads in the background;
+    # load-refresh then re-runs on_select_data, which picks up the new version
+    if(view is None or view.get('status') != "ready" or session_store.get(session_id).get('load_job') is not None):
+        raise PreventUpdate
+    full_data_path = os.path.join(view['path'], view['file'])
+    try:
+        if(list(dc.file_key(full_data_path)) == view['version']):
+            raise PreventUpdate
+    except OSError:
+        raise PreventUpdate
+    start_load(session_id, view['path'], view['file'], view['group_by'], view['aggregation'], label="Refreshing ")
+    return n_intervals
+
+
+
+@app.callback(
+    Output("cancel-load-ack", "data"),
+    Input("cancel-load-button", "n_clicks"),
+    State("session-id", "data"),
+    prevent_initial_call=True
+)
+@mt.instrument
+def on_cancel_load(n_clicks, session_id):
+    cancelled = []
+
+    def cancel(state):
+        if(state.get('load_job') is None):
+            return None
+        cancelled.append(state['load_job'])
+        return dict(load_cancelled=state['load_job'], load_job=None, progress=None, load_token=state.get('load_token', 0) + 1)
+
+    # The job notices at its next chunk that no session is waiting for it any more
+    session_store.modify(session_id, cancel)
+    if(len(cancelled) == 0):
+        raise PreventUpdate
+    return n_clicks
 
 
 
@@ -454,146 +1116,432 @@ def on_download_filter_data_button_pressed(n_clicks, path, file, group_by, aggre
     [Input("data-path", "value"),
      Input("dropdown-select-dataset", "value")]
 )
+@mt.instrument
 def on_change_data_path(path, _):
     return get_file_path_options(path)
 
 
 
+@app.callback(
+    Output("sheet-select", "options"),
+    Output("sheet-select", "value"),
+    Output("sheet-select", "disabled"),
+    Input("data-path", "value"),
+    Input("dropdown-select-dataset", "value")
+)
+@mt.instrument
+def on_select_workbook(path, file):
+    # Sheet names only, read from the workbook part without parsing any sheet
+    if(not file or not xl.is_excel(file)):
+        return [[], None, True]
+    try:
+        sheets = xl.sheet_names(os.path.join(path or "", file))
+    except Exception as e:
+        warn("COULDN'T LIST SHEETS --- " + str(file) + " --- " + str(e))
+        return [[], None, True]
+    return [sheets, sheets[0] if len(sheets) > 0 else None, len(sheets) <= 1]
+
+
+
 
 @app.callback(
+    Output("table-view", "data"),
     Output("datatable-interactivity", "columns"),
-    Output("datatable-interactivity", "data"),
-    Output("datatable-interactivity", "derived_virtual_selected_rows"),
-    Output("datatable-interactivity", "page_current"),
-    Output("datatable-interactivity", "page_size"),
-    Output("data-title", "children"),
+    Output("datatable-interactivity", "selected_rows"),
     Output("group-by", "options"),
     Output("group-by", "value"),
     Output("aggregate", "options"),
     Output("aggregate", "value"),
     Output("download-filtered-data-button", "disabled"),
-    Output("data-filter-query", "children"),
     Output("datatable-interactivity", "filter_query"),
+    Output("datatable-interactivity", "sort_by"),
+    Output("column-summary", "children"),
+    Output("column-select", "options"),
+    Output("column-select", "value"),
     Input("data-path", "value"),
     Input("dropdown-select-dataset", "value"),
+    Input("sheet-select", "value"),
     Input("group-by", "value"),
     Input("aggregate", "value"),
-    Input('datatable-interactivity', "derived_virtual_data"),
-    Input('datatable-interactivity', "derived_virtual_selected_rows"),
-    Input("page-size-selection", "value"),
-    Input("datatable-interactivity", "page_size"),
-    Input("datatable-interactivity", "filter_query")
+    Input("load-refresh", "data"),
+    Input("fast-preview", "value"),
+    Input("column-select", "value"),
+    State("session-id", "data")
 )
-def on_select_data(path, file, group_by, aggregation_method, rows, derived_virtual_selected_rows, selected_page_size, table_page_size, filter_query):
-    global global_group_by
-    global global_agg
+@mt.instrument
+def on_select_data(path, file, sheet, group_by, aggregation_method, load_token, fast_preview, picked_columns, session_id):
+    # Picks the table's view (dataset, group-by, aggregation) and publishes its key to table-view.
+    # Rows are sent by on_table_view, so paging, sorting and filtering never come through here.
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if(file and xl.is_excel(file) and not sheet):
+        # Wait for on_select_workbook to pick the sheet
+        raise PreventUpdate
+    file = dataset_file(file, sheet)
+    if(path is None or file is None or not dataset_exists(os.path.join(path, file))):
+        raise PreventUpdate
+
+    state = session_store.get(session_id)
+
+    # Anything that has to read the file is loaded in the background, the view updates when load-refresh fires
+    full_data_path = os.path.join(path, file)
+    profile = column_profile(full_data_path)
+    blocked = blocked_group_by(profile, group_by)
+    if(len(blocked) > 0):
+        warn("TOO MANY DISTINCT VALUES TO GROUP BY --- " + str(blocked))
+        group_by = [c for c in group_by if c not in blocked]
+    load_group_by = [] if state.get('dataset') != full_data_path else group_by
+    status = "ready"
+    if(loads_in_background(full_data_path, load_group_by, aggregation_method)):
+        refresh_only = len(triggered) > 0 and all(t == 'load-refresh.data' for t in triggered)
+        if(refresh_only and state.get('load_cancelled') == load_key(full_data_path, load_group_by)):
+            data_title = "Cancelled Loading: " + str(file)
+        elif(refresh_only and state.get('load_error')):
+            data_title = "Couldn't Load: " + str(file) + " --- " + str(state['load_error'])
+        else:
+            start_load(session_id, path, file, load_group_by, aggregation_method)
+            data_title = "Loading: " + str(file)
+            # Show estimates from a sample until the exact results replace them on load-refresh
+            preview = get_preview_df(path, file, load_group_by, aggregation_method) if fast_preview else None
+            if(preview is not None):
+                status = "preview"
+        if(status != "preview"):
+            view = {'status': "loading", 'title': data_title}
+            return [view] + [dash.no_update] * 6 + [True] + [dash.no_update] * 5
+
+    selection_changed = str(state.get('group_by')) != str(group_by) or str(state.get('aggregation')) != str(aggregation_method)
+
+    if(status == "preview"):
+        df_tmp, df, total_rows = preview
+        new_df = False
+        session_store.update(session_id, group_by=group_by, aggregation=aggregation_method)
+        data_title = "Preview: " + str(file)
+        note = (" --- Estimated from a sample of " + "{:,}".format(len(df)) + " of ~" + "{:,}".format(total_rows) +
+                " rows (" + sp.ci_suffix.strip() + " columns are 95% confidence intervals), exact results are loading")
+    else:
+        df_tmp, new_df = get_filtered_df(path, file, group_by, aggregation_method, session_id=session_id)
+        df = load_dataset(full_data_path, session_id)
+        session_store.update(session_id, group_by=[] if new_df else group_by, aggregation=aggregation_method)
+        profile = column_profile(full_data_path)
+        data_title = "Examining: " + str(file)
+        note = ""
+    if(new_df):
+        group_by = []
+        aggregation_method = "Count"
+        picked_columns = default_columns(df)
 
-    if(str(global_group_by) != str(group_by) or str(global_agg) != str(aggregation_method)):
-        derived_virtual_selected_rows = []
+    if(is_streaming(full_data_path) and len(group_by or []) == 0):
+        note = " --- Preview of the first " + "{:,}".format(streaming_chunk_rows) + " rows, Group By to aggregate the whole file"
 
-    global_group_by = group_by
-    global_agg = aggregation_method
+    columns = visible_columns(df_tmp, df, group_by, picked_columns)
+    if(len(columns) < len(df_tmp.columns)):
+        note += " --- Showing " + str(len(columns)) + " of " + str(len(df_tmp.columns)) + " columns"
 
+    # The key of the cached frame on_table_view and update_graphs read, rather than the rows themselves
+    view = {'status': status, 'title': data_title, 'note': note, 'path': path, 'file': file,
+            'version': list(dc.file_key(full_data_path)), 'group_by': list(group_by or []),
+            'aggregation': aggregation_method, 'columns': columns}
 
-    df_tmp, new_df = get_filtered_df(path, file, group_by, aggregation_method)
+    return ([view, table_columns(df_tmp[columns]), [] if (new_df or selection_changed) else dash.no_update] +
+            reset_chart_x_dropdown(df, group_by, profile) + reset_aggregate(aggregation_method) + [status == "preview"] +
+            (["", []] if new_df else [dash.no_update] * 2) + [column_summary(profile)] +
+            ([list(df.columns), picked_columns] if new_df else [dash.no_update] * 2))
 
-    data_title = "Examining: " + str(file)
 
-    if(new_df):
-        filter_query = ""
+
+def default_columns(df):
+    # Picked in the Columns dropdown when a dataset opens: none (all shown) unless it's wider than max_visible_columns
+    if(max_visible_columns <= 0 or len(df.columns) <= max_visible_columns):
+        return []
+    return list(df.columns[:max_visible_columns])
+
+
+def visible_columns(df_tmp, df, group_by, picked_columns):
+    # The table columns left after the Columns dropdown: the Group By keys, the picked dataset columns and
+    # the columns an aggregation adds (Count's size, the ± intervals of picked columns in a preview).
+    # Hidden columns never leave the server, in the table pages or the bar plots.
+    picked = set(c for c in (picked_columns or []) if c in df.columns)
+    if(len(picked) == 0):
+        return list(df_tmp.columns)
+    picked.update(group_by or [])
+    columns = []
+    for c in df_tmp.columns:
+        base = c[:-len(sp.ci_suffix)] if isinstance(c, str) and c.endswith(sp.ci_suffix) else c
+        if(base in picked or base not in df.columns):
+            columns.append(c)
+    return columns
 
 
+def view_columns(df_tmp, view):
+    # df_tmp projected to the view's visible columns
+    columns = [c for c in view.get('columns') or [] if c in df_tmp.columns]
+    return df_tmp[columns] if 0 < len(columns) < len(df_tmp.columns) else df_tmp
+
+
+
+def view_frame(view):
+    # The frame behind a table-view key: (table frame, dataset frame), None while loading
+    if(view is None or view.get('status') not in ["ready", "preview"]):
+        return None
+    if(view['status'] == "preview"):
+        preview = get_preview_df(view['path'], view['file'], view['group_by'], view['aggregation'])
+        return None if preview is None else preview[:2]
+    full_data_path = os.path.join(view['path'], view['file'])
+    if(loads_in_background(full_data_path, view['group_by'], view['aggregation'])):
+        return None
+    df_tmp, _ = get_filtered_df(view['path'], view['file'], view['group_by'], view['aggregation'])
+    return df_tmp, load_dataset(full_data_path)
+
+
+
+@app.callback(
+    Output("table-page", "data"),
+    Output("datatable-interactivity", "page_current"),
+    Output("datatable-interactivity", "page_count"),
+    Output("data-title", "children"),
+    Output("data-filter-query", "children"),
+    Input("table-view", "data"),
+    Input("datatable-interactivity", "filter_query"),
+    Input("datatable-interactivity", "sort_by"),
+    Input("datatable-interactivity", "page_current"),
+    Input("datatable-interactivity", "page_size")
+)
+@mt.instrument
+def on_table_view(view, filter_query, sort_by, page_current, page_size):
+    # Sends the rows of the current view: only the requested page with the custom backend.
+    # Rows go out column-oriented (see utils/wire.py), the browser expands them into the table's records.
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if(view is None):
+        raise PreventUpdate
+    if(view['status'] not in ["ready", "preview"]):
+        return [dash.no_update] * 3 + [view['title'], dash.no_update]
+
     if(filter_query is not None and len(filter_query) > 0):
         data_filter_query_text = "Current Filter Query: " + str(filter_query)
     else:
         data_filter_query_text = ""
 
+    view_changed = any(t == 'table-view.data' for t in triggered)
+    if(table_backend == "native"):
+        # Paging, sorting and filtering are handled in the browser, which already has every row
+        if(not view_changed):
+            if(all(t.endswith(('.page_current', '.sort_by', '.page_size')) for t in triggered)):
+                raise PreventUpdate
+            return [dash.no_update] * 4 + [data_filter_query_text]
+    elif(not all(t.endswith('.page_current') for t in triggered)):
+        # Only keep the current page when the user is flipping pages
+        page_current = 0
+
+    frames = view_frame(view)
+    if(frames is None):
+        raise PreventUpdate
+    df_tmp = frames[0]
+
+    data_title = view['title']
+    if(table_backend == "custom"):
+        try:
+            with mt.timed("query"):
+                df_tmp = tq.query_frame(df_tmp, filter_query, sort_by, run=engine.query)
+        except tq.FilterQueryError as e:
+            warn(str(e))
+            data_filter_query_text = "Invalid Filter Query: " + str(e)
+        data_title += " (" + "{:,}".format(len(df_tmp)) + " rows)"
+    data_title += view.get('note', "")
+
+    # Hidden columns are dropped after filtering and sorting, which can still use them
+    df_tmp = view_columns(df_tmp, view)
+    return table_page(df_tmp, page_current, page_size) + [data_title, data_filter_query_text]
+
+
+
+app.clientside_callback(
+    wr.decode_js,
+    Output("datatable-interactivity", "data"),
+    Input("table-page", "data")
+)
+
+
+app.clientside_callback(
+    wr.render_timing_js,
+    Output("render-timing", "data"),
+    Input("datatable-interactivity", "data"),
+    State("datatable-interactivity", "virtualization"),
+    State("datatable-interactivity", "columns")
+)
 
-    if(new_df):
-        output = reset_table(df_tmp, table_page_size, selected_page_size, []) + [data_title] + reset_chart_x_dropdown(df) + reset_aggregate() + [False] + [data_filter_query_text] + [filter_query]
-    else:
-        output = reset_table(df_tmp, table_page_size, selected_page_size, selected_rows=derived_virtual_selected_rows) + [data_title] + reset_chart_x_dropdown(df, group_by) + reset_aggregate(aggregation_method) + [False] + [data_filter_query_text] + [filter_query]
 
 
-    return output
+@app.callback(
+    Output("datatable-interactivity", "page_size"),
+    Output("datatable-interactivity", "virtualization"),
+    Output("datatable-interactivity", "fixed_rows"),
+    Output("datatable-interactivity", "style_table"),
+    Output("datatable-interactivity", "style_cell"),
+    Output("datatable-interactivity", "style_data"),
+    Input("page-size-selection", "value"),
+    State("datatable-interactivity", "page_size")
+)
+@mt.instrument
+def set_page_size(new_page_size, old_page_size):
+    page_size = new_page_size if new_page_size else default_page_size
+    if (page_size == old_page_size):
+        raise PreventUpdate
+    return [page_size] + table_layout(page_size)
 
 
+def is_virtualized(page_size):
+    return virtualize_page_size > 0 and page_size >= virtualize_page_size
 
-# Output("datatable-interactivity", "columns"),
-# Output("datatable-interactivity", "data"),
-# Output("datatable-interactivity", "derived_virtual_selected_rows"),
-# Output("datatable-interactivity", "page_current"),
-# Output("datatable-interactivity", "page_size"),
-def reset_table(df, table_page_size, selected_page_size, selected_rows=[]):
 
-    page_size = selected_page_size
+def table_layout(page_size):
+    # [virtualization, fixed_rows, style_table, style_cell, style_data] of the DataTable.
+    # Virtualized pages only render the rows scrolled into view, which needs every row and
+    # column to keep one size: single-line cells of fixed height and width, cut with an ellipsis.
+    if(not is_virtualized(page_size)):
+        return [False, {}, {}, {}, table_style_data]
+    return [True, {'headers': True}, {'height': table_height, 'overflowY': 'auto'},
+            {'minWidth': column_width, 'width': column_width, 'maxWidth': column_width},
+            dict(table_style_data, whiteSpace='nowrap', height=row_height, lineHeight=row_height,
+                 overflow='hidden', textOverflow='ellipsis')]
 
 
-    columns=[
-                  {'name': i, 'id': i, 'deletable': False, 'type': table_type(df[i], i), 'presentation': 'markdown'} for i in df.columns
-                  # omit the id column
-                  # if i != 'id'
-              ]
-    data = df.to_dict('records')
-    selected_rows = selected_rows
-    page_current = 0
-    return [columns, data, selected_rows, page_current, page_size]
+
+markdown_link = re.compile(r"\[[^\]]*\]\([^)]+\)")
+link_sample_rows = 1000 # values of a text column checked for links
+
+
+def has_links(series):
+    # Whether a text column holds markdown links, e.g. "[report](https://...)", judged from a sample
+    if(table_type(series) != 'text'):
+        return False
+    if(isinstance(series.dtype, pd.CategoricalDtype)):
+        sample = pd.Series(series.cat.categories[:link_sample_rows])
+    else:
+        sample = series.iloc[:link_sample_rows].dropna()
+    return bool(sample.astype(str).str.contains(markdown_link).any())
+
+
+def table_columns(df):
+    # Only columns with links go through the markdown renderer, the others render as plain text
+    return [
+        dict({'name': i, 'id': i, 'deletable': False, 'type': table_type(df[i], i)},
+             **({'presentation': 'markdown'} if has_links(df[i]) else {})) for i in df.columns
+        # omit the id column
+        # if i != 'id'
+    ]
+
+
+    # Output("table-page", "data"),
+    # Output("datatable-interactivity", "page_current"),
+    # Output("datatable-interactivity", "page_count"),
+def table_page(df, page_current=0, page_size=None):
+    page_size = page_size if page_size else default_page_size
+
+    with mt.timed("records"):
+        if(table_backend == "custom"):
+            # df is already filtered and sorted, only send the requested page
+            df_page, page_current = tq.get_page(df, page_current, page_size)
+            data = wr.encode(df_page)
+            page_count = tq.page_count(len(df), page_size)
+        else:
+            data = wr.encode(df)
+            page_current = 0
+            page_count = None
+    return [data, page_current, page_count]
 
 
     # Output("group-by", "options"),
     # Output("group-by", "value")
-def reset_chart_x_dropdown(df=None, pass_through=[]):
+def reset_chart_x_dropdown(df=None, pass_through=[], profile=None):
     #options = [c for c in df.columns if table_type(df[c]) == 'text'] # If we only want to be able to group on categorical vars
-    options = list(df.columns)
+    if(profile is None):
+        return [list(df.columns), pass_through]
+
+    # Distinct counts come from the profile, high-cardinality columns are flagged or can't be picked
+    options = []
+    for c in df.columns:
+        column = profile['columns'].get(c)
+        if(column is None):
+            options.append({'label': str(c), 'value': c})
+            continue
+        distinct = cs.format_count(column['distinct'], column['distinct_exact'])
+        if(column['distinct'] > group_by_max_distinct):
+            options.append({'label': str(c) + " (" + distinct + " distinct, too many to group by)", 'value': c, 'disabled': True})
+        elif(column['distinct'] > group_by_warn_distinct):
+            options.append({'label': "\u26a0 " + str(c) + " (" + distinct + " distinct)", 'value': c})
+        else:
+            options.append({'label': str(c) + " (" + distinct + ")", 'value': c})
     return [options, pass_through]
 
 
 
-def reset_chart_y_dropdown(df=None):
-    options = [c for c in df.columns if table_type(df[c]) in ['numeric', 'any'] and 'date' not in str(df.dtypes[c])]
+def reset_chart_y_dropdown(df=None, profile=None):
+    if(profile is not None):
+        types = {c: (column['type'], column['dtype']) for c, column in profile['columns'].items()}
+    else:
+        types = {c: (table_type(df[c]), str(df.dtypes[c])) for c in df.columns}
+    options = [c for c in df.columns if c in types and types[c][0] in ['numeric', 'any'] and 'date' not in types[c][1]]
     return [options, []]
 
 
 
-def reset_aggregate(value="Count"):
-    options = ["Count", "Sum", "Mean", "Standard Deviation", "Variance", "Min", "Max"]
-    return [options, value]
+def column_summary(profile):
+    # Summary panel children, straight from the profile: no pass over the data
+    if(profile is None):
+        return [html.Summary("Column Summary")]
+    header = ["Column", "Type", "Missing", "Distinct", "Min", "Max", "Most Frequent"]
+    rows = []
+    for name, column in profile['columns'].items():
+        top = ", ".join(str(v) + " (" + "{:,}".format(n) + ")" for v, n in column['top'] or [])
+        rows.append(html.Tr([html.Td(str(name)), html.Td(column['type'] or column['dtype']),
+                             html.Td("{:,}".format(column['nulls'])),
+                             html.Td(cs.format_count(column['distinct'], column['distinct_exact'])),
+                             html.Td("" if column['min'] is None else str(column['min'])),
+                             html.Td("" if column['max'] is None else str(column['max'])),
+                             html.Td(top)]))
+    title = "Column Summary (" + "{:,}".format(profile['rows']) + " rows" + \
+            (", first chunk only" if profile.get('partial') else "") + ")"
+    return [html.Summary(title),
+            html.Table([html.Thead(html.Tr([html.Th(h) for h in header])), html.Tbody(rows)])]
 
 
 
+def reset_aggregate(value="Count"):
+    options = list(ac.methods)
+    return [options, value]
 
-def get_filtered_df(path, file, group_by, aggregation_method, add_hyperlinks=True):
-    global df
-    global df_path
 
-    try:
-        new_df = df_path != os.path.join(path, file)
-        df_path = os.path.join(path, file)
-    except:
-        new_df = False
 
+
+def get_filtered_df(path, file, group_by, aggregation_method, session_id=None, add_hyperlinks=True):
+    # With a session_id, new_df tells whether this session just switched datasets
     if (path is None or file is None):
         raise PreventUpdate
 
     full_data_path = os.path.join(path, file)
 
-    if (not os.path.exists(full_data_path) or
-            os.path.isdir(full_data_path)):
+    if (not dataset_exists(full_data_path)):
         raise PreventUpdate
 
+    if (session_id is not None):
+        new_df = session_store.get(session_id).get('dataset') != full_data_path
+        if (new_df):
+            session_store.update(session_id, dataset=full_data_path)
+    else:
+        new_df = False
+
     try:
         # If you know the data structure, do this
         # if ('order' in file):
-        #     df = read_df(full_data_path,
+        #     df = load_df(full_data_path,
         #                  dtype_dict=selected_orders_data_usable_cols_to_dtype,
         #                  col_order=selected_orders_data_usable_cols)
         # elif ('earning' in file):
-        #     df = read_df(full_data_path,
+        #     df = load_df(full_data_path,
         #                  dtype_dict=selected_earning_data_usable_cols_to_dtype,
         #                  col_order=selected_earning_data_usable_cols)
         # else:
-        #     df = read_df(full_data_path)
-        df = read_df(full_data_path)
+        #     df = load_df(full_data_path)
+        df = load_dataset(full_data_path, session_id)
     except:
         raise Exception("Cannot Load CSV File at: ", full_data_path)
 
@@ -609,20 +1557,14 @@ def get_filtered_df(path, file, group_by, aggregation_method, add_hyperlinks=Tru
 
     if (not (group_by is None or len(group_by) == 0) and
             not (aggregation_method is None or len(aggregation_method) == 0)):
-        if (aggregation_method == "Count"):
-            df_tmp = df.groupby(by=group_by, as_index=False).size()
-        elif (aggregation_method == "Mean"):
-            df_tmp = df.groupby(by=group_by, as_index=False).mean()
-        elif (aggregation_method == "Standard Deviation"):
-            df_tmp = df.groupby(by=group_by, as_index=False).std()
-        elif (aggregation_method == "Min"):
-            df_tmp = df.groupby(by=group_by, as_index=False).min()
-        elif (aggregation_method == "Max"):
-            df_tmp = df.groupby(by=group_by, as_index=False).max()
-        elif (aggregation_method == "Variance"):
-            df_tmp = df.groupby(by=group_by, as_index=False).var()
-        elif (aggregation_method == "Sum"):
-            df_tmp = df.groupby(by=group_by, as_index=False).sum()
+        # Every method for these keys is finalized on the first miss from one table of partial states,
+        # see utils/aggcache.py and utils/partialagg.py
+        def compute():
+            with mt.timed("aggregate", engine=engine.name):
+                states = dataset_states(full_data_path, df, group_by)
+            with mt.timed("finalize"):
+                return pa.aggregate(states, group_by, ac.methods, dtypes=df.dtypes)
+        df_tmp = aggregation_cache.get(dc.file_key(full_data_path), df, group_by, aggregation_method, compute=compute)
     else:
         df_tmp = df
 
@@ -633,127 +1575,123 @@ def get_filtered_df(path, file, group_by, aggregation_method, add_hyperlinks=Tru
 
 
 
+def dataset_states(full_data_path, df, group_by):
+    # Partial group-by states of the whole dataset. They're saved for each version of the file, so
+    # other worker processes and later runs finalize them instead of grouping the rows again.
+    key = dc.file_key(full_data_path)
+    states = pa.read_states(key, group_by, aggregation_state_dir)
+    if (states is not None):
+        return states
+
+    if (sh.is_sharded(full_data_path)):
+        # Merged from per-shard states, only new / changed shards are aggregated
+        states = sh.states(full_data_path, df, group_by)
+    elif (is_followed(full_data_path)):
+        # Rows seen before are merged from their states, only appended rows are aggregated
+        states = tl.states(full_data_path, df, group_by)
+    elif (is_streaming(full_data_path)):
+        # df is only a preview, aggregate the whole file: queried in place, or chunk by chunk
+        job = jobs.current_job()
+        progress = job_progress("Aggregating " + os.path.basename(full_data_path))
+        cancelled = job.cancelled if job is not None else None
+        if (engine.reads_files):
+            # None when DuckDB can't read the file
+            states = engine.file_states(full_data_path, group_by, progress=progress, cancelled=cancelled)
+        if (states is None):
+            states = ck.stream_states(full_data_path, group_by, streaming_chunk_rows, schema=ti.get_schema(full_data_path),
+                                      progress=progress, cancelled=cancelled)
+    if (states is None):
+        states = engine.partial_states(df, group_by)
+
+    pa.write_states(states, key, group_by, aggregation_state_dir)
+    return states
+
+
+
+def chart_frame(df_tmp, group_by, filter_query, sort_by, max_plot_bars):
+    # Only the rows that become bars: filtered / sorted like the table, then cut to max_plot_bars
+    try:
+        with mt.timed("query"):
+            dff = tq.query_frame(df_tmp, filter_query, sort_by, run=engine.query)
+    except tq.FilterQueryError:
+        dff = df_tmp
+    dff = dff.iloc[:max_plot_bars]
+
+    if(len(group_by) > 1):
+        chart_x_column = "___".join(group_by)
+        # Vectorized label of the group-by keys, e.g. "Luggage--Mobile"
+        labels = dff[group_by[0]].astype(str).str.cat([dff[c].astype(str) for c in group_by[1:]], sep='--')
+        dff = dff[[c for c in dff.columns if c not in group_by]].assign(**{chart_x_column: labels})
+    else:
+        chart_x_column = group_by[0]
+
+    return dff, chart_x_column
+
+
+
 @app.callback(
     Output('datatable-interactivity-container', "children"),
-    Input('datatable-interactivity', "derived_virtual_data"),
     Input('datatable-interactivity', "derived_virtual_selected_rows"),
-
-
-    Input("data-path", "value"),
-    Input("dropdown-select-dataset", "value"),
-    Input("group-by", "value"),
-    Input("aggregate", "value"),
-    Input("max-plot-bars", "value")
+    Input("table-view", "data"),
+    Input("max-plot-bars", "value"),
+    Input("datatable-interactivity", "filter_query"),
+    Input("datatable-interactivity", "sort_by")
 )
-def update_graphs(rows, derived_virtual_selected_rows, path, file, group_by, aggregation_method, max_plot_bars):
-    # When the table is first rendered, `derived_virtual_data` and
-    # `derived_virtual_selected_rows` will be `None`. This is due to an
-    # idiosyncrasy in Dash (unsupplied properties are always None and Dash
+@mt.instrument
+def update_graphs(derived_virtual_selected_rows, view, max_plot_bars, filter_query, sort_by):
+    # The bars are computed from the view's cached aggregate with the table's filter and sort
+    # applied server-side, rather than from derived_virtual_data posted back by the browser.
+    # When the table is first rendered, `derived_virtual_selected_rows` will be `None`.
+    # This is due to an idiosyncrasy in Dash (unsupplied properties are always None and Dash
     # calls the dependent callbacks when the component is first rendered).
-    # So, if `rows` is `None`, then the component was just rendered
-    # and its value will be the same as the component's dataframe.
-    # Instead of setting `None` in here, you could also set
-    # `derived_virtual_data=df.to_rows('dict')` when you initialize
-    # the component.
     try:
         if(max_plot_bars == 0):
             return []
 
-        if(group_by is None or len(group_by)==9 or
-           aggregation_method is None or len(group_by)==0):
+        group_by = (view or {}).get('group_by')
+        if(group_by is None or len(group_by) == 0):
             # NO CHILDREN
             return []
 
-        global df
-
-        df_tmp, new_df = get_filtered_df(path, file, group_by, aggregation_method)
+        # Still loading in the background, table-view changes again once it's done
+        frames = view_frame(view)
+        if(frames is None):
+            return []
+        df_tmp, df = frames
 
         if derived_virtual_selected_rows is None:
             derived_virtual_selected_rows = []
 
-        dff = df_tmp if rows is None else pd.DataFrame(rows)
-
-        if(len(group_by) > 1):
-            chart_x_column = "___".join(group_by)
-            dff[chart_x_column] = dff[group_by].agg('--'.join, axis=1)
-            dff = dff[[c for c in dff.columns if c not in group_by]]
-
-        else:
-            chart_x_column = group_by[0]
+        dff, chart_x_column = chart_frame(df_tmp, group_by, filter_query, sort_by, max_plot_bars)
+        # No plots of the columns hidden with the Columns dropdown
+        shown = set(view.get('columns') or df_tmp.columns)
 
 
         colors = ['#7FDBFF' if i in derived_virtual_selected_rows else '#0074D9'
                   for i in range(len(dff))]
 
-        figs = []
+        tick_size = mu.lerp(16, 12, min(len(dff), max_plot_bars)/max_num_bars)
+        x = dff[chart_x_column].to_numpy()
 
-        graphs = [
-            html.Div(
-                dcc.Graph(
-                    id=column,
-                    # figure={
-                    #     "data": [
-                    #         {
-                    #             "x": dff[chart_x_column][:max_plot_bars],
-                    #             "y": dff[column][:max_plot_bars],
-                    #             "type": "bar",
-                    #             "marker": {"color": colors},
-                    #         }
-                    #     ],
-                    #     "layout": {
-                    #         "xaxis": {"automargin": True},
-                    #         "yaxis": {
-                    #             "automargin": True,
-                    #             "title": {"text": column}
-                    #         },
-                    #         "height": 250,
-                    #         "margin": {"t": 100, "l": 10, "r": 10},
-                    #     },
-                    # },
-                    figure=go.Figure(
-                        data=px.bar(
-                            pd.DataFrame.from_dict(
-                                                        {
-                                                            chart_x_column: dff[chart_x_column][:max_plot_bars],
-                                                            column: dff[column][:max_plot_bars]
-                                                        }
-                                                   ),
-                            x=chart_x_column,
-                            y=column,
-                            #x=dff[chart_x_column][:max_plot_bars],
-                            #y=dff[column][:max_plot_bars],
-                            #width=[0.8, 0.8, 0.8, 3.5, 4] # customize width here,
-                            color_discrete_sequence=colors[:max_plot_bars],
-                            title=column
-                        )
-                    )
-                ),
-                style={'marginBottom': 50, 'marginTop': 25}
-            )
-            # check if column exists - user may have deleted it
-            # If `column.deletable=False`, then you don't
-            # need to do this check.
-
-            for column in list(dict.fromkeys(list(df.columns) + ['size', 'count'])) if
-            ((column in dff.columns and table_type(dff[column]) in ['numeric', 'any']) or
-            (column in dff.columns and column == ['size', 'count'])) and
-            column not in group_by
-        ]
-
-        for fig in [g.children.figure for g in graphs]:
-            #print(type(fig))
-            fig.update_layout({
-                'plot_bgcolor': 'rgba(0, 0, 0, 0)',
-                'paper_bgcolor': 'rgba(0, 0, 0, 0)',
-                'font_family': "Arial",
-                'font_color': "#a5b1cd",
-                'font_size': 20,
-                'title_font_color': "#a5b1cd",
-                'legend_title_font_color': "#a5b1cd"
-            },
-            xaxis={'tickfont': {'size': mu.lerp(16, 12, min(len(dff), max_plot_bars)/max_num_bars)}},
-            title={'x': 0.5, 'xanchor': 'center'}
-            )
+        with mt.timed("figures"):
+            graphs = [
+                html.Div(
+                    dcc.Graph(
+                        id=column,
+                        figure=fg.bar_figure(x, dff[column].to_numpy(), chart_x_column, column, colors, tick_size,
+                                             error=dff[column + sp.ci_suffix].to_numpy() if column + sp.ci_suffix in dff.columns else None)
+                    ),
+                    style={'marginBottom': 50, 'marginTop': 25}
+                )
+                # check if column exists - user may have deleted it
+                # If `column.deletable=False`, then you don't
+                # need to do this check.
+
+                for column in list(dict.fromkeys(list(df.columns) + ['size', 'count'])) if
+                ((column in dff.columns and table_type(dff[column]) in ['numeric', 'any']) or
+                (column in dff.columns and column == ['size', 'count'])) and
+                column not in group_by and column in shown
+            ]
 
     except Exception as e:
         print("\n\n\n")
@@ -768,14 +1706,47 @@ def update_graphs(rows, derived_virtual_selected_rows, path, file, group_by, agg
 
 
 
-#     Output('datatable-interactivity', "page_current"),
-#     Output('datatable-interactivity', 'page_size'),
-#     Input("page-size-selection", "value"),
-#     Input('datatable-interactivity', 'page_size')
-def set_page_size(new_page_size, old_page_size):
-    if (new_page_size == old_page_size):
-        raise PreventUpdate
-    return 0, new_page_size
+#########################################################################################################################
+# DEPLOYMENT
+
+
+
+def preload(paths=None):
+    # Loads datasets (and their column profiles) into the cache and pins them there. Run in the
+    # master of a preforking server (see gunicorn.conf.py), the workers forked afterwards share the
+    # frames' memory copy-on-write, and memory-mapped Feather sidecars through the page cache,
+    # rather than each loading its own copy.
+    start = time.perf_counter()
+    for full_data_path in preload_datasets if paths is None else paths:
+        try:
+            with mt.timed("preload"):
+                dataset_cache.acquire(full_data_path, load_and_catalog)
+                column_profile(full_data_path)
+        except Exception as e:
+            warn("COULDN'T PRELOAD --- " + str(full_data_path) + " --- " + str(e))
+    # Objects created so far are left out of garbage collection, which would otherwise write to
+    # their headers and copy every page they're on into each worker
+    gc.freeze()
+    startup_seconds["preload"] = time.perf_counter() - start
+
+
+def after_fork():
+    # In a forked worker: threads started by the parent didn't come along, so its thread pools,
+    # catalog watcher and DuckDB connection are replaced by fresh ones
+    global engine, load_jobs, catalogs
+    engine = en.get_engine(query_engine)
+    load_jobs = jobs.JobQueue(load_worker_threads)
+    catalogs = cg.CatalogRegistry(recursive=catalog_recursive, poll_seconds=catalog_poll_seconds)
+    sh.forget_pool()
+    xl.forget_pool()
+
+
+startup_seconds = {"import": time.perf_counter() - import_start}
+mt.gauge("startup_seconds", "Time to import the app and to preload datasets, in the process that did it",
+         lambda: {(("stage", stage),): seconds for stage, seconds in startup_seconds.items()})
+mt.gauge("process_memory_bytes", "Memory of this worker process, shared with the other workers or private to it",
+         lambda: {(("kind", kind),): value for kind, value in mt.process_memory().items()})
+
 
 
 def open_browser():
@@ -785,8 +1756,10 @@ def open_browser():
         warn("Couldn't automatically open browser window --- Please open a browser window and navigate to" + \
              " http://localhost:8050 in order to use the application")
 
-# Running the server
+# Running the server, for development and single users. Production servers run `server` under
+# gunicorn instead, see gunicorn.conf.py, and never open a browser.
 if __name__ == "__main__":
+    preload()
     Timer(1, open_browser).start()
     app.run_server(debug=False)
 
@@ -0,0 +1,30 @@
+# Production server for the app, several worker processes sharing preloaded datasets:
+#
+#   DATA_EXPLORER_PRELOAD=/data/sales.csv,/data/orders.xlsx::2026 gunicorn -c gunicorn.conf.py app:server
+#
+# The app is imported once in the master (preload_app), which then loads the DATA_EXPLORER_PRELOAD
+# datasets before forking the workers, so they start with the datasets in memory they share
+# copy-on-write. Workers are threaded: callbacks waiting on pandas / DuckDB release the GIL and
+# downloads stream while the other threads answer callbacks.
+
+import os
+
+bind = os.environ.get("DATA_EXPLORER_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("DATA_EXPLORER_WORKERS", min(4, os.cpu_count() or 1)))
+worker_class = "gthread"
+threads = int(os.environ.get("DATA_EXPLORER_WORKER_THREADS", 8))
+timeout = int(os.environ.get("DATA_EXPLORER_WORKER_TIMEOUT", 300))  # Large files load in the background, but Group Bys on loaded data run in the callback
+preload_app = True
+
+
+def when_ready(server):
+    # In the master, after preload_app imported the app and before any worker is forked
+    import app
+    app.preload()
+    server.log.info("Imported the app in %.2f s, preloaded %d dataset(s) in %.2f s",
+                    app.startup_seconds["import"], len(app.preload_datasets), app.startup_seconds["preload"])
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork()
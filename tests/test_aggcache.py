@@ -0,0 +1,13 @@
+import numpy as np
+import pandas as pd
+
+import utils.aggcache as ac
+
+
+def test_categorical_extremes_of_all_missing_group():
+    df = pd.DataFrame({"k": ["a", "a", "b"], "c": pd.Categorical(["x", "y", None], categories=["x", "y", "z"])})
+    for method, expected in [("Min", "x"), ("Max", "y")]:
+        result = ac.aggregate(df, ["k"], [method])[method].sort_values("k").reset_index(drop=True)
+        assert result["c"][0] == expected
+        # No value in group b: missing, not the last category
+        assert pd.isna(result["c"][1])
@@ -0,0 +1,64 @@
+import os
+
+import utils.catalog as cat
+
+
+def _touch_dir(path, seconds):
+    # Explicit mtimes, filesystem timestamp granularity could hide a change made in the same tick
+    os.utime(path, ns=(seconds * 10**9, seconds * 10**9))
+
+
+def _names(catalog):
+    return [e["name"] for e in catalog.files()]
+
+
+def test_scan_relists_only_changed_directories(tmp_path):
+    (tmp_path / "a.csv").write_text("x\n1\n")
+    (tmp_path / "notes.txt").write_text("skip")
+    _touch_dir(tmp_path, 1000)
+    catalog = cat.DirectoryCatalog(str(tmp_path))
+    assert catalog.scan() is True
+    assert _names(catalog) == ["a.csv"]
+    assert catalog.scan() is False
+
+    (tmp_path / "b.xlsx").write_bytes(b"")
+    _touch_dir(tmp_path, 2000)
+    assert catalog.scan() is True
+    assert _names(catalog) == ["a.csv", "b.xlsx"]
+
+    os.remove(tmp_path / "a.csv")
+    _touch_dir(tmp_path, 3000)
+    assert catalog.scan() is True
+    assert _names(catalog) == ["b.xlsx"]
+
+
+def test_recorded_counts_reset_when_file_is_rewritten(tmp_path):
+    path = tmp_path / "a.csv"
+    path.write_text("x\n1\n")
+    _touch_dir(tmp_path, 1000)
+    catalog = cat.DirectoryCatalog(str(tmp_path))
+    catalog.scan()
+    catalog.record(str(path), rows=1, columns=1, dtypes={"x": "int64"})
+    assert catalog.files()[0]["rows"] == 1
+
+    path.write_text("x\n1\n2\n3\n")
+    os.utime(path, ns=(5000 * 10**9, 5000 * 10**9))
+    _touch_dir(tmp_path, 2000)
+    catalog.scan()
+    entry = catalog.files()[0]
+    assert entry["rows"] is None and entry["size"] == os.path.getsize(path)
+
+
+def test_recursive_catalog_follows_subdirectories(tmp_path):
+    sub = tmp_path / "sub"
+    sub.mkdir()
+    (sub / "c.csv").write_text("x\n1\n")
+    catalog = cat.DirectoryCatalog(str(tmp_path), recursive=True)
+    catalog.scan()
+    assert _names(catalog) == [os.path.join("sub", "c.csv")]
+    assert catalog.files(search="C.CSV") and not catalog.files(pattern="*.xlsx")
+
+    (sub / "c.csv").unlink()
+    sub.rmdir()
+    catalog.scan()
+    assert _names(catalog) == []
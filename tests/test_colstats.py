@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.colstats as cs
+
+
+@pytest.mark.parametrize("distinct", [10, 1000, 50000, 400000])
+def test_hyperloglog_estimate_within_error(distinct):
+    values = pd.Series(np.arange(distinct) * 7919 % 1000003).astype(str)
+    estimate = cs.HyperLogLog().add(values).count()
+    # Standard error with 2^14 registers is about 0.8%, allow four of them
+    assert abs(estimate - distinct) <= max(2, 0.033 * distinct)
+
+
+def test_hyperloglog_ignores_duplicates_and_nulls():
+    values = pd.Series(np.tile(np.arange(5000, dtype=np.float64), 20))
+    values[::3] = np.nan
+    assert cs.HyperLogLog().add(values).count() == pytest.approx(5000, rel=0.033)
+
+
+def test_hyperloglog_merge_equals_single_pass():
+    values = pd.Series(np.arange(200000))
+    whole = cs.HyperLogLog().add(values)
+    parts = cs.HyperLogLog().add(values[:120000]).merge(cs.HyperLogLog().add(values[80000:]))
+    assert np.array_equal(whole.registers, parts.registers)
+    assert parts.count() == whole.count()
+
+
+def test_distinct_count_switches_to_estimate(monkeypatch):
+    series = pd.Series(np.arange(3000) % 2000)
+    assert cs.distinct_count(series) == (2000, True)
+    monkeypatch.setattr(cs, "exact_rows", 1000)
+    count, exact = cs.distinct_count(series)
+    assert not exact and count == pytest.approx(2000, rel=0.033)
+    assert cs.distinct_count(series.astype("category")) == (2000, True)
+
+
+def test_profile_column():
+    series = pd.Series([3, 1, None, 3, 2], name="n")
+    profile = cs.profile_column(series)
+    assert (profile["nulls"], profile["distinct"], profile["min"], profile["max"]) == (1, 3, 1.0, 3.0)
+    assert profile["top"][0] == [3.0, 2]
@@ -0,0 +1,64 @@
+import threading
+import time
+
+import utils.datacache as dc
+
+
+def _files(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / ("f" + str(i) + ".csv")
+        path.write_text("x\n" + str(i) + "\n")
+        paths.append(str(path))
+    return paths
+
+
+def test_concurrent_gets_load_once_and_drop_their_lock(tmp_path):
+    path = _files(tmp_path, 1)[0]
+    cache = dc.DatasetCache(max_bytes=10 ** 9, sizeof=lambda v: 1)
+    calls = []
+
+    def loader(p):
+        calls.append(p)
+        time.sleep(0.2)
+        return "loaded"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(path, loader))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["loaded"] * 4 and calls == [path]
+    assert cache._loading == {}
+
+
+def test_loading_locks_dont_accumulate(tmp_path):
+    cache = dc.DatasetCache(max_bytes=10 ** 9, sizeof=lambda v: 1)
+    paths = _files(tmp_path, 51)
+    for path in paths[:50]:
+        cache.get(path, lambda p: p)
+    # A failed load too
+    try:
+        cache.get(paths[50], lambda p: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    assert cache._loading == {}
+
+
+def test_pinned_entries_are_never_evicted(tmp_path):
+    a, b, c = _files(tmp_path, 3)
+    cache = dc.DatasetCache(max_bytes=1, sizeof=lambda v: 1)
+    cache.acquire(a, lambda p: "a")
+    cache.acquire(b, lambda p: "b")
+    # Both pinned: over budget rather than evicting one of them
+    assert cache.contains(a) and cache.contains(b)
+    assert cache.current_bytes == 2 and cache.evictions == 0
+
+    cache.get(c, lambda p: "c")
+    assert cache.contains(a) and cache.contains(b) and cache.contains(c)
+
+    # Once a is released, unpinned entries are evicted down to the budget
+    cache.release(a)
+    assert [cache.contains(p) for p in (a, b, c)] == [False, True, False]
+    assert cache.current_bytes == 1
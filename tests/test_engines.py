@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+import utils.engines as en
+import utils.partialagg as pa
+
+duckdb = pytest.importorskip("duckdb")
+
+
+def test_file_states_reads_latin1(tmp_path):
+    path = tmp_path / "latin1.csv"
+    path.write_bytes("k,v\ncafé,1\nnaïve,2\ncafé,3\n".encode("latin-1"))
+    states = en.DuckDBEngine().file_states(str(path), ["k"])
+    result = pa.finalize(states, "Sum", ["k"]).sort_values("k")
+    assert result["k"].tolist() == ["café", "naïve"]
+    assert result["v"].tolist() == [4, 2]
+
+
+def test_file_states_returns_none_when_duckdb_fails(tmp_path, monkeypatch):
+    path = tmp_path / "data.csv"
+    path.write_bytes(b"k,v\na,1\nb,2\n")
+    monkeypatch.setattr(en, "csv_encoding", "no-such-encoding")
+    assert en.DuckDBEngine().file_states(str(path), ["k"]) is None
+
+
+def test_benchmark_times_frame_and_file_states(tmp_path):
+    path = tmp_path / "data.csv"
+    df = pd.DataFrame({"k": ["a", "b", "a"], "v": [1, 2, 3]})
+    df.to_csv(path, index=False)
+    results = en.benchmark(df, [["k"]], engine_names=["pandas", "duckdb"], repeat=1, path=str(path))
+    assert [(r["engine"], r["source"]) for r in results] == [("pandas", "frame"), ("duckdb", "frame"), ("duckdb", "file")]
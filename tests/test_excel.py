@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.excel as xl
+
+
+def test_empty_cells_become_missing_not_the_value_above():
+    # Rows the way calamine returns them, empty cells as ""
+    df = xl._frame([["name", "n", "note"], ["a", 1.0, "first"], ["", "", ""], ["c", 3.0, ""]])
+    assert df["name"].tolist()[0] == "a" and pd.isna(df["name"][1])
+    assert pd.isna(df["n"][1]) and df["n"].dtype == np.float64
+    assert df["note"][0] == "first" and df["note"][1:].isna().all()
+
+
+def test_openpyxl_sheet_matches_read_excel(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    path = str(tmp_path / "book.xlsx")
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for row in [["name", "n"], ["a", 1], [None, None], ["c", 3]]:
+        ws.append(row)
+    wb.save(path)
+    pd.testing.assert_frame_equal(xl.parse_sheet(path, reader="openpyxl"), pd.read_excel(path))
@@ -0,0 +1,52 @@
+import gzip
+import io
+
+import pandas as pd
+import pytest
+
+import utils.export as ex
+import utils.session as ss
+
+
+def test_csv_export_has_no_index_column():
+    df = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]}, index=[10, 20, 30])
+    text = b"".join(ex.iter_csv(df, chunk_rows=2)).decode("utf-8")
+    assert text.splitlines()[0] == "a,b"
+    pd.testing.assert_frame_equal(pd.read_csv(io.StringIO(text)), df.reset_index(drop=True))
+
+
+def _streamed_export(monkeypatch, tmp_path, fmt, **export):
+    app = pytest.importorskip("app")
+    # Every CSV streams, with a preview of 10 rows
+    monkeypatch.setattr(app, "streaming_threshold_bytes", 0)
+    monkeypatch.setattr(app, "streaming_chunk_rows", 10)
+    monkeypatch.setattr(app, "export_chunk_rows", 7)
+    df = pd.DataFrame({"k": ["a", "b", "c"] * 20, "v": range(60)})
+    df.to_csv(tmp_path / "big.csv", index=False)
+
+    session_id = ss.new_session_id()
+    app.session_store.update(session_id, export=dict({"path": str(tmp_path), "file": "big.csv", "group_by": [],
+                                                      "aggregation": None, "filter_query": "", "sort_by": []}, **export))
+    response = app.server.test_client().get("/export?session=" + session_id + "&format=" + fmt)
+    assert response.status_code == 200
+    return df, response
+
+
+@pytest.mark.parametrize("fmt", ["csv", "csv.gz", "parquet"])
+def test_streamed_dataset_exports_whole_file_filtered(monkeypatch, tmp_path, fmt):
+    df, response = _streamed_export(monkeypatch, tmp_path, fmt, filter_query="{k} = b")
+    data = response.get_data()
+    if fmt == "parquet":
+        exported = pd.read_parquet(io.BytesIO(data))
+    else:
+        exported = pd.read_csv(io.BytesIO(gzip.decompress(data) if fmt == "csv.gz" else data))
+    expected = df[df["k"] == "b"].reset_index(drop=True)
+    pd.testing.assert_frame_equal(exported, expected, check_dtype=False)
+    assert "_first_" not in response.headers["Content-Disposition"]
+
+
+def test_sorted_streamed_dataset_exports_labelled_preview(monkeypatch, tmp_path):
+    df, response = _streamed_export(monkeypatch, tmp_path, "csv", sort_by=[{"column_id": "v", "direction": "desc"}])
+    exported = pd.read_csv(io.BytesIO(response.get_data()))
+    assert exported["v"].tolist() == list(range(9, -1, -1))
+    assert "_first_10_rows.csv" in response.headers["Content-Disposition"]
@@ -0,0 +1,57 @@
+import threading
+
+import utils.jobs as jb
+
+
+def _chunked_work(started, release, chunks=100):
+    # Reports progress and checks for cancellation between chunks like a streamed load
+    def fn():
+        job = jb.current_job()
+        started.set()
+        for i in range(chunks):
+            release.wait(5)
+            job.raise_if_cancelled()
+            job.report((i + 1) / chunks)
+        return "loaded"
+    return fn
+
+
+def test_cancel_stops_job_between_chunks():
+    queue = jb.JobQueue(max_workers=1)
+    started, release, finished = threading.Event(), threading.Event(), []
+    job = queue.submit("k", _chunked_work(started, release), session_id="s", on_done=finished.append)
+    assert started.wait(5)
+    job.cancel()
+    release.set()
+    job.future.result(5)
+    assert job.error == "cancelled"
+    assert finished == [job]
+    assert job.fraction < 1.0
+    assert len(queue) == 0
+
+
+def test_check_cancels_once_no_session_waits():
+    queue = jb.JobQueue(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+    job = queue.submit("k", _chunked_work(started, release), session_id="s",
+                       check=lambda job: len(job.sessions) == 0)
+    assert started.wait(5)
+    job.sessions.discard("s")
+    release.set()
+    job.future.result(5)
+    assert job.error == "cancelled"
+
+
+def test_same_key_attaches_to_in_flight_job_and_cancelled_one_is_replaced():
+    queue = jb.JobQueue(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+    job = queue.submit("k", _chunked_work(started, release), session_id="a")
+    assert queue.submit("k", _chunked_work(threading.Event(), release), session_id="b") is job
+    assert job.sessions == {"a", "b"}
+
+    job.cancel()
+    again = queue.submit("k", _chunked_work(threading.Event(), release, chunks=1), session_id="c")
+    assert again is not job
+    release.set()
+    assert again.future.result(5) == "loaded" and again.error is None
+    assert job.error == "cancelled"
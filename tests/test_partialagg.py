@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+import utils.aggcache as ac
+import utils.chunked as ck
+import utils.partialagg as pa
+
+
+def _sorted(df, group_by):
+    return df.sort_values(group_by).reset_index(drop=True)
+
+
+def test_merge_states_disjoint_keys_with_text_column():
+    first = pd.DataFrame({"k": ["a", "a"], "t": ["x", "y"], "v": [1, 2]})
+    second = pd.DataFrame({"k": ["b", "a"], "t": ["z", "a"], "v": [3, 0]})
+    states = pa.merge_states(pa.partial_states(first, ["k"]), pa.partial_states(second, ["k"]))
+    expected = ac.aggregate(pd.concat([first, second], ignore_index=True), ["k"], ["Min", "Max"])
+    for method in ["Min", "Max"]:
+        result = _sorted(pa.finalize(states, method, ["k"]), ["k"])
+        assert result["t"].tolist() == _sorted(expected[method], ["k"])["t"].tolist()
+        assert result["v"].tolist() == _sorted(expected[method], ["k"])["v"].tolist()
+
+
+def test_merge_states_mixed_types_across_pieces():
+    first = pd.DataFrame({"k": ["a", "b"], "t": [5, 7]})
+    second = pd.DataFrame({"k": ["a", "c"], "t": ["q", "r"]})
+    states = pa.merge_states(pa.partial_states(first, ["k"]), pa.partial_states(second, ["k"]))
+    result = _sorted(pa.finalize(states, "Max", ["k"]), ["k"])
+    assert result["t"].tolist() == ["q", 7, "r"]
+
+
+def test_stream_states_key_first_seen_in_later_chunk(tmp_path):
+    path = str(tmp_path / "stream.csv")
+    df = pd.DataFrame({"k": ["a"] * 6 + ["b"] * 3, "t": list("uvwxyzabc"), "v": np.arange(9)})
+    df.to_csv(path, index=False)
+    states = ck.stream_states(path, ["k"], chunk_rows=4)
+    expected = ac.aggregate(df, ["k"])
+    for method in ac.methods:
+        result = _sorted(pa.finalize(states, method, ["k"]), ["k"])
+        reference = _sorted(expected[method], ["k"])
+        for c in reference.columns:
+            if pd.api.types.is_numeric_dtype(reference[c].dtype):
+                np.testing.assert_allclose(result[c].astype(float), reference[c].astype(float))
+            else:
+                assert result[c].tolist() == reference[c].tolist()
@@ -0,0 +1,30 @@
+import threading
+
+import utils.session as ss
+
+
+def _hammer(store, session_id, key, count):
+    for i in range(count):
+        store.update(session_id, **{key: i})
+
+
+def test_concurrent_updates_keep_every_key(tmp_path):
+    for directory in [None, str(tmp_path)]:
+        store = ss.SessionStore(directory)
+        session_id = ss.new_session_id()
+        threads = [threading.Thread(target=_hammer, args=(store, session_id, "key" + str(t), 200)) for t in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert store.get(session_id) == {"key" + str(t): 199 for t in range(4)}
+
+
+def test_modify_only_writes_when_the_check_holds():
+    store = ss.SessionStore()
+    session_id = ss.new_session_id()
+    store.update(session_id, load_job="new")
+    store.modify(session_id, lambda state: {"load_job": None} if state.get("load_job") == "old" else None)
+    assert store.get(session_id)["load_job"] == "new"
+    store.modify(session_id, lambda state: {"load_job": None} if state.get("load_job") == "new" else None)
+    assert store.get(session_id)["load_job"] is None
@@ -0,0 +1,32 @@
+import pandas as pd
+
+import utils.partialagg as pa
+import utils.shards as sh
+import utils.typeinfer as ti
+
+
+def _read(path):
+    df = pd.read_csv(path)
+    return df.assign(v=ti.downcast_numeric(df["v"]))
+
+
+def test_load_widens_then_narrows_numbers(tmp_path):
+    pd.DataFrame({"k": ["a", "b"], "v": [1, 2]}).to_csv(tmp_path / "o_1.csv", index=False)
+    pd.DataFrame({"k": ["c", "a"], "v": [100000, 3]}).to_csv(tmp_path / "o_2.csv", index=False)
+    path = str(tmp_path / "o_*.csv")
+    df = sh.load(path, _read)
+    assert df["v"].tolist() == [1, 2, 100000, 3]
+    assert str(df["v"].dtype) == "int32"
+
+    # The second file brings a new key
+    result = pa.finalize(sh.states(path, df, ["k"]), "Sum", ["k"]).sort_values("k")
+    assert result["v"].tolist() == [4, 2, 100000]
+
+
+def test_file_with_glob_characters_is_not_sharded(tmp_path):
+    path = tmp_path / "report[1].csv"
+    pd.DataFrame({"k": ["a"], "v": [1]}).to_csv(path, index=False)
+    assert not sh.is_sharded(str(path))
+    assert sh.exists(str(path))
+    assert sh.is_sharded(str(tmp_path / "report[0-9].csv"))
+    assert sh.is_sharded(str(tmp_path))
@@ -0,0 +1,71 @@
+import duckdb
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.table_query as tq
+
+
+def _frame():
+    return pd.DataFrame({
+        "name": ["Alpha", "beta", None, "Gamma ray", "", "delta"],
+        "n": [1.0, 2.0, np.nan, 4.0, 5.0, 6.0],
+        "flag": [True, False, True, False, True, False],
+        "day": pd.to_datetime(["2026-01-01", "2026-01-15", None, "2026-02-01", "2026-03-01", "2026-03-02"]),
+        "col with space": [1, 2, 3, 4, 5, 6],
+    })
+
+
+queries = [
+    ("{n} > 2", [3, 4, 5]),
+    ("{n} >= 2 && {n} < 5", [1, 3]),
+    ("{n} = 1 || {n} eq 6", [0, 5]),
+    ("{n} != 2", [0, 2, 3, 4, 5]),
+    ("{name} contains a", [0, 1, 3, 5]),
+    ("{name} icontains ALPHA", [0]),
+    ("{name} = 'Alpha'", [0]),
+    ("{name} ieq 'ALPHA'", [0]),
+    ("{name} is blank", [2, 4]),
+    ("{name} is nil", [2]),
+    ("!({n} > 2)", [0, 1, 2]),
+    ("{n} is even", [1, 3, 5]),
+    ("{day} datestartswith 2026-03", [4, 5]),
+    ("{day} > 2026-01-20", [3, 4, 5]),
+    ("{col with space} < 3 and {flag} = True", [0]),
+    ("{name} > 'b'", [1, 5]),
+]
+
+
+@pytest.mark.parametrize("query,expected", queries)
+def test_filter_mask(query, expected):
+    df = _frame()
+    assert np.flatnonzero(tq.filter_mask(df, query).to_numpy()).tolist() == expected
+
+
+@pytest.mark.parametrize("query,expected", queries)
+def test_filter_sql_matches_mask(query, expected):
+    df = _frame()
+    con = duckdb.connect()
+    con.register("t", df.assign(_row=np.arange(len(df))))
+    rows = con.execute("SELECT _row FROM t WHERE " + tq.filter_sql(df, query) + " ORDER BY _row").fetchall()
+    assert [r[0] for r in rows] == expected
+
+
+def test_sql_quotes_identifiers_and_literals():
+    df = pd.DataFrame({'we"ird': ["it's"]})
+    sql = tq.filter_sql(df, '{we"ird} = "it\'s"')
+    assert '"we""ird"' in sql and "'it''s'" in sql
+
+
+@pytest.mark.parametrize("query", ["{n} >", "{missing} = 1", "({n} > 1", "{n} ~ 1", "n > 1", "{n} is weird"])
+def test_invalid_queries_raise(query):
+    with pytest.raises(tq.FilterQueryError):
+        tq.filter_mask(_frame(), query)
+
+
+def test_sort_and_page():
+    df = _frame()
+    result = tq.apply_sort(df, [{"column_id": "n", "direction": "desc"}])
+    assert result["n"].tolist()[:5] == [6.0, 5.0, 4.0, 2.0, 1.0] and pd.isna(result["n"].iloc[-1])
+    page, current = tq.get_page(result, 9, 4)
+    assert current == 1 and len(page) == 2
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+import utils.aggcache as ac
+import utils.partialagg as pa
+import utils.tail as tl
+
+
+def _read(path):
+    return pd.read_csv(path, encoding=tl.encoding)
+
+
+def test_append_with_new_group_key(tmp_path):
+    path = str(tmp_path / "log.csv")
+    pd.DataFrame({"k": ["a", "a", "b"], "t": ["x", "y", "z"], "v": [1, 2, 3]}).to_csv(path, index=False)
+    df = tl.load(path, _read)
+    assert tl.follows(path, df)
+    tl.states(path, df, ["k"])
+
+    with open(path, "a") as f:
+        f.write("c,w,10\na,q,-4\n")
+    grown = tl.load(path, _read, previous=df)
+    assert len(grown) == 5 and tl.follows(path, grown)
+
+    states = tl.states(path, grown, ["k"])
+    expected = ac.aggregate(_read(path), ["k"])
+    for method in ac.methods:
+        result = pa.finalize(states, method, ["k"]).sort_values("k").reset_index(drop=True)
+        reference = expected[method].sort_values("k").reset_index(drop=True)
+        for c in reference.columns:
+            if pd.api.types.is_numeric_dtype(reference[c].dtype):
+                np.testing.assert_allclose(result[c].astype(float), reference[c].astype(float))
+            else:
+                assert result[c].astype(str).tolist() == reference[c].astype(str).tolist()
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+import utils.typeinfer as ti
+
+
+def _frame(rows=2000):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "day": pd.date_range("2026-01-01", periods=rows, freq="h").strftime("%Y-%m-%d %H:%M:%S"),
+        "amount": rng.normal(100, 10, rows).round(2).astype(str),
+        "region": rng.choice(["north", "south", "east"], rows),
+        "count": rng.integers(0, 100, rows),
+        "note": ["note " + str(i) for i in range(rows)],
+    })
+
+
+def test_infer_schema():
+    schema = ti.infer_schema(_frame())
+    assert schema["dtype_dict"] == {"day": "datetime64", "amount": "float64", "region": "category",
+                                    "count": "int8", "note": "object"}
+    assert schema["date_formats"] == {"day": "%Y-%m-%d %H:%M:%S"}
+    assert schema["col_order"] == ["day", "amount", "region", "count", "note"]
+
+
+def test_apply_dtypes_converts_and_downcasts_inferred_types():
+    df = _frame()
+    schema = ti.infer_schema(df)
+    typed = ti.apply_dtypes(df, schema["dtype_dict"], schema["date_formats"], downcast=True)
+    assert pd.api.types.is_datetime64_any_dtype(typed["day"].dtype)
+    assert isinstance(typed["region"].dtype, pd.CategoricalDtype)
+    assert str(typed["count"].dtype) == "int8"
+    np.testing.assert_allclose(typed["amount"].astype(float), df["amount"].astype(float))
+    assert typed["day"].iloc[0] == pd.Timestamp("2026-01-01")
+
+
+def test_apply_dtypes_coerces_unparseable_values():
+    df = pd.DataFrame({"n": ["1", "2", "oops"], "i": ["3", "", "5"]})
+    typed = ti.apply_dtypes(df, {"n": "float64", "i": "int64"})
+    assert typed["n"].iloc[:2].tolist() == [1, 2] and pd.isna(typed["n"].iloc[2])
+    # Missing values don't fit ints, the column becomes floats
+    assert pd.api.types.is_float_dtype(typed["i"].dtype) and pd.isna(typed["i"].iloc[1])
+
+
+def test_apply_dtypes_downcasts_only_inferred_floats():
+    df = pd.DataFrame({"x": ["0.5", "1.25", "2"]})
+    assert ti.apply_dtypes(df, {"x": "float64"})["x"].dtype == np.float64
+    assert ti.apply_dtypes(df, {"x": "double"})["x"].dtype == np.float64
+    assert ti.apply_dtypes(df, {"x": "float64"}, downcast=True)["x"].dtype == np.float32
+    # Ints coerced to floats for their missing values keep 64 bits too
+    assert ti.apply_dtypes(pd.DataFrame({"i": ["1", ""]}), {"i": "int64"})["i"].dtype == np.float64
+
+
+def test_downcast_numeric_only_when_lossless():
+    assert ti.downcast_numeric(pd.Series([1, 2, 300])).dtype == np.int16
+    assert ti.downcast_numeric(pd.Series([0.5, 1.25])).dtype == np.float32
+    assert ti.downcast_numeric(pd.Series([0.1, 1 / 3])).dtype == np.float64
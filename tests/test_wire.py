@@ -0,0 +1,72 @@
+import base64
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+import utils.wire as wr
+
+
+def _wide_frame(rows=2000, repeats=5):
+    rng = np.random.default_rng(0)
+    columns = {}
+    for r in range(repeats):
+        ints = rng.integers(0, 30000, rows)
+        floats = rng.normal(0, 1000, rows)
+        floats[::7] = np.nan
+        days = pd.Series(pd.date_range("2026-01-01", periods=rows, freq="37min"))
+        days[::11] = pd.NaT
+        columns["id_" + str(r)] = ints
+        columns["small_" + str(r)] = rng.integers(0, 100, rows).astype(np.int8)
+        columns["value_" + str(r)] = floats
+        columns["ratio_" + str(r)] = rng.random(rows).astype(np.float32)
+        columns["day_" + str(r)] = days
+        columns["region_" + str(r)] = pd.Categorical(rng.choice(["north", "south", None], rows))
+        columns["label_" + str(r)] = ["row " + str(i) for i in range(rows)]
+    return pd.DataFrame(columns)
+
+
+def _decode(payload):
+    # What decode_js does in the browser: typed arrays from base64, NaN -> null
+    rows = [{} for _ in range(payload["length"])]
+    for name, encoded in payload["columns"]:
+        if "dtype" in encoded:
+            values = np.frombuffer(base64.b64decode(encoded["b64"]), dtype=np.dtype(encoded["dtype"]).newbyteorder("<")).tolist()
+        else:
+            values = encoded["values"]
+        for row, v in zip(rows, values):
+            row[name] = None if isinstance(v, float) and np.isnan(v) else v
+    return rows
+
+
+def test_payload_smaller_than_records_raw_and_gzipped():
+    df = _wide_frame()
+    payload = to_json_plotly(wr.encode(df)).encode("utf-8")
+    records = to_json_plotly(df.to_dict("records")).encode("utf-8")
+    assert len(payload) < len(records)
+    assert len(gzip.compress(payload)) < len(gzip.compress(records))
+    assert wr.encoded_size(df) == len(payload) and wr.records_size(df) == len(records)
+
+
+def test_decoded_payload_matches_records():
+    df = _wide_frame(rows=300, repeats=1)
+    decoded = _decode(json.loads(to_json_plotly(wr.encode(df))))
+    expected = json.loads(to_json_plotly(df.to_dict("records")))
+    assert len(decoded) == len(expected)
+    for got, want in zip(decoded, expected):
+        assert got.keys() == want.keys()
+        for column, value in want.items():
+            if column.startswith("ratio_"):
+                # float32 travels as itself, records widen it to float64 first
+                assert np.float32(got[column]) == np.float32(value)
+            else:
+                assert got[column] == value, column
+
+
+def test_large_integers_fall_back_to_json():
+    df = pd.DataFrame({"big": np.array([2 ** 60, 1], dtype=np.int64), "n": pd.array([1, None], dtype="Int64")})
+    payload = wr.encode(df)
+    assert payload["columns"][0][1] == {"values": [2 ** 60, 1]}
+    assert _decode(payload)[1]["n"] is None
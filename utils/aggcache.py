@@ -0,0 +1,148 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import utils.datacache as dc
+
+
+# Group-by results for the "Aggregation Method" dropdown.
+# All methods are computed together off one GroupBy (the key factorization is shared), and each
+# result is cached under (dataset fingerprint, group-by columns, method), so switching methods,
+# paging or moving the plot slider is a lookup rather than another groupby.
+
+methods = ["Count", "Sum", "Mean", "Standard Deviation", "Variance", "Min", "Max"]
+
+
+def _value_columns(df, group_by):
+    return [c for c in df.columns if c not in group_by]
+
+
+def _numeric_columns(df, columns):
+    return [c for c in columns if pd.api.types.is_numeric_dtype(df[c].dtype) and
+            not pd.api.types.is_bool_dtype(df[c].dtype)]
+
+
+def _categorical_extreme(df, group_by, column, how):
+    # Reduce the category codes, which sort like the (sorted) categories, and map back
+    keys = [df[k] for k in group_by]
+    cat = df[column].cat
+    if not cat.categories.is_monotonic_increasing:
+        try:
+            cat = cat.reorder_categories(sorted(cat.categories)).cat
+        except TypeError:
+            return getattr(df[column].astype(object).groupby(keys, observed=True), how)()
+    codes = pd.Series(cat.codes.to_numpy(dtype="float64"), index=df.index, name=column)
+    codes[codes < 0] = np.nan
+    reduced = getattr(codes.groupby(keys, observed=True), how)()
+    values = cat.categories.take(reduced.fillna(-1).astype("int64").to_numpy(), allow_fill=True, fill_value=np.nan)
+    return pd.Series(pd.Categorical(values, categories=cat.categories), index=reduced.index, name=column)
+
+
+def _extremes(df, group_by, grouper, columns, how):
+    parts = []
+    plain = [c for c in columns if not isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if len(plain) > 0:
+        parts.append(getattr(grouper[plain], how)())
+    for c in columns:
+        if isinstance(df[c].dtype, pd.CategoricalDtype):
+            parts.append(_categorical_extreme(df, group_by, c, how).to_frame())
+    if len(parts) == 0:
+        return pd.DataFrame(index=grouper.size().index)
+    return pd.concat(parts, axis=1)[columns]
+
+
+def aggregate(df, group_by, methods_to_compute=None):
+    methods_to_compute = methods if methods_to_compute is None else methods_to_compute
+    group_by = list(group_by)
+    grouper = df.groupby(by=group_by, observed=True)
+    values = _value_columns(df, group_by)
+    numeric = _numeric_columns(df, values)
+
+    results = {}
+    for method in methods_to_compute:
+        if method == "Count":
+            result = grouper.size().rename("size").to_frame()
+        elif method == "Sum":
+            result = grouper[numeric].sum()
+        elif method == "Mean":
+            result = grouper[numeric].mean()
+        elif method == "Standard Deviation":
+            result = grouper[numeric].std()
+        elif method == "Variance":
+            result = grouper[numeric].var()
+        elif method == "Min":
+            result = _extremes(df, group_by, grouper, values, "min")
+        elif method == "Max":
+            result = _extremes(df, group_by, grouper, values, "max")
+        else:
+            raise ValueError("Unknown aggregation method --- " + str(method))
+        results[method] = result.reset_index()
+    return results
+
+
+class AggregationCache:
+    def __init__(self, max_bytes, sizeof=dc.frame_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # (fingerprint, group_by, method) -> (frame, nbytes)
+        self._lock = threading.RLock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(fingerprint, group_by, method):
+        return (fingerprint, tuple(group_by), method)
+
+    def get(self, fingerprint, df, group_by, method, compute=None):
+        # compute() replaces the in-memory engine when given (e.g. streaming a file too big to load)
+        key = self.key(fingerprint, group_by, method)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        # One miss fills every method for these keys
+        results = aggregate(df, group_by) if compute is None else compute()
+        for m, frame in results.items():
+            self.put(self.key(fingerprint, group_by, m), frame)
+        return results[method]
+
+    def put(self, key, frame):
+        nbytes = self.sizeof(frame)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (frame, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self.current_bytes -= dropped
+                self.evictions += 1
+
+    def contains(self, fingerprint, group_by, method):
+        with self._lock:
+            return self.key(fingerprint, group_by, method) in self._entries
+
+    def invalidate(self, fingerprint=None):
+        with self._lock:
+            for key in [k for k in self._entries if fingerprint is None or k[0] == fingerprint]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,217 @@
+import argparse
+import gc
+import gzip
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+
+
+# Benchmarks of the hot paths: parsing, type inference, group-bys, table records, bar figures
+# and exports, run on synthetic datasets so every run measures the same work.
+# Each stage records its best time over a few repeats and the peak memory tracemalloc saw
+# (numpy and pandas allocations included). Results are written as JSON, and --compare prints
+# how a run moved against an earlier one, e.g. before and after a pandas or Dash upgrade.
+#
+#   python -m utils.benchmark --rows 1000000 --output before.json
+#   python -m utils.benchmark --rows 1000000 --compare before.json
+
+def make_dataset(rows, numeric_columns=6, text_columns=3, date_columns=1, cardinality=50, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(text_columns):
+        # Group-by candidates, the first one has the requested cardinality and the rest fewer values
+        distinct = max(2, cardinality // (10 ** i))
+        data["Text " + str(i)] = rng.choice(["value_" + str(v) for v in range(distinct)], rows)
+    for i in range(date_columns):
+        data["Date " + str(i)] = (pd.Timestamp("2020-01-01") +
+                                  pd.to_timedelta(rng.integers(0, 1500, rows), unit="D")).strftime("%Y-%m-%d")
+    for i in range(numeric_columns):
+        data["Number " + str(i)] = rng.integers(0, 1000, rows) if i % 2 == 0 else rng.normal(100, 25, rows).round(4)
+    return pd.DataFrame(data)
+
+
+def write_dataset(df, directory, fmt="csv"):
+    path = os.path.join(directory, "benchmark_" + str(len(df)) + "." + fmt)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+    return path
+
+
+def measure(fn, repeat=3):
+    # (best seconds, peak traced bytes of the first run, result of the last run)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    times = [time.perf_counter() - start]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), peak, result
+
+
+def run_stages(path, group_by, repeat=3, page_size=25, max_plot_bars=50):
+    # app is imported here, so the module can generate datasets without building the Dash app
+    import app
+    import utils.aggcache as ac
+    import utils.export as ex
+    import utils.figures as fg
+    import utils.partialagg as pa
+    import utils.typeinfer as ti
+    import utils.wire as wr
+    from plotly.io.json import to_json_plotly
+
+    results = []
+
+    def stage(name, fn, **extra):
+        seconds, peak, result = measure(fn, repeat)
+        results.append(dict({"stage": name, "seconds": seconds, "peak_bytes": peak}, **extra))
+        return result
+
+    if path.endswith(".csv"):
+        raw = stage("parse", lambda: pd.read_csv(path, sep=",", encoding='Latin-1'))
+    else:
+        raw = stage("parse", lambda: pd.read_excel(path))
+    schema = stage("infer_schema", lambda: ti.infer_schema(raw))
+    df = stage("apply_dtypes", lambda: ti.apply_dtypes(raw, schema["dtype_dict"], schema["date_formats"], downcast=True))
+    stage("read_df", lambda: app.read_df(path))
+
+    for method in ac.methods:
+        stage("groupby", lambda: ac.aggregate(df, group_by, [method]), method=method)
+    aggregated = stage("groupby_all_methods", lambda: ac.aggregate(df, group_by))
+    states = stage("partial_states", lambda: app.engine.partial_states(df, group_by), engine=app.engine.name)
+    stage("finalize_all_methods", lambda: pa.aggregate(states, group_by, ac.methods, dtypes=df.dtypes))
+
+    stage("records_page", lambda: app.table_page(df, 0, page_size))
+    stage("records_full", lambda: df.to_dict("records"))
+
+    # Table payload sizes, the old records format against the column-oriented one, raw and gzipped
+    for name, frame in [("page", df.iloc[:500]), ("groupby", aggregated["Mean"])]:
+        for fmt, serialize in [("records", lambda f: to_json_plotly(f.to_dict("records"))),
+                               ("columns", lambda f: to_json_plotly(wr.encode(f)))]:
+            text = stage("payload", lambda: serialize(frame).encode("utf-8"), payload=name, format=fmt)
+            results[-1].update(bytes=len(text), gzip_bytes=len(gzip.compress(text, 6)))
+
+    # Wide tables: column definitions, and a page of every column against the columns shown by default
+    wide = pd.concat([df.iloc[:500].add_suffix(" " + str(i)) for i in range(20)], axis=1)
+    stage("table_columns", lambda: app.table_columns(wide), columns=len(wide.columns))
+    for name, frame in [("wide_page", wide), ("projected_page", wide.iloc[:, :max(1, app.max_visible_columns)])]:
+        text = stage("payload", lambda: to_json_plotly(wr.encode(frame)).encode("utf-8"), payload=name, format="columns")
+        results[-1].update(bytes=len(text), gzip_bytes=len(gzip.compress(text, 6)), columns=len(frame.columns))
+
+    def figures(frame):
+        dff, chart_x_column = app.chart_frame(frame, group_by, "", [], max_plot_bars)
+        x = dff[chart_x_column].to_numpy()
+        colors = ['#0074D9'] * len(dff)
+        figs = [fg.bar_figure(x, dff[c].to_numpy(), chart_x_column, c, colors, 12)
+                for c in dff.columns if c != chart_x_column and app.table_type(dff[c]) == 'numeric']
+        return to_json_plotly(figs)
+    stage("figures", lambda: figures(aggregated["Sum"]), method="Sum")
+
+    for fmt in ex.available_formats():
+        stage("export", lambda: sum(len(chunk) for chunk in ex.iter_export(df, fmt)), format=fmt)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _versions():
+    versions = {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__}
+    for module in ["dash", "plotly", "pyarrow", "duckdb"]:
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            pass
+    return versions
+
+
+def _key(result):
+    return (result["dataset"], result["stage"], result.get("method"), result.get("payload"), result.get("format"))
+
+
+def compare(old, new):
+    old_results = {_key(r): r for r in old["results"]}
+    for r in new["results"]:
+        before = old_results.get(_key(r))
+        if before is None or before["seconds"] == 0:
+            continue
+        label = " ".join(str(k) for k in _key(r)[1:] if k is not None)
+        print("{:45} {:>10.4f} s -> {:>10.4f} s  {:>+7.1%}".format(
+            r["dataset"] + " " + label, before["seconds"], r["seconds"], r["seconds"] / before["seconds"] - 1))
+        if before.get("bytes") and "bytes" in r:
+            print("{:45} {:>10,} B -> {:>10,} B  {:>+7.1%}".format(
+                r["dataset"] + " " + label, before["bytes"], r["bytes"], r["bytes"] / float(before["bytes"]) - 1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the data explorer's load / aggregate / render / export paths")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000])
+    parser.add_argument("--numeric-columns", type=int, default=6)
+    parser.add_argument("--text-columns", type=int, default=3)
+    parser.add_argument("--date-columns", type=int, default=1)
+    parser.add_argument("--cardinality", type=int, default=50, help="distinct values of the first text column")
+    parser.add_argument("--formats", nargs="+", default=["csv"], choices=["csv", "xlsx"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file, defaults to benchmark_<commit>_<time>.json")
+    parser.add_argument("--compare", default=None, help="earlier JSON results to compare against")
+    args = parser.parse_args(argv)
+
+    params = {k: v for k, v in vars(args).items() if k not in ["output", "compare"]}
+    run = {"commit": _git_commit(), "time": datetime.now().isoformat(timespec="seconds"),
+           "platform": platform.platform(), "versions": _versions(), "params": params, "results": []}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            df = make_dataset(rows, args.numeric_columns, args.text_columns, args.date_columns, args.cardinality, args.seed)
+            group_by = [c for c in df.columns if c.startswith("Text ")][:2]
+            for fmt in args.formats:
+                try:
+                    path = write_dataset(df, directory, fmt)
+                except ImportError as e:
+                    warn("SKIPPING " + fmt + " --- " + str(e))
+                    continue
+                dataset = fmt + ":" + str(rows)
+                print("Benchmarking " + dataset + " ...", file=sys.stderr)
+                for result in run_stages(path, group_by, args.repeat):
+                    run["results"].append(dict({"dataset": dataset, "rows": rows}, **result))
+
+    output = args.output or "benchmark_" + str(run["commit"] or "nogit") + "_" + datetime.now().strftime("%Y_%m_%d_%H_%M_%S") + ".json"
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print("Wrote " + output, file=sys.stderr)
+
+    for r in run["results"]:
+        label = " ".join(str(r[k]) for k in ["stage", "method", "payload", "format", "engine"] if r.get(k) is not None)
+        print("{:12} {:45} {:>10.4f} s {:>10.1f} MB".format(r["dataset"], label, r["seconds"], r["peak_bytes"] / 1024 ** 2) +
+              ("  {:>12,} B {:>10,} B gzip".format(r["bytes"], r["gzip_bytes"]) if "bytes" in r else ""))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), run)
+    return run
+
+
+if __name__ == "__main__":
+    main()
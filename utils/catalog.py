@@ -0,0 +1,165 @@
+import fnmatch
+import os
+import threading
+import time
+
+
+# Cached listing of the data files in a directory, so the dataset dropdown and searches don't
+# list the directory again on every callback (slow on network mounts with many files).
+# Each catalog remembers the mtime of every directory it scanned and a background thread polls
+# them: only directories whose mtime changed (files added, removed or renamed) are listed again.
+# Row / column counts and column types are filled in once a file has been loaded.
+
+data_extensions = ('.csv', '.xls', '.xlsm', '.xlsx')
+
+
+class DirectoryCatalog:
+    def __init__(self, root, recursive=False, extensions=data_extensions):
+        self.root = os.path.abspath(root)
+        self.recursive = recursive
+        self.extensions = extensions
+        self._dirs = {}  # abs dir -> mtime_ns when it was last listed
+        self._files = {}  # path relative to root -> entry dict
+        self._lock = threading.RLock()
+        self.last_access = time.time()
+
+    def _list_dir(self, directory):
+        # Data files directly in directory, and its subdirectories when recursive
+        files, subdirs = {}, []
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if self.recursive and not entry.name.startswith('.'):
+                            subdirs.append(entry.path)
+                    elif entry.name.endswith(self.extensions):
+                        st = entry.stat()
+                        files[os.path.relpath(entry.path, self.root)] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        return files, subdirs
+
+    def scan(self):
+        # Re-lists the directories that changed since the last scan, returns whether anything did
+        changed = False
+        pending = [self.root]
+        seen = set()
+        while pending:
+            directory = pending.pop()
+            seen.add(directory)
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                if directory == self.root:
+                    raise
+                continue
+
+            with self._lock:
+                unchanged = self._dirs.get(directory) == mtime
+            if unchanged:
+                # Still walk known subdirectories, their own mtimes say whether they changed
+                if self.recursive:
+                    with self._lock:
+                        pending.extend(d for d in self._dirs if os.path.dirname(d) == directory)
+                continue
+
+            files, subdirs = self._list_dir(directory)
+            pending.extend(subdirs)
+            with self._lock:
+                self._dirs[directory] = mtime
+                for name in [n for n in self._files if self._files[n]["dir"] == directory and n not in files]:
+                    del self._files[name]
+                for name, (size, mtime_ns) in files.items():
+                    entry = self._files.get(name)
+                    if entry is None or (entry["size"], entry["mtime_ns"]) != (size, mtime_ns):
+                        # New or rewritten file, its counts / types are unknown until it's loaded again
+                        self._files[name] = {"name": name, "dir": directory, "size": size, "mtime_ns": mtime_ns,
+                                             "rows": None, "columns": None, "dtypes": None}
+            changed = True
+
+        # Directories that disappeared take their files with them
+        with self._lock:
+            for directory in [d for d in self._dirs if d not in seen]:
+                del self._dirs[directory]
+                for name in [n for n in self._files if self._files[n]["dir"] == directory]:
+                    del self._files[name]
+                changed = True
+        return changed
+
+    def files(self, pattern=None, search=None):
+        # Served from the catalog only, the filesystem isn't touched
+        self.last_access = time.time()
+        with self._lock:
+            entries = list(self._files.values())
+        if pattern:
+            entries = [e for e in entries if fnmatch.fnmatch(e["name"], pattern)]
+        if search:
+            search = search.lower()
+            entries = [e for e in entries if search in e["name"].lower()]
+        return [dict(e) for e in sorted(entries, key=lambda e: e["name"])]
+
+    def record(self, path, rows=None, columns=None, dtypes=None):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        name = os.path.relpath(os.path.abspath(path), self.root)
+        with self._lock:
+            entry = self._files.get(name)
+            if entry is not None:
+                entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns, rows=rows, columns=columns, dtypes=dtypes)
+
+
+class CatalogRegistry:
+    # One catalog per directory the app has been pointed at, all refreshed by one polling thread
+    def __init__(self, recursive=False, poll_seconds=5.0, idle_seconds=3600):
+        self.recursive = recursive
+        self.poll_seconds = poll_seconds
+        self.idle_seconds = idle_seconds  # catalogs nobody looked at for this long are dropped
+        self._catalogs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self, root):
+        root = os.path.abspath(root)
+        with self._lock:
+            catalog = self._catalogs.get(root)
+        if catalog is None:
+            catalog = DirectoryCatalog(root, recursive=self.recursive)
+            catalog.scan()
+            with self._lock:
+                catalog = self._catalogs.setdefault(root, catalog)
+            self._start()
+        return catalog
+
+    def record(self, path, **info):
+        # Every catalog the file shows up in, a recursive one may hold it under a parent directory
+        path = os.path.abspath(path)
+        with self._lock:
+            catalogs = [c for root, c in self._catalogs.items() if path.startswith(root + os.sep)]
+        for catalog in catalogs:
+            catalog.record(path, **info)
+
+    def _start(self):
+        if self.poll_seconds <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._poll, name="catalog-watcher", daemon=True)
+        self._thread.start()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            now = time.time()
+            with self._lock:
+                for root in [r for r, c in self._catalogs.items() if now - c.last_access > self.idle_seconds]:
+                    del self._catalogs[root]
+                catalogs = list(self._catalogs.values())
+            for catalog in catalogs:
+                try:
+                    catalog.scan()
+                except OSError:
+                    with self._lock:
+                        self._catalogs.pop(catalog.root, None)
@@ -0,0 +1,109 @@
+import os
+
+import pandas as pd
+
+import utils.aggcache as ac
+import utils.jobs as jobs
+import utils.partialagg as pa
+import utils.typeinfer as ti
+
+
+# Streaming ingestion for CSV files too large to load at once.
+# The file is read chunk by chunk (unnamed columns are dropped by usecols at parse time, dtypes
+# are coerced per chunk) and each chunk only contributes a mergeable partial group-by state,
+# so memory stays bounded by the chunk size plus the number of groups.
+
+
+def _named(column):
+    return not str(column).lower().startswith("unnamed")
+
+
+def stream_dtypes(schema, raw_dtypes=None):
+    # Only keep conversions that are safe chunk by chunk: parsing dates and numeric text.
+    # Category and downcast integer types depend on values later chunks may not share.
+    dtype_dict = {}
+    for col, dtype in schema["dtype_dict"].items():
+        if raw_dtypes is not None and str(raw_dtypes.get(col)) != "object":
+            continue
+        if "date" in dtype or dtype == "float64":
+            dtype_dict[col] = dtype
+    return dtype_dict
+
+
+def iter_chunks(path, chunk_rows, dtype_dict=None, date_formats=None, usecols=None, progress=None):
+    total_bytes = max(os.path.getsize(path), 1)
+    rows = 0
+    with open(path, "rb") as f:
+        reader = pd.read_csv(f, sep=",", encoding='Latin-1', chunksize=chunk_rows,
+                             usecols=usecols if usecols is not None else _named)
+        for chunk in reader:
+            if dtype_dict:
+                chunk = ti.apply_dtypes(chunk, dtype_dict, date_formats)
+            rows += len(chunk)
+            yield chunk
+            if progress is not None:
+                progress(min(f.tell() / float(total_bytes), 1.0), rows)
+
+
+def read_csv_chunked(path, chunk_rows, nrows=None, progress=None, cancelled=None):
+    # A whole-file read done in chunks, so a background load can report progress and stop early
+    total_bytes = max(os.path.getsize(path), 1)
+    chunks = []
+    rows = 0
+    with open(path, "rb") as f:
+        reader = pd.read_csv(f, sep=",", encoding='Latin-1', chunksize=chunk_rows, nrows=nrows)
+        for chunk in reader:
+            if cancelled is not None and cancelled():
+                raise jobs.LoadCancelled(path)
+            chunks.append(chunk)
+            rows += len(chunk)
+            if progress is not None:
+                progress(min(f.tell() / float(total_bytes), 1.0), rows)
+
+    if len(chunks) == 0:
+        return pd.read_csv(path, sep=",", encoding='Latin-1', nrows=0)
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def aggregate_stream(path, group_by, chunk_rows, schema=None, progress=None, cancelled=None):
+    states = stream_states(path, group_by, chunk_rows, schema=schema, progress=progress, cancelled=cancelled)
+    return pa.aggregate(states, group_by, ac.methods)
+
+
+def _stream_head(path, chunk_rows, schema=None):
+    # The head of the file and the conversions every chunk gets, inferred from the head when the
+    # caller has no schema for the file yet
+    head = pd.read_csv(path, sep=",", encoding='Latin-1', nrows=min(chunk_rows, 10000), usecols=_named)
+    if schema is None:
+        schema = ti.infer_schema(head)
+    return head, stream_dtypes(schema, head.dtypes.astype(str).to_dict()), schema.get("date_formats")
+
+
+def stream_frames(path, chunk_rows, schema=None, progress=None, cancelled=None):
+    # The rows of the whole file, one typed chunk at a time
+    _, dtype_dict, date_formats = _stream_head(path, chunk_rows, schema)
+    for chunk in iter_chunks(path, chunk_rows, dtype_dict, date_formats, progress=progress):
+        if cancelled is not None and cancelled():
+            raise jobs.LoadCancelled(path)
+        yield chunk
+
+
+def stream_states(path, group_by, chunk_rows, schema=None, progress=None, cancelled=None):
+    # Partial states of the whole file, merged chunk by chunk, see utils/partialagg.py
+    group_by = list(group_by)
+
+    head, dtype_dict, date_formats = _stream_head(path, chunk_rows, schema)
+    missing = [c for c in group_by if c not in head.columns]
+    if len(missing) > 0:
+        raise KeyError("GROUP BY COLUMNS NOT IN FILE --- " + str(missing))
+
+    states = None
+    for chunk in iter_chunks(path, chunk_rows, dtype_dict, date_formats, progress=progress):
+        if cancelled is not None and cancelled():
+            raise jobs.LoadCancelled(path)
+        states = pa.merge_states(states, pa.partial_states(chunk, group_by))
+
+    if states is None:
+        states = pa.partial_states(head.iloc[:0], group_by)
+    return states
+
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import utils.datacache as dc
+
+
+# Column profiles: dtype, null count, distinct count, min / max and the most frequent values of
+# every column, computed once when a dataset is loaded and kept per file version.
+# Distinct counts are exact up to exact_rows rows, beyond that they are HyperLogLog estimates
+# (about 1% error with the default 2^14 registers). Top values are only counted for columns with
+# few enough distinct values to be worth grouping by; for ID-like columns they say nothing.
+
+exact_rows = 100000  # columns with more rows get a HyperLogLog distinct count
+top_k = 5
+top_k_max_distinct = 100000  # no top values for columns with more distinct values than this
+hll_precision = 14
+
+_profiles = OrderedDict()  # file key -> profile
+_profiles_lock = threading.Lock()
+_max_profiles = 32
+
+
+class HyperLogLog:
+    # Registers can be merged with merge(), e.g. across the chunks of a streamed file
+    def __init__(self, precision=None):
+        self.p = hll_precision if precision is None else precision
+        self.m = 1 << self.p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        # hashes: uint64 array, e.g. from pd.util.hash_pandas_object
+        if len(hashes) == 0:
+            return self
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        bits = 64 - self.p
+        index = (hashes >> np.uint64(bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        # Position of the leftmost 1 in the remaining bits. They're under 2^53, so they convert to
+        # float64 exactly and frexp's exponent is their bit length.
+        rank = bits - np.frexp(rest.astype(np.float64))[1].astype(np.int64) + 1
+        # Highest rank seen per register, counted in one O(n) pass instead of a sort / group-by
+        seen = np.bincount(index * 64 + rank, minlength=self.m * 64).reshape(self.m, 64) > 0
+        best = (63 - np.argmax(seen[:, ::-1], axis=1)) * seen.any(axis=1)
+        np.maximum(self.registers, best.astype(np.uint8), out=self.registers)
+        return self
+
+    def add(self, series):
+        # categorize=False: factorizing first only pays off for columns with few distinct values
+        return self.add_hashes(pd.util.hash_pandas_object(series.dropna(), index=False, categorize=False).to_numpy())
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros > 0:
+            # Linear counting is more accurate for small cardinalities
+            estimate = self.m * np.log(self.m / float(zeros))
+        return int(round(estimate))
+
+
+def _scalar(value):
+    # JSON friendly min / max / top values
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value if isinstance(value, (int, float, str, bool)) else str(value)
+
+
+def distinct_count(series):
+    # (count, exact)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        return int(len(np.unique(codes[codes >= 0]))), True
+    if len(series) <= exact_rows or pd.api.types.is_bool_dtype(series.dtype):
+        return int(series.nunique(dropna=True)), True
+    return HyperLogLog().add(series).count(), False
+
+
+def profile_column(series, type_of=None):
+    nulls = int(series.isna().sum())
+    distinct, exact = distinct_count(series)
+    column = {"name": str(series.name), "dtype": str(series.dtype), "type": type_of(series) if type_of else None,
+              "rows": len(series), "nulls": nulls, "distinct": distinct, "distinct_exact": exact,
+              "min": None, "max": None, "top": None}
+
+    if len(series) - nulls > 0 and (pd.api.types.is_numeric_dtype(series.dtype) or
+                                    pd.api.types.is_datetime64_any_dtype(series.dtype)) and \
+            not pd.api.types.is_bool_dtype(series.dtype):
+        column["min"], column["max"] = _scalar(series.min()), _scalar(series.max())
+
+    if distinct <= top_k_max_distinct:
+        counts = series.value_counts(dropna=True, sort=True).head(top_k)
+        column["top"] = [[_scalar(v), int(n)] for v, n in counts.items() if n > 0]
+    return column
+
+
+def profile_frame(df, type_of=None):
+    # {"rows": ..., "columns": {name: column profile}}, one pass per column
+    return {"rows": len(df), "columns": {c: profile_column(df[c], type_of) for c in df.columns}}
+
+
+def cache_profile(path, profile):
+    key = dc.file_key(path)
+    with _profiles_lock:
+        _profiles[key] = profile
+        _profiles.move_to_end(key)
+        while len(_profiles) > _max_profiles:
+            _profiles.popitem(last=False)
+    return profile
+
+
+def cached_profile(path, make_profile=None):
+    # The profile of this version of the file; made with make_profile(path) on a miss, or None without one
+    key = dc.file_key(path)
+    with _profiles_lock:
+        profile = _profiles.get(key)
+        if profile is not None:
+            _profiles.move_to_end(key)
+            return profile
+    if make_profile is None:
+        return None
+    return cache_profile(path, make_profile(path))
+
+
+def format_count(n, exact=True):
+    if n is None:
+        return ""
+    if exact or n < 1000:
+        return "{:,}".format(n)
+    for bound, suffix in [(1e9, "B"), (1e6, "M"), (1e3, "K")]:
+        if n >= bound:
+            return "~" + "{:.1f}".format(n / bound) + suffix
+    return "~" + str(n)
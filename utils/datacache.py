@@ -0,0 +1,174 @@
+import os
+import threading
+from collections import OrderedDict
+from warnings import warn
+
+import utils.excel as xl
+import utils.shards as sh
+
+
+# Process-wide cache of loaded datasets.
+# Entries are keyed on the absolute file path and remember the (mtime, size) they were
+# loaded from, so a file that changes on disk is reloaded instead of served stale.
+# Eviction is least-recently-used, bounded by the total memory footprint of the cached frames.
+# Frames are shared by every session: sessions pin the dataset they have open with acquire() /
+# release(), and pinned entries are never evicted. When they don't fit the budget together, the
+# cache stays over it until enough of them are released.
+
+
+def file_key(path):
+    # Folders / globs of shards get a key that changes with any of their files, see utils/shards.py
+    if sh.is_sharded(path):
+        return sh.dataset_key(path)
+    # A sheet ("book.xlsx::Sales") changes with its workbook
+    st = os.stat(xl.split_sheet(path)[0])
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def frame_nbytes(df):
+    try:
+        return int(df.memory_usage(index=True, deep=True).sum())
+    except Exception:
+        return 0
+
+
+class DatasetCache:
+    def __init__(self, max_bytes, sizeof=frame_nbytes, pass_previous=False):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        # Loaders are called as loader(path, previous) with the outdated value of a changed file
+        # (or None), so they can reuse the parts of it that are still valid
+        self.pass_previous = pass_previous
+        self._entries = OrderedDict()  # abs path -> (file key, value, nbytes)
+        self._refcounts = {}  # abs path -> number of sessions holding it
+        self._loading = {}  # abs path -> [lock held while that file is being loaded, callers using it]
+        self._lock = threading.RLock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _lookup(self, key):
+        # (found, value, outdated value of a file that changed on disk)
+        entry = self._entries.get(key[0])
+        if entry is not None:
+            if entry[0] == key:
+                self._entries.move_to_end(key[0])
+                self.hits += 1
+                return True, entry[1], None
+            # File changed on disk since it was cached
+            self._drop(key[0])
+            self.invalidations += 1
+            return False, None, entry[1]
+        return False, None, None
+
+    def get(self, path, loader):
+        key = file_key(path)
+
+        with self._lock:
+            found, value, previous = self._lookup(key)
+            if found:
+                return value
+            loading = self._loading.setdefault(key[0], [threading.Lock(), 0])
+            loading[1] += 1
+
+        # Only one caller loads a given file, concurrent callers wait and then read the cached copy
+        try:
+            with loading[0]:
+                with self._lock:
+                    found, value, outdated = self._lookup(key)
+                    if found:
+                        return value
+                    previous = previous if outdated is None else outdated
+                    self.misses += 1
+
+                value = loader(path, previous) if self.pass_previous else loader(path)
+                previous = None
+                self.put(key, value)
+                return value
+        finally:
+            with self._lock:
+                # The last caller for this file drops its lock, so the dict doesn't grow with every file ever opened
+                loading[1] -= 1
+                if loading[1] == 0:
+                    del self._loading[key[0]]
+
+    def contains(self, path):
+        try:
+            key = file_key(path)
+        except OSError:
+            return False
+        with self._lock:
+            entry = self._entries.get(key[0])
+            return entry is not None and entry[0] == key
+
+    def put(self, key, value):
+        nbytes = self.sizeof(value)
+        with self._lock:
+            if key[0] in self._entries:
+                self._drop(key[0])
+
+            # A frame bigger than the whole budget is still kept, alone, since callbacks keep asking for it
+            self._entries[key[0]] = (key, value, nbytes)
+            self.current_bytes += nbytes
+            self._evict(keep=key[0])
+
+    def _evict(self, keep=None):
+        # Least recently used unpinned entries first, pinned ones stay even over budget
+        while self.current_bytes > self.max_bytes:
+            unpinned = [p for p in self._entries if p != keep and self._refcounts.get(p, 0) == 0]
+            if len(unpinned) == 0:
+                if len(self._entries) > 1:
+                    warn("DATASET CACHE OVER BUDGET, EVERY OTHER DATASET IS OPEN --- " +
+                         str(self.current_bytes) + " of " + str(self.max_bytes) + " bytes")
+                return
+            self._drop(unpinned[0])
+            self.evictions += 1
+
+    def acquire(self, path, loader):
+        value = self.get(path, loader)
+        with self._lock:
+            abs_path = os.path.abspath(path)
+            self._refcounts[abs_path] = self._refcounts.get(abs_path, 0) + 1
+        return value
+
+    def release(self, path):
+        with self._lock:
+            abs_path = os.path.abspath(path)
+            count = self._refcounts.get(abs_path, 0) - 1
+            if count > 0:
+                self._refcounts[abs_path] = count
+            else:
+                self._refcounts.pop(abs_path, None)
+                # Evictable again, catch up on a budget pinned entries held the cache over
+                self._evict()
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                for p in list(self._entries):
+                    self._drop(p)
+                    self.invalidations += 1
+            elif os.path.abspath(path) in self._entries:
+                self._drop(os.path.abspath(path))
+                self.invalidations += 1
+
+    def _drop(self, abs_path):
+        _, _, nbytes = self._entries.pop(abs_path)
+        self.current_bytes -= nbytes
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "pinned": sum(1 for p in self._entries if self._refcounts.get(p, 0) > 0),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,260 @@
+import threading
+import time
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+
+import utils.aggcache as ac
+import utils.jobs as jobs
+import utils.partialagg as pa
+import utils.table_query as tq
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - the DuckDB engine is optional
+    duckdb = None
+
+
+# Query engines behind the group-by and table filter / sort paths.
+# The pandas engine is the reference implementation. The DuckDB engine runs the same queries
+# multi-threaded in-process, either over the cached DataFrames (scanned in place) or straight
+# over CSV / Parquet files with projection and predicate pushdown, which replaces chunked
+# streaming for files too large to load. Every engine returns the same frames as pandas: the
+# partial states of pa.partial_states(), finalized into group-by results by pa.aggregate(), and
+# filtered / sorted rows of the original frame.
+
+engines = ["pandas", "duckdb"]
+csv_encoding = "latin-1"  # CSV files are read with the same encoding as the rest of the app
+
+
+class PandasEngine:
+    name = "pandas"
+    reads_files = False
+
+    def partial_states(self, df, group_by):
+        return pa.partial_states(df, group_by)
+
+    def query(self, df, filter_query, sort_by):
+        return tq.apply_sort(tq.apply_filter(df, filter_query), sort_by)
+
+
+_sql_integers = ["TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT"]
+_sql_floats = ["FLOAT", "DOUBLE", "DECIMAL", "REAL"]
+
+
+def _alias(stat, column):
+    return stat + ":" + str(column)
+
+
+def _frame_kinds(df, columns):
+    # How each value column is aggregated: "int" / "float" get every method, the rest only Min / Max
+    numeric = ac._numeric_columns(df, columns)
+    return {c: ("int" if pd.api.types.is_integer_dtype(df[c].dtype) else "float") if c in numeric else
+            "category" if isinstance(df[c].dtype, pd.CategoricalDtype) else "other" for c in columns}
+
+
+def _sql_kind(sql_type):
+    base = sql_type.split("(")[0]
+    return "int" if base in _sql_integers else "float" if base in _sql_floats else "other"
+
+
+class DuckDBEngine:
+    name = "duckdb"
+    reads_files = True
+
+    def __init__(self, threads=None):
+        if duckdb is None:
+            raise ImportError("The duckdb engine needs the duckdb package")
+        self._con = duckdb.connect(":memory:")
+        if threads:
+            self._con.execute("SET threads TO " + str(int(threads)))
+        self._lock = threading.Lock()
+
+    def _cursor(self):
+        # Each call gets its own cursor, a connection can't run queries from two threads at once
+        with self._lock:
+            cursor = self._con.cursor()
+        # Settings are per cursor: progress is tracked for query_progress() but never printed
+        cursor.execute("SET enable_progress_bar = true")
+        cursor.execute("SET enable_progress_bar_print = false")
+        return cursor
+
+    @staticmethod
+    def _states_sql(group_by, kinds, source):
+        # One pass computing the partial states of pa.partial_states()
+        keys = [tq._sql_ident(k) for k in group_by]
+        select = list(keys) + ["COUNT(*) AS " + tq._sql_ident("size")]
+        for c, kind in kinds.items():
+            col = tq._sql_ident(c)
+            if kind in ["int", "float"]:
+                select.append("COUNT(" + col + ") AS " + tq._sql_ident(_alias("n", c)))
+                select.append("CAST(COALESCE(SUM(" + col + "), 0) AS " + ("BIGINT" if kind == "int" else "DOUBLE") + ")" +
+                              " AS " + tq._sql_ident(_alias("sum", c)))
+                select.append("AVG(" + col + ") AS " + tq._sql_ident(_alias("mean", c)))
+                select.append("COALESCE(VAR_POP(" + col + ") * COUNT(" + col + "), 0) AS " + tq._sql_ident(_alias("m2", c)))
+            value = "CAST(" + col + " AS VARCHAR)" if kind == "category" else col
+            select.append("MIN(" + value + ") AS " + tq._sql_ident(_alias("min", c)))
+            select.append("MAX(" + value + ") AS " + tq._sql_ident(_alias("max", c)))
+        return ("SELECT " + ", ".join(select) + " FROM " + source +
+                " WHERE " + " AND ".join(k + " IS NOT NULL" for k in keys) +
+                " GROUP BY " + ", ".join(keys))
+
+    @staticmethod
+    def _to_states(result, group_by, kinds, df=None):
+        group_by = list(group_by)
+        keys = result[group_by]
+        if df is not None:
+            keys = pd.DataFrame({k: keys[k].astype(df[k].dtype) for k in group_by})
+        index = pd.MultiIndex.from_frame(keys) if len(group_by) > 1 else pd.Index(keys[group_by[0]], name=group_by[0])
+
+        parts = {pa.size_col: result["size"].astype("int64")}
+        for c, kind in kinds.items():
+            stats = pa.numeric_stats if kind in ["int", "float"] else pa.other_stats
+            for stat in stats:
+                values = result[_alias(stat, c)]
+                parts[(c, stat)] = values.astype(object) if kind == "category" else values
+        states = pd.DataFrame({k: v.to_numpy() for k, v in parts.items()}, index=index)
+        states.columns = pd.MultiIndex.from_tuples(list(parts.keys()))
+        return states
+
+    def _run(self, cursor, sql, progress=None, cancelled=None):
+        # Runs on the calling thread; a watcher reports progress and interrupts the query on cancel
+        if progress is None and cancelled is None:
+            return cursor.execute(sql).df()
+
+        finished = threading.Event()
+
+        def watch():
+            while not finished.wait(0.5):
+                if cancelled is not None and cancelled():
+                    cursor.interrupt()
+                    return
+                if progress is not None:
+                    try:
+                        fraction = cursor.query_progress()
+                    except Exception:
+                        continue
+                    if fraction is not None and fraction >= 0:
+                        progress(min(fraction / 100.0, 1.0))
+
+        watcher = threading.Thread(target=watch, name="duckdb-progress", daemon=True)
+        watcher.start()
+        try:
+            return cursor.execute(sql).df()
+        finally:
+            finished.set()
+
+    def partial_states(self, df, group_by):
+        group_by = list(group_by)
+        values = [c for c in df.columns if c not in group_by]
+        cursor = self._cursor()
+        try:
+            cursor.register("source_df", df[group_by + values])
+            kinds = _frame_kinds(df, values)
+            result = self._run(cursor, self._states_sql(group_by, kinds, "source_df"))
+        except duckdb.Error as e:
+            warn("DUCKDB COULDN'T AGGREGATE, USING PANDAS --- " + str(e))
+            return pa.partial_states(df, group_by)
+        finally:
+            cursor.close()
+        return self._to_states(result, group_by, kinds, df)
+
+    @staticmethod
+    def file_source(path):
+        if path.endswith(".parquet"):
+            return "read_parquet(" + tq._sql_literal(path) + ")"
+        return "read_csv_auto(" + tq._sql_literal(path) + ", header=true, encoding=" + tq._sql_literal(csv_encoding) + ")"
+
+    def file_states(self, path, group_by, progress=None, cancelled=None):
+        group_by = list(group_by)
+        source = self.file_source(path)
+        cursor = self._cursor()
+        try:
+            described = cursor.execute("DESCRIBE SELECT * FROM " + source).fetchall()
+            types = {name: sql_type for name, sql_type, *_ in described if not str(name).lower().startswith("unnamed")}
+            missing = [c for c in group_by if c not in types]
+            if len(missing) > 0:
+                raise KeyError("GROUP BY COLUMNS NOT IN FILE --- " + str(missing))
+            kinds = {c: _sql_kind(t) for c, t in types.items() if c not in group_by}
+            result = self._run(cursor, self._states_sql(group_by, kinds, source), progress=progress, cancelled=cancelled)
+        except duckdb.InterruptException:
+            raise jobs.LoadCancelled(path)
+        except duckdb.Error as e:
+            # e.g. a malformed line, or a DuckDB without this encoding: None, the caller streams the file instead
+            warn("DUCKDB COULDN'T AGGREGATE THE FILE, STREAMING IT --- " + str(e))
+            return None
+        finally:
+            cursor.close()
+        if cancelled is not None and cancelled():
+            raise jobs.LoadCancelled(path)
+        return self._to_states(result, group_by, kinds)
+
+    def query(self, df, filter_query, sort_by):
+        # DuckDB only picks the row positions, the rows themselves come from df so dtypes are untouched
+        where = tq.filter_sql(df, filter_query)
+        order = tq.order_by_sql(df, sort_by)
+        if where == "TRUE" and len(order) == 0:
+            return df
+        used = [c for c in dict.fromkeys(tq.filter_columns(filter_query) + [s["column_id"] for s in sort_by or []])
+                if c in df.columns]
+        rows = pd.DataFrame({c: df[c].to_numpy() for c in used})
+        rows["__row"] = np.arange(len(df))
+        cursor = self._cursor()
+        try:
+            cursor.register("rows_df", rows)
+            positions = cursor.execute("SELECT __row FROM rows_df WHERE " + where +
+                                       " ORDER BY " + ", ".join(order + ["__row"])).fetchnumpy()["__row"]
+        except duckdb.Error as e:
+            warn("DUCKDB COULDN'T FILTER, USING PANDAS --- " + str(e))
+            return tq.apply_sort(tq.apply_filter(df, filter_query), sort_by)
+        finally:
+            cursor.close()
+        return df.iloc[positions]
+
+
+def get_engine(name, threads=None):
+    if name == "duckdb":
+        try:
+            return DuckDBEngine(threads)
+        except ImportError as e:
+            warn(str(e) + ", using pandas")
+    elif name != "pandas":
+        warn("UNKNOWN QUERY ENGINE --- " + str(name) + ", using pandas")
+    return PandasEngine()
+
+
+def benchmark(df, group_bys, engine_names=None, repeat=3, path=None):
+    # Best-of-repeat seconds per engine and group-by on the same frame, from partial states to every
+    # method's results like the app computes them. With the file's path, engines that read files are
+    # also timed aggregating the file directly.
+    results = []
+    for name in engine_names or engines:
+        engine = get_engine(name)
+        if engine.name != name:
+            continue
+        runs = [("frame", lambda group_by: engine.partial_states(df, group_by))]
+        if path is not None and engine.reads_files:
+            runs.append(("file", lambda group_by: engine.file_states(path, group_by)))
+        for source, states in runs:
+            for group_by in group_bys:
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    pa.aggregate(states(group_by), group_by, ac.methods, dtypes=df.dtypes)
+                    times.append(time.perf_counter() - start)
+                results.append({"engine": name, "source": source, "group_by": list(group_by),
+                                "rows": len(df), "seconds": min(times)})
+    return results
+
+
+if __name__ == "__main__":
+    # python -m utils.engines data.csv Category Category,Region
+    import sys
+
+    if len(sys.argv) < 3:
+        print("usage: python -m utils.engines FILE.csv GROUP_BY[,GROUP_BY...] [...]")
+        sys.exit(1)
+    frame = pd.read_csv(sys.argv[1], sep=",", encoding='Latin-1')
+    for row in benchmark(frame, [g.split(",") for g in sys.argv[2:]], path=sys.argv[1]):
+        print("{engine:8} {source:6} {group:40} {rows:>12,} rows {seconds:10.4f} s".format(group=",".join(row["group_by"]), **row))
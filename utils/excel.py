@@ -0,0 +1,179 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # pragma: no cover - optional, openpyxl read-only mode is used without it
+    CalamineWorkbook = None
+
+try:
+    import openpyxl
+except ImportError:  # pragma: no cover
+    openpyxl = None
+
+
+# Excel workbooks, one dataset per sheet. A sheet is addressed as "<workbook path>::<sheet name>",
+# so it is cached, keyed and loaded like a file of its own (see datacache.file_key).
+# Sheets are parsed with the fastest reader available: calamine (Rust, python-calamine package),
+# else openpyxl in read-only streaming mode, else pandas (e.g. xlrd for .xls). Whole workbooks are
+# parsed in parallel worker processes, one sheet per task, so every sheet of a workbook that has
+# been opened once can get its own columnar sidecar.
+
+excel_extensions = ('.xls', '.xlsm', '.xlsx')
+sheet_separator = "::"
+workers = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+_sheet_names = {}  # abs workbook path -> ((mtime_ns, size), [sheet names])
+_sheet_names_lock = threading.Lock()
+
+
+def is_excel(path):
+    return split_sheet(path)[0].endswith(excel_extensions)
+
+
+def split_sheet(path):
+    # "book.xlsx::Sales" -> ("book.xlsx", "Sales"), anything else -> (path, None)
+    workbook, sep, sheet = path.partition(sheet_separator)
+    if sep and workbook.endswith(excel_extensions):
+        return workbook, sheet
+    return path, None
+
+
+def sheet_path(path, sheet):
+    return split_sheet(path)[0] + sheet_separator + str(sheet) if sheet else path
+
+
+def is_sheet_path(path):
+    return split_sheet(path)[1] is not None
+
+
+def engine(path):
+    if CalamineWorkbook is not None:
+        return "calamine"
+    if openpyxl is not None and path.endswith(('.xlsx', '.xlsm')):
+        return "openpyxl"
+    return "pandas"
+
+
+def sheet_names(path):
+    workbook = split_sheet(path)[0]
+    st = os.stat(workbook)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _sheet_names_lock:
+        entry = _sheet_names.get(os.path.abspath(workbook))
+        if entry is not None and entry[0] == stamp:
+            return list(entry[1])
+
+    reader = engine(workbook)
+    if reader == "calamine":
+        names = CalamineWorkbook.from_path(workbook).sheet_names
+    elif reader == "openpyxl":
+        # Read-only mode only reads the workbook part here, not the sheets
+        wb = openpyxl.load_workbook(workbook, read_only=True)
+        try:
+            names = list(wb.sheetnames)
+        finally:
+            wb.close()
+    else:
+        names = pd.ExcelFile(workbook).sheet_names
+    with _sheet_names_lock:
+        _sheet_names[os.path.abspath(workbook)] = (stamp, list(names))
+    return list(names)
+
+
+def exists(path):
+    workbook, sheet = split_sheet(path)
+    if not os.path.isfile(workbook):
+        return False
+    try:
+        return sheet is None or sheet in sheet_names(workbook)
+    except Exception:
+        return False
+
+
+def _columns(header):
+    # Header cells to column names the way pd.read_excel names them
+    names, seen = [], {}
+    for i, value in enumerate(header):
+        name = "Unnamed: " + str(i) if value is None or value == "" else value
+        if name in seen:
+            seen[name] += 1
+            name = str(name) + "." + str(seen[name])
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _frame(rows):
+    rows = list(rows)
+    # Read-only sheets often report formatted but empty rows past the data
+    while len(rows) > 1 and all(v is None or v == "" for v in rows[-1]):
+        rows.pop()
+    if len(rows) == 0:
+        return pd.DataFrame()
+    width = max(len(r) for r in rows)
+    header = list(rows[0]) + [None] * (width - len(rows[0]))
+    body = [list(r) + [None] * (width - len(r)) for r in rows[1:]]
+    df = pd.DataFrame.from_records(body, columns=range(width))
+    df.columns = _columns(header)
+    # Empty cells come back as "" from calamine, as None from openpyxl, NaN like read_excel either way.
+    # Not replace("", None): before pandas 2 that fills each "" with the value above it instead.
+    return df.mask(df.isna() | df.eq(""), np.nan).infer_objects() if len(df) > 0 else df
+
+
+def parse_sheet(path, sheet=None, reader=None, nrows=None):
+    # Runs in worker processes, must stay a module-level function
+    reader = reader or engine(path)
+    if reader == "calamine":
+        wb = CalamineWorkbook.from_path(path)
+        rows = (wb.get_sheet_by_index(0) if sheet is None else wb.get_sheet_by_name(sheet)).to_python(skip_empty_area=False)
+        return _frame(rows[:None if nrows is None else nrows + 1])
+    if reader == "openpyxl":
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0] if sheet is None else wb[sheet]
+            rows = ws.iter_rows(values_only=True, max_row=None if nrows is None else nrows + 1)
+            return _frame(rows)
+        finally:
+            wb.close()
+    return pd.read_excel(path, sheet_name=0 if sheet is None else sheet, nrows=nrows)
+
+
+def forget_pool():
+    # In a forked child: the parent's pool is unusable there, the next _get_pool() starts a new one
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that runs server threads can copy held locks
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def parse_sheets(path, sheets):
+    # {sheet: raw frame} parsed in parallel worker processes. A sheet that fails is left out.
+    reader = engine(path)
+    if workers <= 1 or len(sheets) <= 1:
+        return {s: parse_sheet(path, s, reader) for s in sheets}
+    futures = {s: _get_pool().submit(parse_sheet, path, s, reader) for s in sheets}
+    frames = {}
+    for sheet, future in futures.items():
+        try:
+            frames[sheet] = future.result()
+        except Exception as e:
+            warn("COULDN'T PARSE SHEET --- " + str(path) + " --- " + str(sheet) + " --- " + str(e))
+    return frames
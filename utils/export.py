@@ -0,0 +1,124 @@
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - only Parquet export needs pyarrow
+    pa = None
+    pq = None
+
+
+# Exports of the filtered table, written chunk by chunk so a response can be streamed to the
+# browser without ever holding the whole file in memory.
+
+# format -> (mimetype, file extension)
+formats = {
+    "csv": ("text/csv", ".csv"),
+    "csv.gz": ("application/gzip", ".csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+
+def available_formats():
+    return [f for f in formats if f != "parquet" or pq is not None]
+
+
+def _slices(df, chunk_rows):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def iter_csv(df, chunk_rows=50000, compress=False):
+    return iter_csv_frames(_slices(df, chunk_rows), compress)
+
+
+def iter_csv_frames(frames, compress=False):
+    # frames: the rows to export in order, e.g. the filtered chunks of a streamed file
+    gz = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    header = True
+    for frame in frames:
+        data = frame.to_csv(header=header, index=False).encode("utf-8")
+        header = False
+        if gz is not None:
+            data = gz.compress(data)
+        if data:
+            yield data
+    if gz is not None:
+        yield gz.flush()
+
+
+class _Sink:
+    # Write-only file object the Parquet writer fills, drained after every row group
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_parquet(df, chunk_rows=50000):
+    if pq is None:
+        raise RuntimeError("Parquet export needs pyarrow")
+    # One schema for the whole frame, so every row group agrees even when a chunk is all nulls
+    return iter_parquet_frames(_slices(df, chunk_rows), pa.Schema.from_pandas(df, preserve_index=False))
+
+
+def iter_parquet_frames(frames, schema=None):
+    # Without a schema the first frame with rows sets it, later frames are cast to it (e.g. ints
+    # with missing values read as floats)
+    if pq is None:
+        raise RuntimeError("Parquet export needs pyarrow")
+
+    sink = _Sink()
+    writer = None
+    empty = None
+    try:
+        for frame in frames:
+            if len(frame) == 0:
+                empty = frame
+                continue
+            if writer is None:
+                schema = schema if schema is not None else pa.Schema.from_pandas(frame, preserve_index=False)
+                writer = pq.ParquetWriter(sink, schema)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            data = sink.drain()
+            if data:
+                yield data
+        if writer is None and empty is not None:
+            # No rows at all, still a valid file with the columns
+            schema = schema if schema is not None else pa.Schema.from_pandas(empty, preserve_index=False)
+            writer = pq.ParquetWriter(sink, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def iter_export(df, fmt, chunk_rows=50000):
+    if fmt == "parquet":
+        return iter_parquet(df, chunk_rows)
+    return iter_export_frames(_slices(df, chunk_rows), fmt)
+
+
+def iter_export_frames(frames, fmt):
+    if fmt == "csv":
+        return iter_csv_frames(frames)
+    if fmt == "csv.gz":
+        return iter_csv_frames(frames, compress=True)
+    if fmt == "parquet":
+        return iter_parquet_frames(frames)
+    raise ValueError("Unknown export format --- " + str(fmt))
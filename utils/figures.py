@@ -0,0 +1,68 @@
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+
+# Bar charts for update_graphs.
+# The dark theme lives in one registered Plotly template instead of an update_layout() call per
+# figure, and figures are plain dicts built straight from NumPy slices: going through
+# Plotly Express / go.Figure validates every property again for each column, which dominates the
+# callback for wide tables.
+
+template_name = "data_explorer_dark"
+
+
+def _build_template():
+    base = pio.templates["plotly"]
+    template = go.layout.Template(layout=base.layout)
+    template.data.bar = base.data.bar
+    # Parts of the base layout that never apply to a bar chart, they'd only bloat every figure
+    for key in ["geo", "polar", "ternary", "scene", "mapbox", "coloraxis", "colorscale",
+                "shapedefaults", "annotationdefaults"]:
+        template.layout[key] = None
+    template.layout.update({
+        'plot_bgcolor': 'rgba(0, 0, 0, 0)',
+        'paper_bgcolor': 'rgba(0, 0, 0, 0)',
+        'font_family': "Arial",
+        'font_color': "#a5b1cd",
+        'font_size': 20,
+        'title_font_color': "#a5b1cd",
+        'legend_title_font_color': "#a5b1cd",
+        'title': {'x': 0.5, 'xanchor': 'center'},
+        'xaxis': {'automargin': True},
+        'yaxis': {'automargin': True},
+    })
+    return template
+
+
+pio.templates[template_name] = _build_template()
+# Serialized once, every figure embeds the same dict
+template_json = pio.templates[template_name].to_plotly_json()
+
+
+def _values(series):
+    # Dates go over the wire as ISO strings, plotly.js still detects them as a date axis
+    if np.issubdtype(np.asarray(series).dtype, np.datetime64):
+        return np.datetime_as_string(np.asarray(series, dtype="datetime64[ns]"), unit="auto")
+    return np.asarray(series)
+
+
+def bar_figure(x, y, x_title, title, colors, tick_size, error=None):
+    figure = {
+        "data": [{
+            "type": "bar",
+            "x": _values(x),
+            "y": _values(y),
+            "marker": {"color": colors},
+        }],
+        "layout": {
+            "template": template_json,
+            "title": {"text": title},
+            "xaxis": {"title": {"text": x_title}, "tickfont": {"size": tick_size}},
+            "yaxis": {"title": {"text": title}},
+        },
+    }
+    if error is not None:
+        # e.g. the confidence interval of a sampled estimate
+        figure["data"][0]["error_y"] = {"type": "data", "array": np.asarray(error), "color": "#a5b1cd"}
+    return figure
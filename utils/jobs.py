@@ -0,0 +1,103 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Background job queue for dataset loads and aggregations.
+# Jobs are keyed, so concurrent requests for the same work attach to the one in-flight job
+# instead of starting another. Code running inside a job finds it with current_job() to report
+# progress and to check for cancellation between chunks of work.
+
+_local = threading.local()
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+def current_job():
+    return getattr(_local, "job", None)
+
+
+class Job:
+    def __init__(self, key, fn, check=None, on_progress=None, on_done=None, progress_interval=0.5):
+        self.key = key
+        self.fn = fn
+        self.check = check  # check(job) -> True when nobody wants the result any more
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.progress_interval = progress_interval
+        self.sessions = set()
+        self.future = None
+        self.error = None
+        self.fraction = 0.0
+        self.text = ""
+        self._cancel = threading.Event()
+        self._last_report = 0.0
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self):
+        return self._cancel.is_set() or (self.check is not None and self.check(self))
+
+    def raise_if_cancelled(self):
+        if self.cancelled():
+            self._cancel.set()
+            raise LoadCancelled(str(self.key))
+
+    def report(self, fraction, text=""):
+        self.fraction = fraction
+        self.text = text
+        now = time.time()
+        if self.on_progress is not None and (fraction >= 1.0 or now - self._last_report >= self.progress_interval):
+            self._last_report = now
+            self.on_progress(self, fraction, text)
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+
+class JobQueue:
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="data-loader")
+        self._jobs = {}  # key -> in-flight Job
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, session_id=None, check=None, on_progress=None, on_done=None):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job.done() or job._cancel.is_set():
+                job = Job(key, fn, check=check, on_progress=on_progress, on_done=on_done)
+                self._jobs[key] = job
+                if session_id is not None:
+                    job.sessions.add(session_id)
+                job.future = self._executor.submit(self._run, job)
+            elif session_id is not None:
+                job.sessions.add(session_id)
+        return job
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def _run(self, job):
+        _local.job = job
+        try:
+            job.raise_if_cancelled()
+            return job.fn()
+        except LoadCancelled:
+            job.error = "cancelled"
+        except Exception as e:
+            job.error = str(e)
+        finally:
+            _local.job = None
+            with self._lock:
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+            if job.on_done is not None:
+                job.on_done(job)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
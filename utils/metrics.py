@@ -0,0 +1,163 @@
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+# In-process timing metrics, rendered in the Prometheus text format for the /metrics route.
+# Callbacks are wrapped with instrument(), internal stages (file reads, group-bys, records
+# serialization, figures, exports) with timed(). Histograms use fixed buckets so they can be
+# aggregated by Prometheus across scrapes; every worker process keeps its own.
+# Profiling is armed per callback for the next N calls (see arm_profile()), the cProfile stats
+# of those calls are kept for the /profile route.
+
+prefix = "data_explorer_"
+seconds_buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+bytes_buckets = [1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2]
+max_profiles = 20
+
+_lock = threading.Lock()
+_histograms = {}  # name -> {"help": str, "buckets": [...], "series": {labels tuple: [bucket counts, sum, count]}}
+_gauges = []  # (name, help, fn() -> {labels tuple: value})
+_profile_armed = {}  # callback name -> remaining calls to profile
+_profiles = deque(maxlen=max_profiles)
+
+
+def histogram(name, help_text, buckets=None):
+    with _lock:
+        _histograms.setdefault(name, {"help": help_text, "buckets": buckets or seconds_buckets, "series": {}})
+
+
+def observe(name, value, **labels):
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        metric = _histograms[name]
+        series = metric["series"].get(key)
+        if series is None:
+            series = metric["series"][key] = [[0] * len(metric["buckets"]), 0.0, 0]
+        for i, bound in enumerate(metric["buckets"]):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+
+def gauge(name, help_text, fn):
+    # fn() is called at scrape time and returns {labels dict as a tuple of pairs: value}
+    with _lock:
+        _gauges.append((name, help_text, fn))
+
+
+def process_memory():
+    # {"rss", "pss", "shared", "private"} bytes of this process. Of a forked worker's RSS, "shared" is
+    # still shared with the other processes and pss splits it evenly between them. Linux only, {} elsewhere.
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f if line.split()[-1] == "kB"}
+    except (OSError, ValueError, IndexError):
+        return {}
+    return {"rss": fields.get("Rss", 0), "pss": fields.get("Pss", 0),
+            "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+            "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)}
+
+
+histogram("callback_seconds", "Time spent in each Dash callback")
+histogram("stage_seconds", "Time spent in each internal stage of a callback")
+histogram("response_bytes", "Size of Dash callback responses", bytes_buckets)
+histogram("request_bytes", "Size of Dash callback requests", bytes_buckets)
+
+
+@contextmanager
+def timed(stage, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+
+def arm_profile(callback, count=1):
+    with _lock:
+        _profile_armed[callback] = _profile_armed.get(callback, 0) + max(int(count), 0)
+
+
+def _take_profile(callback):
+    with _lock:
+        remaining = _profile_armed.get(callback, 0)
+        if remaining <= 0:
+            return False
+        _profile_armed[callback] = remaining - 1
+        return True
+
+
+def profiles():
+    with _lock:
+        return list(_profiles)
+
+
+def instrument(fn):
+    # Goes directly under @app.callback(...), so Dash sees the callback's own name and signature
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profiler = cProfile.Profile() if _take_profile(name) else None
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            if profiler is None:
+                return fn(*args, **kwargs)
+            return profiler.runcall(fn, *args, **kwargs)
+        except Exception as e:
+            # PreventUpdate is how callbacks skip an update, not a failure
+            status = "skipped" if type(e).__name__ == "PreventUpdate" else "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            observe("callback_seconds", seconds, callback=name, status=status)
+            if profiler is not None:
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+                with _lock:
+                    _profiles.append({"callback": name, "time": time.time(), "seconds": seconds, "stats": out.getvalue()})
+
+    return wrapper
+
+
+def _labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"' for k, v in pairs) + "}"
+
+
+def render():
+    lines = []
+    with _lock:
+        histograms = {name: {"help": m["help"], "buckets": list(m["buckets"]),
+                             "series": {k: [list(s[0]), s[1], s[2]] for k, s in m["series"].items()}}
+                      for name, m in _histograms.items()}
+        gauges = list(_gauges)
+
+    for name, metric in histograms.items():
+        full = prefix + name
+        lines.append("# HELP " + full + " " + metric["help"])
+        lines.append("# TYPE " + full + " histogram")
+        for key, (counts, total, count) in sorted(metric["series"].items()):
+            for bound, n in zip(metric["buckets"], counts):
+                lines.append(full + "_bucket" + _labels(key, [("le", repr(float(bound)))]) + " " + str(n))
+            lines.append(full + "_bucket" + _labels(key, [("le", "+Inf")]) + " " + str(count))
+            lines.append(full + "_sum" + _labels(key) + " " + repr(total))
+            lines.append(full + "_count" + _labels(key) + " " + str(count))
+
+    for name, help_text, fn in gauges:
+        full = prefix + name
+        lines.append("# HELP " + full + " " + help_text)
+        lines.append("# TYPE " + full + " gauge")
+        for key, value in sorted(fn().items()):
+            lines.append(full + _labels(key) + " " + repr(float(value)))
+    return "\n".join(lines) + "\n"
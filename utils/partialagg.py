@@ -0,0 +1,320 @@
+import hashlib
+import json
+import os
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather as feather
+except ImportError:  # pragma: no cover - states are then only kept in memory
+    pyarrow = None
+
+
+# Mergeable partial group-by states.
+# A state table is indexed by the group-by keys and has (column, stat) columns: for numeric
+# columns n / sum / mean / m2 (sum of squared deviations) / min / max, for other columns
+# min / max, plus ("", "size") for the row count. States of two chunks combine with Chan's
+# parallel update, so the Aggregation Method dropdown can be answered for data that is
+# never in memory all at once. Every method is finalized from the same table, and tables are
+# saved to disk (write_states / read_states) so other worker processes and later runs can
+# reuse or extend them instead of grouping the rows again.
+
+size_col = ("", "size")
+coded_sample_rows = 10000
+coded_max_ratio = 0.5  # text columns with at most this share of distinct values in a sample are reduced as codes
+numeric_stats = ["n", "sum", "mean", "m2", "min", "max"]
+other_stats = ["min", "max"]
+
+
+def _is_numeric(series):
+    return pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+
+
+def _coded_extremes(codes, values, keys):
+    # Min / max per group of codes that sort like values (an Index), mapped back to plain values
+    codes = pd.Series(codes.astype("float64"), index=keys[0].index)
+    codes[codes < 0] = np.nan
+    grouper = codes.groupby(keys, observed=True, sort=False)
+    extremes = []
+    for reduced in [grouper.min(), grouper.max()]:
+        taken = values.take(reduced.fillna(-1).astype("int64").to_numpy(), allow_fill=True, fill_value=np.nan)
+        extremes.append(pd.Series(np.asarray(taken, dtype=object), index=reduced.index))
+    return extremes
+
+
+def _sorted_codes(series, force=False):
+    # (codes, values) with codes ordered like the values, None when they don't sort or aren't worth coding
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, values = series.cat.codes.to_numpy(), series.cat.categories
+    else:
+        # Mostly distinct text is compared directly, sorting all of its values would cost more
+        sample = series.iloc[:coded_sample_rows]
+        if series.dtype != object or (not force and sample.nunique() > coded_max_ratio * len(sample)):
+            return None
+        codes, values = pd.factorize(series)
+    if len(values) == 0:
+        return None
+    if values.is_monotonic_increasing:
+        return codes, values
+    try:
+        values, order = values.sort_values(return_indexer=True)
+    except TypeError:
+        return None
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return np.where(codes >= 0, rank[np.maximum(codes, 0)], -1), values
+
+
+def partial_states(df, group_by):
+    group_by = list(group_by)
+    grouper = df.groupby(by=group_by, observed=True, sort=False)
+    values = [c for c in df.columns if c not in group_by]
+    numeric = [c for c in values if _is_numeric(df[c])]
+
+    size = grouper.size()
+    if len(numeric) > 0:
+        n = grouper[numeric].count()
+        total = grouper[numeric].sum()
+        m2 = grouper[numeric].var(ddof=0) * n
+        mins = grouper[numeric].min()
+        maxs = grouper[numeric].max()
+
+    # Extremes of text / dates / categories, kept as plain values so chunks line up. Text and
+    # categories are reduced as integer codes that sort like their values when possible.
+    extremes = {}
+    for c in values:
+        if c not in numeric:
+            coded = _sorted_codes(df[c])
+            if coded is not None:
+                extremes[c] = _coded_extremes(coded[0], coded[1], [df[k] for k in group_by])
+    plain = [c for c in values if c not in numeric and c not in extremes]
+    if len(plain) > 0:
+        columns = {c: df[c].astype(object) if isinstance(df[c].dtype, pd.CategoricalDtype) else df[c] for c in plain}
+        keys = [df[k] for k in group_by]
+        try:
+            plain_grouper = pd.DataFrame(columns).groupby(keys, observed=True, sort=False)
+            plain_mins, plain_maxs = plain_grouper.min(), plain_grouper.max()
+            for c in plain:
+                extremes[c] = [plain_mins[c], plain_maxs[c]]
+        except TypeError:
+            # Text with missing values, or mixed types (e.g. numbers and text in one column, compared
+            # as text like merge_states does): reduced as codes after all
+            for c in plain:
+                coded = _sorted_codes(columns[c], force=True) or \
+                    _sorted_codes(columns[c].astype(str).where(columns[c].notna()), force=True)
+                extremes[c] = _coded_extremes(coded[0], coded[1], keys) if coded is not None else \
+                    [pd.Series(None, index=size.index, dtype=object) for _ in range(2)]
+
+    # Columns in the frame's order, so finalized tables list them like the data does
+    parts = {size_col: size}
+    for c in values:
+        if c in numeric:
+            parts[(c, "n")] = n[c]
+            parts[(c, "sum")] = total[c]
+            parts[(c, "mean")] = total[c] / n[c].where(n[c] > 0)
+            parts[(c, "m2")] = m2[c].fillna(0.0)
+            parts[(c, "min")] = mins[c]
+            parts[(c, "max")] = maxs[c]
+        else:
+            parts[(c, "min")], parts[(c, "max")] = extremes[c]
+
+    states = pd.DataFrame(parts)
+    states.columns = pd.MultiIndex.from_tuples(list(parts.keys()))
+    return states
+
+
+def _extreme(a, b, how):
+    # Per group, skipping a side that has no value: a group missing from one piece is NaN there
+    # after the reindex, and NaN doesn't compare with text
+    result = a.where(a.notna(), b)
+    both = a.notna() & b.notna()
+    if not both.any():
+        return result
+    left, right = a[both], b[both]
+    try:
+        better = right < left if how == "min" else right > left
+    except TypeError:
+        # Mixed types across pieces (e.g. numbers in one, text in another), compared as text
+        left, right = left.astype(str), right.astype(str)
+        better = right < left if how == "min" else right > left
+    take = pd.Series(False, index=a.index)
+    take[both] = better.to_numpy(dtype=bool)
+    return result.where(~take, b)
+
+
+def merge_states(a, b):
+    if a is None or len(a) == 0:
+        return b
+    if b is None or len(b) == 0:
+        return a
+
+    # Integer sums / extremes stay integers when every group has a value
+    int_columns = [c for c in dict.fromkeys(list(a.columns) + list(b.columns)) if
+                   all(pd.api.types.is_integer_dtype(x[c].dtype) for x in [a, b] if c in x.columns)]
+
+    index = a.index.union(b.index)
+    a = a.reindex(index)
+    b = b.reindex(index)
+    columns = list(dict.fromkeys(list(a.columns) + list(b.columns)))
+
+    merged = {size_col: a[size_col].fillna(0) + b[size_col].fillna(0)}
+    for col, stat in columns:
+        if (col, stat) == size_col or stat in ["n", "sum", "mean", "m2"]:
+            continue
+        left = a[(col, stat)] if (col, stat) in a.columns else pd.Series(np.nan, index=index)
+        right = b[(col, stat)] if (col, stat) in b.columns else pd.Series(np.nan, index=index)
+        merged[(col, stat)] = _extreme(left, right, stat)
+
+    for col in dict.fromkeys(c for c, s in columns if s == "n"):
+        na = a[(col, "n")].fillna(0) if (col, "n") in a.columns else pd.Series(0.0, index=index)
+        nb = b[(col, "n")].fillna(0) if (col, "n") in b.columns else pd.Series(0.0, index=index)
+        mean_a = a[(col, "mean")].fillna(0) if (col, "mean") in a.columns else pd.Series(0.0, index=index)
+        mean_b = b[(col, "mean")].fillna(0) if (col, "mean") in b.columns else pd.Series(0.0, index=index)
+        m2_a = a[(col, "m2")].fillna(0) if (col, "m2") in a.columns else pd.Series(0.0, index=index)
+        m2_b = b[(col, "m2")].fillna(0) if (col, "m2") in b.columns else pd.Series(0.0, index=index)
+        sum_a = a[(col, "sum")].fillna(0) if (col, "sum") in a.columns else pd.Series(0.0, index=index)
+        sum_b = b[(col, "sum")].fillna(0) if (col, "sum") in b.columns else pd.Series(0.0, index=index)
+
+        n = na + nb
+        safe_n = n.where(n > 0)
+        delta = mean_b - mean_a
+        merged[(col, "n")] = n
+        merged[(col, "sum")] = sum_a + sum_b
+        merged[(col, "mean")] = (mean_a + delta * nb / safe_n).where(n > 0)
+        merged[(col, "m2")] = (m2_a + m2_b + delta ** 2 * na * nb / safe_n).fillna(0.0)
+
+    for c in int_columns:
+        if c in merged and merged[c].notna().all():
+            merged[c] = merged[c].astype("int64")
+
+    states = pd.DataFrame(merged, index=index)
+    states.columns = pd.MultiIndex.from_tuples(list(merged.keys()))
+    return states[[c for c in columns if c in states.columns]]
+
+
+def combine(states_list):
+    result = None
+    for states in states_list:
+        result = merge_states(result, states)
+    return result
+
+
+def _stat_columns(states, stat):
+    return [c for c, s in states.columns if s == stat and (c, s) != size_col]
+
+
+def _restore_dtypes(result, dtypes):
+    # States hold categories as plain values; give columns back the dataset's categories when they cover them
+    for c in result.columns:
+        dtype = dtypes.get(c)
+        if isinstance(dtype, pd.CategoricalDtype) and not isinstance(result[c].dtype, pd.CategoricalDtype):
+            values = result[c]
+            try:
+                if values.dropna().isin(dtype.categories).all():
+                    result[c] = pd.Categorical(values, dtype=dtype)
+            except (TypeError, ValueError):
+                continue
+    return result
+
+
+def finalize(states, method, group_by, dtypes=None):
+    # dtypes: the dataset's column dtypes, to give category columns back their categories
+    group_by = list(group_by)
+    states = states.sort_index()
+
+    if method == "Count":
+        result = states[size_col].astype("int64").rename("size").to_frame()
+    elif method in ["Sum", "Mean", "Standard Deviation", "Variance"]:
+        columns = _stat_columns(states, "n")
+        data = {}
+        for c in columns:
+            n = states[(c, "n")]
+            if method == "Sum":
+                data[c] = states[(c, "sum")]
+            elif method == "Mean":
+                data[c] = states[(c, "mean")].where(n > 0)
+            else:
+                var = states[(c, "m2")] / (n - 1).where(n > 1)
+                data[c] = np.sqrt(var) if method == "Standard Deviation" else var
+        result = pd.DataFrame(data, index=states.index)
+    elif method in ["Min", "Max"]:
+        stat = "min" if method == "Min" else "max"
+        columns = _stat_columns(states, stat)
+        result = pd.DataFrame({c: states[(c, stat)] for c in columns}, index=states.index)
+    else:
+        raise ValueError("Unknown aggregation method --- " + str(method))
+
+    result.index.names = group_by
+    result = result.reset_index()
+    return result if dtypes is None else _restore_dtypes(result, dict(dtypes))
+
+
+def aggregate(states, group_by, methods, dtypes=None):
+    # {method: group-by result} for every method, from one state table
+    return {method: finalize(states, method, group_by, dtypes) for method in methods}
+
+
+# Saved states: one file per dataset and group-by, tagged with the dataset's file key
+# (see datacache.file_key) so a file that changed is never answered from old states.
+
+_meta_key = b"data_explorer.file_key"
+_meta_group_by = b"data_explorer.group_by"
+
+
+def states_path(key, group_by, cache_dir):
+    digest = hashlib.sha1((str(key[0]) + "|" + repr(list(group_by))).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, os.path.basename(str(key[0])).replace(":", "_") + "-" + digest + ".states.feather")
+
+
+def _column_name(name):
+    # JSON of [column, stat] for state columns, of [key] for the group-by keys, so they never collide
+    return json.dumps(list(name) if isinstance(name, tuple) else [name])
+
+
+def write_states(states, key, group_by, cache_dir):
+    if not cache_dir or pyarrow is None or states is None:
+        return
+    path = states_path(key, group_by, cache_dir)
+    tmp_path = path + ".tmp-" + str(os.getpid())
+    try:
+        flat = states.reset_index()
+        flat.columns = [_column_name(c[0] if c[1] == "" and c[0] in group_by else c) for c in flat.columns]
+        table = pyarrow.Table.from_pandas(flat, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata.update({_meta_key: json.dumps(list(key)).encode(), _meta_group_by: json.dumps(list(group_by)).encode()})
+        os.makedirs(cache_dir, exist_ok=True)
+        feather.write_feather(table.replace_schema_metadata(metadata), tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    except Exception as e:
+        # e.g. text extremes of mixed types that Arrow can't represent
+        warn("COULDN'T SAVE AGGREGATION STATES --- " + str(key[0]) + " --- " + str(e))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_states(key, group_by, cache_dir):
+    # The saved states of this version of the dataset, None when there are none
+    if not cache_dir or pyarrow is None:
+        return None
+    path = states_path(key, group_by, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = feather.read_table(path)
+        metadata = table.schema.metadata or {}
+        if json.loads(metadata.get(_meta_key, b"null")) != json.loads(json.dumps(list(key))) or \
+                json.loads(metadata.get(_meta_group_by, b"null")) != list(group_by):
+            return None
+        flat = table.to_pandas()
+    except Exception as e:
+        warn("COULDN'T READ AGGREGATION STATES --- " + str(path) + " --- " + str(e))
+        return None
+    names = [tuple(json.loads(c)) for c in flat.columns]
+    flat.columns = [n[0] if len(n) == 1 else n for n in names]
+    states = flat.set_index(list(group_by))
+    states.columns = pd.MultiIndex.from_tuples(list(states.columns))
+    return states
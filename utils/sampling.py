@@ -0,0 +1,139 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import utils.aggcache as ac
+import utils.datacache as dc
+
+
+# Sampled estimates of group-by results, for a quick first look at datasets whose exact
+# aggregation takes a while. Count and Sum are scaled up from a uniform sample to the whole
+# dataset, and come with the half-width of a normal-approximation confidence interval in a
+# "<column> ±" column; Mean gets an interval as well. The other methods are computed on the
+# sample as is.
+# Large CSV files are sampled without reading them: blocks of lines are read at random byte
+# offsets, and the total row count is estimated from the average line length.
+
+sample_rows = 100000
+sample_blocks = 200  # random offsets a CSV sample is read from
+z_score = 1.96  # 95% confidence
+ci_suffix = " ±"
+estimated_methods = ["Count", "Sum", "Mean"]
+
+_samples = OrderedDict()  # file key -> (sample frame, estimated total rows)
+_samples_lock = threading.Lock()
+_max_samples = 8
+_estimates = OrderedDict()  # (file key, group-by, method) -> estimate frame
+_max_estimates = 32
+
+
+def sample_frame(df, n=None, seed=0):
+    n = sample_rows if n is None else n
+    if len(df) <= n:
+        return df, len(df)
+    return df.sample(n=n, random_state=seed), len(df)
+
+
+def sample_csv(path, n=None, blocks=None, seed=0):
+    n = sample_rows if n is None else n
+    blocks = sample_blocks if blocks is None else blocks
+    rng = np.random.default_rng(seed)
+    size = os.path.getsize(path)
+
+    with open(path, "rb") as f:
+        header = f.readline()
+        body_bytes = size - len(header)
+        lines_per_block = max(1, int(np.ceil(n / float(blocks))))
+        lines = []
+        for offset in np.sort(rng.integers(len(header), max(size, len(header) + 1), size=blocks)):
+            f.seek(offset)
+            f.readline()  # skip to the start of the next full line
+            for _ in range(lines_per_block):
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line if line.endswith(b"\n") else line + b"\n")
+
+    if len(lines) == 0 or body_bytes <= sum(len(l) for l in lines):
+        # Small file, the blocks would overlap: read it whole instead
+        df = pd.read_csv(path, sep=",", encoding='Latin-1')
+        return sample_frame(df, n, seed)
+
+    df = pd.read_csv(io.BytesIO(header + b"".join(lines)), sep=",", encoding='Latin-1', on_bad_lines='skip')
+    total_rows = int(round(body_bytes / (sum(len(l) for l in lines) / float(len(lines)))))
+    return df, max(total_rows, len(df))
+
+
+def cached_sample(path, make_sample):
+    # make_sample(path) -> (sample frame, estimated total rows), kept per file version
+    key = dc.file_key(path)
+    with _samples_lock:
+        entry = _samples.get(key)
+        if entry is not None:
+            _samples.move_to_end(key)
+            return entry
+    entry = make_sample(path)
+    with _samples_lock:
+        _samples[key] = entry
+        while len(_samples) > _max_samples:
+            _samples.popitem(last=False)
+    return entry
+
+
+def estimate(sample, total_rows, group_by, method, z=None):
+    z = z_score if z is None else z
+    group_by = list(group_by)
+    if method not in estimated_methods:
+        return ac.aggregate(sample, group_by, [method])[method]
+
+    n = len(sample)
+    scale = total_rows / float(max(n, 1))
+    grouper = sample.groupby(by=group_by, observed=True)
+
+    if method == "Count":
+        size = grouper.size()
+        p = size / float(max(n, 1))
+        result = pd.DataFrame({"size": (size * scale).round().astype("int64"),
+                               "size" + ci_suffix: z * total_rows * np.sqrt(p * (1 - p) / max(n, 1))})
+        return result.reset_index()
+
+    numeric = ac._numeric_columns(sample, ac._value_columns(sample, group_by))
+    data = {}
+    if method == "Sum":
+        # Each row contributes y when it is in the group and 0 otherwise, the sum is N times that mean
+        sums = grouper[numeric].sum()
+        squares = sample[numeric].astype("float64").pow(2).groupby([sample[k] for k in group_by], observed=True).sum()
+        for c in numeric:
+            var = (squares[c] - sums[c] ** 2 / n) / max(n - 1, 1)
+            data[c] = sums[c] * scale
+            data[c + ci_suffix] = z * total_rows * np.sqrt(var.clip(lower=0) / n)
+    else:
+        means = grouper[numeric].mean()
+        stds = grouper[numeric].std()
+        counts = grouper[numeric].count()
+        for c in numeric:
+            data[c] = means[c]
+            data[c + ci_suffix] = z * stds[c] / np.sqrt(counts[c].where(counts[c] > 0))
+
+    index = grouper.size().index
+    return pd.DataFrame(data, index=index).reset_index()
+
+
+def cached_estimate(path, sample, total_rows, group_by, method):
+    # The table and the charts both read the estimate on every interaction, it's computed once per sample
+    key = (dc.file_key(path), tuple(group_by), method)
+    with _samples_lock:
+        entry = _estimates.get(key)
+        if entry is not None and entry[0] is sample:
+            _estimates.move_to_end(key)
+            return entry[1]
+    result = estimate(sample, total_rows, group_by, method)
+    with _samples_lock:
+        _estimates[key] = (sample, result)
+        while len(_estimates) > _max_estimates:
+            _estimates.popitem(last=False)
+    return result
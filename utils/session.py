@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows, updates are only serialized within a process
+    fcntl = None
+
+
+# Per-session application state (current dataset, group-by, aggregation method), keyed by the
+# session id each page load stores in a dcc.Store. With a directory configured, state is kept
+# as small JSON files so every worker process behind the same server sees the same sessions;
+# otherwise it lives in this process only. Updates are read-modify-writes serialized across threads,
+# and across processes with a lock file in the directory, so a loader thread reporting progress
+# and a request starting a new load never overwrite each other's keys.
+
+lock_name = ".lock"
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class SessionStore:
+    def __init__(self, directory=None, ttl_seconds=12 * 3600, on_expire=None):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.on_expire = on_expire  # called with (session_id, state) when an idle session is dropped
+        self._states = {}  # session id -> state, for sessions served by this process
+        self._last_access = {}
+        self._last_sweep = 0.0
+        self._lock = threading.RLock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _file(self, session_id):
+        # Session ids come from the browser, never let them pick the path
+        return os.path.join(self.directory, uuid.UUID(hex=str(session_id)).hex + ".json")
+
+    def _read(self, session_id):
+        with self._lock:
+            self._last_access[session_id] = time.time()
+            state = self._states.get(session_id)
+        if self.directory:
+            try:
+                with open(self._file(session_id), "r") as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                pass
+        return dict(state or {})
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if not self.directory or fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, lock_name), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, session_id):
+        if session_id is None:
+            return {}
+        state = self._read(session_id)
+        self.sweep()
+        return state
+
+    def update(self, session_id, **values):
+        return self.modify(session_id, lambda state: values)
+
+    def modify(self, session_id, change):
+        # change(current state) -> the keys to set, or None to leave the state as it is. Runs under
+        # the update lock, so checks like "is this still the session's load?" can't go stale.
+        if session_id is None:
+            return dict(change({}) or {})
+        with self._locked():
+            state = self._read(session_id)
+            values = change(dict(state))
+            if values is not None:
+                state.update(values)
+                self._states[session_id] = state
+                if self.directory:
+                    path = self._file(session_id)
+                    tmp_path = path + ".tmp-" + str(os.getpid())
+                    with open(tmp_path, "w") as f:
+                        json.dump(state, f)
+                    os.replace(tmp_path, path)
+        self.sweep()
+        return dict(state)
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            if now - self._last_sweep < min(60, self.ttl_seconds):
+                return
+            self._last_sweep = now
+            expired = [sid for sid, t in self._last_access.items() if now - t > self.ttl_seconds]
+            states = [(sid, self._states.pop(sid, {})) for sid in expired]
+            for sid in expired:
+                del self._last_access[sid]
+
+        for sid, state in states:
+            if self.on_expire is not None:
+                self.on_expire(sid, state)
+
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name == lock_name:
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl_seconds:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def __len__(self):
+        with self._lock:
+            return len(self._states)
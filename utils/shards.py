@@ -0,0 +1,201 @@
+import glob
+import hashlib
+import os
+import re
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import utils.catalog as cg
+import utils.jobs as jobs
+import utils.partialagg as pa
+import utils.typeinfer as ti
+
+
+# Datasets made of several files: a folder ("daily/") or a glob ("orders_*.csv") is read as one
+# logical dataset, the concatenation of its shards in name order.
+# Shards are read in parallel on a thread pool (the CSV / Excel parsers release the GIL for most
+# of their work, and a process pool would have to pickle every frame back) and each one goes
+# through its own sidecar. When shards are added or rewritten, the unchanged ones are sliced out
+# of the previous frame instead of being read again.
+# Group-bys keep a partial state per shard (see utils/partialagg.py), so after an update only the
+# new shards are aggregated and merged with the states already computed.
+
+glob_chars = "*?["
+workers = 4
+states_max_bytes = 256 * 1024 ** 2
+
+_pool = None
+_pool_lock = threading.Lock()
+_layouts = {}  # abs dataset path -> (weakref to the concatenated frame, [(shard key, start row, stop row)])
+_layouts_lock = threading.Lock()
+_states = OrderedDict()  # (shard key, group-by) -> (partial states, nbytes)
+_states_bytes = 0
+_states_lock = threading.Lock()
+
+
+def is_sharded(path):
+    # A file that exists is itself, even when its name has glob characters, e.g. "report[1].csv"
+    if os.path.isdir(path):
+        return True
+    return any(c in os.path.basename(path) for c in glob_chars) and not os.path.isfile(path)
+
+
+def shard_paths(path):
+    pattern = os.path.join(path, "*") if os.path.isdir(path) else path
+    return sorted(p for p in glob.glob(pattern) if p.endswith(cg.data_extensions) and os.path.isfile(p))
+
+
+def shard_key(path):
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def dataset_key(path):
+    # Changes whenever a shard is added, removed or rewritten, like a file's (mtime, size)
+    keys = [shard_key(p) for p in shard_paths(path)]
+    if len(keys) == 0:
+        raise FileNotFoundError("NO DATA FILES MATCH --- " + str(path))
+    digest = hashlib.sha1(repr(keys).encode("utf-8")).hexdigest()[:16]
+    return (os.path.abspath(path), digest, sum(k[2] for k in keys))
+
+
+def exists(path):
+    return len(shard_paths(path)) > 0 if is_sharded(path) else os.path.isfile(path)
+
+
+def shard_pattern(name):
+    # "orders_2026_10_01.csv" -> "orders_*.csv": runs of digits and the separators between them
+    return re.sub(r"\d+(?:[_\-.]\d+)*", "*", name)
+
+
+def group_options(names, min_shards=2):
+    # {glob: number of files} for the file names that look like shards of one dataset,
+    # and {folder/: number of files} for folders holding data files
+    patterns, folders = {}, {}
+    for name in names:
+        directory, base = os.path.split(name)
+        pattern = shard_pattern(base)
+        if pattern != base:
+            key = os.path.join(directory, pattern)
+            patterns[key] = patterns.get(key, 0) + 1
+        if directory:
+            folders[directory + os.sep] = folders.get(directory + os.sep, 0) + 1
+    return ({p: n for p, n in patterns.items() if n >= min_shards},
+            {f: n for f, n in folders.items() if n >= min_shards})
+
+
+def forget_pool():
+    # In a forked child: the parent's pool is unusable there, the next _get_pool() starts a new one
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="shards")
+        return _pool
+
+
+def _previous_slices(path, previous):
+    # shard key -> rows of that shard in the previous frame, when it's still the one we built
+    with _layouts_lock:
+        entry = _layouts.get(os.path.abspath(path))
+    if previous is None or entry is None or entry[0]() is not previous:
+        return {}
+    return {key: previous.iloc[start:stop] for key, start, stop in entry[1]}
+
+
+def load(path, read_shard, previous=None, progress=None, cancelled=None):
+    # read_shard(shard path) -> frame. previous is the frame of an older version of the dataset
+    shards = shard_paths(path)
+    if len(shards) == 0:
+        raise FileNotFoundError("NO DATA FILES MATCH --- " + str(path))
+    keys = [shard_key(p) for p in shards]
+    frames = _previous_slices(path, previous)
+    missing = [(p, k) for p, k in zip(shards, keys) if k not in frames]
+
+    futures = {_get_pool().submit(read_shard, p): k for p, k in missing}
+    try:
+        done = 0
+        for future, key in futures.items():
+            frames[key] = future.result()
+            done += 1
+            if progress is not None:
+                progress(done / float(len(futures)))
+            if cancelled is not None and cancelled():
+                raise jobs.LoadCancelled(path)
+    finally:
+        for future in futures:
+            future.cancel()
+
+    ordered = [frames[k] for k in keys]
+    df = pd.concat(ordered, ignore_index=True, sort=False) if len(ordered) > 1 else ordered[0].reset_index(drop=True)
+
+    # Shards whose categories differ concatenate to object columns, make them categories again.
+    # Numbers of shards read with different widths are narrowed to what the whole dataset fits.
+    first = ordered[0]
+    for c in df.columns:
+        if c in first.columns and isinstance(first[c].dtype, pd.CategoricalDtype) and \
+                not isinstance(df[c].dtype, pd.CategoricalDtype):
+            df[c] = df[c].astype("category")
+        elif len(ordered) > 1 and pd.api.types.is_numeric_dtype(df[c].dtype):
+            df[c] = ti.downcast_numeric(df[c])
+
+    layout, start = [], 0
+    for key, frame in zip(keys, ordered):
+        layout.append((key, start, start + len(frame)))
+        start += len(frame)
+    with _layouts_lock:
+        _layouts[os.path.abspath(path)] = (weakref.ref(df), layout)
+    return df
+
+
+def layout(path, df):
+    # [(shard key, start row, stop row)] of a frame built by load(), None for any other frame
+    with _layouts_lock:
+        entry = _layouts.get(os.path.abspath(path))
+    if entry is None or entry[0]() is not df:
+        return None
+    return entry[1]
+
+
+def _shard_states(key, group_by, frame):
+    global _states_bytes
+    cache_key = (key, tuple(group_by))
+    with _states_lock:
+        entry = _states.get(cache_key)
+        if entry is not None:
+            _states.move_to_end(cache_key)
+            return entry[0]
+    states = pa.partial_states(frame, group_by)
+    nbytes = int(states.memory_usage(index=True, deep=True).sum())
+    with _states_lock:
+        if cache_key not in _states:
+            _states[cache_key] = (states, nbytes)
+            _states_bytes += nbytes
+        while _states_bytes > states_max_bytes and len(_states) > 1:
+            _, (_, dropped) = _states.popitem(last=False)
+            _states_bytes -= dropped
+    return states
+
+
+def states(path, df, group_by):
+    # Partial states of a sharded frame, merged from per-shard states; None if df isn't one
+    shards = layout(path, df)
+    if shards is None:
+        return None
+    group_by = list(group_by)
+    futures = [_get_pool().submit(_shard_states, key, group_by, df.iloc[start:stop]) for key, start, stop in shards]
+    return pa.combine(f.result() for f in futures)
+
+
+def states_stats():
+    with _states_lock:
+        return {"entries": len(_states), "current_bytes": _states_bytes, "max_bytes": states_max_bytes}
@@ -0,0 +1,108 @@
+import hashlib
+import os
+from warnings import warn
+
+import utils.excel as xl
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - sidecars are an optional speed-up
+    pa = None
+
+
+# Columnar sidecar files for CSV / Excel sources.
+# The first time a file is parsed, the typed frame is written to the cache directory as Arrow
+# (Feather) or Parquet, tagged with the source file's mtime and size. Later opens memory-map the
+# sidecar instead of parsing the source again, as long as the source hasn't changed.
+
+formats = {"feather": ".feather", "parquet": ".parquet"}
+
+_meta_mtime = b"data_explorer.source_mtime_ns"
+_meta_size = b"data_explorer.source_size"
+
+
+def available():
+    return pa is not None
+
+
+def sidecar_path(path, cache_dir, fmt="feather", variant=None):
+    abs_path = os.path.abspath(path)
+    digest = hashlib.sha1((abs_path + "|" + repr(variant)).encode("utf-8")).hexdigest()[:16]
+    # Sheets ("book.xlsx::Sales") get one sidecar each, ":" isn't allowed in file names everywhere
+    return os.path.join(cache_dir, os.path.basename(path).replace(":", "_") + "-" + digest + formats[fmt])
+
+
+def _source_stamp(path):
+    st = os.stat(xl.split_sheet(path)[0])
+    return str(st.st_mtime_ns).encode(), str(st.st_size).encode()
+
+
+def _read_metadata(path, fmt):
+    if fmt == "parquet":
+        return pq.read_schema(path, memory_map=True).metadata or {}
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).schema.metadata or {}
+
+
+def is_fresh(path, sidecar, fmt="feather"):
+    if not os.path.exists(sidecar):
+        return False
+    try:
+        meta = _read_metadata(sidecar, fmt)
+    except Exception:
+        return False
+    mtime, size = _source_stamp(path)
+    return meta.get(_meta_mtime) == mtime and meta.get(_meta_size) == size
+
+
+def read_sidecar(sidecar, fmt="feather"):
+    if fmt == "parquet":
+        table = pq.read_table(sidecar, memory_map=True)
+    else:
+        table = feather.read_table(sidecar, memory_map=True)
+    # split_blocks lets null-free numeric columns stay views onto the mapped file, so worker
+    # processes reading the same sidecar share those pages through the OS page cache
+    return table.to_pandas(split_blocks=True)
+
+
+def write_sidecar(df, path, sidecar, fmt="feather"):
+    mtime, size = _source_stamp(path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({_meta_mtime: mtime, _meta_size: size})
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+    # Write next to the final name and swap it in, so readers never see a partial file
+    tmp_path = sidecar + ".tmp-" + str(os.getpid())
+    try:
+        if fmt == "parquet":
+            pq.write_table(table, tmp_path)
+        else:
+            feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, sidecar)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_through(path, loader, cache_dir, fmt="feather", variant=None):
+    if not cache_dir or not available():
+        return loader(path)
+
+    sidecar = sidecar_path(path, cache_dir, fmt, variant)
+    if is_fresh(path, sidecar, fmt):
+        try:
+            return read_sidecar(sidecar, fmt)
+        except Exception as e:
+            warn("COULDN'T READ SIDECAR, RE-PARSING --- " + str(sidecar) + " --- " + str(e))
+
+    df = loader(path)
+    try:
+        write_sidecar(df, path, sidecar, fmt)
+    except Exception as e:
+        # e.g. object columns holding mixed types that Arrow can't represent
+        warn("COULDN'T WRITE SIDECAR --- " + str(path) + " --- " + str(e))
+    return df
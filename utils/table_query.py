@@ -0,0 +1,401 @@
+import json
+import math
+import re
+import threading
+import weakref
+
+import pandas as pd
+
+
+# Server-side implementation of the DataTable filter_query / sort_by / paging props, used when
+# the table runs with filter_action, sort_action and page_action set to "custom".
+# Filter expressions follow the Dash filtering grammar (https://dash.plotly.com/datatable/filtering)
+# and are translated into vectorized pandas masks rather than evaluated row by row.
+
+
+class FilterQueryError(ValueError):
+    pass
+
+
+_token_re = re.compile(r"""
+    \s*(?:
+        (?P<column>\{(?:\\.|[^}\\])*\})
+      | (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`)
+      | (?P<paren>[()])
+      | (?P<logical>&&|\|\|)
+      | (?P<symbol>!=|>=|<=|=|<|>|!)
+      | (?P<word>[^\s(){}"'`!=<>&|]+)
+    )""", re.VERBOSE)
+
+_relational_ops = {
+    "=": "eq", "eq": "eq",
+    "!=": "ne", "ne": "ne",
+    "<": "lt", "lt": "lt",
+    "<=": "le", "le": "le",
+    ">": "gt", "gt": "gt",
+    ">=": "ge", "ge": "ge",
+    "contains": "contains",
+    "datestartswith": "datestartswith",
+}
+
+_unary_ops = ["blank", "nil", "bool", "even", "odd", "num", "object", "str"]
+
+
+def _unquote(s):
+    return re.sub(r"\\(.)", r"\1", s[1:-1])
+
+
+def tokenize(filter_query):
+    tokens = []
+    pos = 0
+    query = filter_query.rstrip()
+    while pos < len(query):
+        m = _token_re.match(query, pos)
+        if m is None or m.end() == pos:
+            raise FilterQueryError("Cannot parse filter query at: " + query[pos:])
+        kind = m.lastgroup
+        text = m.group(kind)
+        if kind == "column" or kind == "string":
+            text = _unquote(text)
+        elif kind == "word" and text.lower() in ["and", "or"]:
+            kind, text = "logical", "&&" if text.lower() == "and" else "||"
+        tokens.append((kind, text))
+        pos = m.end()
+    return tokens
+
+
+def _split_case(op):
+    # "i" / "s" prefixes select case-insensitive / case-sensitive variants of an operator
+    lowered = op.lower()
+    if lowered not in _relational_ops and lowered[:1] in ["i", "s"] and lowered[1:] in _relational_ops:
+        return _relational_ops[lowered[1:]], lowered[0] == "i"
+    if lowered in _relational_ops:
+        return _relational_ops[lowered], False
+    return None, False
+
+
+def _coerce_value(series, value, quoted):
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return pd.to_datetime(value, errors="coerce")
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    if not quoted:
+        return value
+    return str(value)
+
+
+def _relational_mask(series, op, value, quoted, case_insensitive):
+    if op in ["contains", "datestartswith"]:
+        text = series.astype(str)
+        if op == "datestartswith":
+            return series.notna() & text.str.startswith(str(value))
+        return series.notna() & text.str.contains(str(value), case=not case_insensitive, regex=False)
+
+    value = _coerce_value(series, value, quoted)
+    if isinstance(value, str):
+        lhs = series.astype(str)
+        if case_insensitive:
+            lhs, value = lhs.str.lower(), value.lower()
+        mask_nulls = series.notna()
+    else:
+        if value is pd.NaT:
+            return pd.Series(False, index=series.index)
+        lhs = series
+        mask_nulls = series.notna()
+
+    try:
+        if op == "eq":
+            mask = lhs == value
+        elif op == "ne":
+            return ~(lhs == value) | ~mask_nulls
+        elif op == "lt":
+            mask = lhs < value
+        elif op == "le":
+            mask = lhs <= value
+        elif op == "gt":
+            mask = lhs > value
+        else:
+            mask = lhs >= value
+    except TypeError:
+        # Comparing incompatible types (e.g. text against a number) matches nothing, like the native filter
+        return pd.Series(False, index=series.index)
+
+    return mask.fillna(False).astype(bool) & mask_nulls
+
+
+def _unary_mask(series, op):
+    if op == "blank":
+        return series.isna() | (series.astype(str).str.strip() == "")
+    if op == "nil":
+        return series.isna()
+    if op == "bool":
+        return series.map(lambda v: isinstance(v, bool)).astype(bool)
+    if op in ["even", "odd"]:
+        numbers = pd.to_numeric(series, errors="coerce")
+        whole = numbers.notna() & (numbers % 1 == 0)
+        return whole & ((numbers % 2 == 0) if op == "even" else (numbers % 2 == 1))
+    if op == "num":
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            return series.notna()
+        return series.map(lambda v: isinstance(v, (int, float)) and not isinstance(v, bool)).astype(bool)
+    if op == "str":
+        if pd.api.types.is_string_dtype(series.dtype) or series.dtype == "object":
+            return series.map(lambda v: isinstance(v, str)).astype(bool)
+        return pd.Series(False, index=series.index)
+    return series.map(lambda v: isinstance(v, (dict, list))).astype(bool)
+
+
+class _MaskBuilder:
+    # Evaluates a parsed filter straight into a boolean mask over df
+    def __init__(self, df):
+        self.df = df
+
+    def or_(self, a, b):
+        return a | b
+
+    def and_(self, a, b):
+        return a & b
+
+    def not_(self, a):
+        return ~a
+
+    def unary(self, column, op):
+        return _unary_mask(self.df[column], op)
+
+    def relational(self, column, op, value, quoted, case_insensitive):
+        return _relational_mask(self.df[column], op, value, quoted, case_insensitive)
+
+
+def _sql_ident(column):
+    return '"' + str(column).replace('"', '""') + '"'
+
+
+def _sql_literal(value):
+    if isinstance(value, pd.Timestamp):
+        return "TIMESTAMP '" + value.strftime("%Y-%m-%d %H:%M:%S.%f") + "'"
+    if isinstance(value, float):
+        return repr(value) if math.isfinite(value) else "NULL"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _sql_text(series, col):
+    # Column as text, spelled the way series.astype(str) spells it
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return "(CASE WHEN " + col + " THEN 'True' ELSE 'False' END)"
+    return "CAST(" + col + " AS VARCHAR)"
+
+
+class _SqlBuilder:
+    # Translates a parsed filter into a SQL boolean expression with the same meaning as the
+    # mask, for engines that run the query themselves (see utils/engines.py)
+    def __init__(self, df):
+        self.df = df
+
+    def or_(self, a, b):
+        return "(" + a + " OR " + b + ")"
+
+    def and_(self, a, b):
+        return "(" + a + " AND " + b + ")"
+
+    def not_(self, a):
+        return "(NOT COALESCE(" + a + ", FALSE))"
+
+    def unary(self, column, op):
+        series = self.df[column]
+        col = _sql_ident(column)
+        text = _sql_text(series, col)
+        if op == "blank":
+            return "(" + col + " IS NULL OR trim(" + text + ") = '')"
+        if op == "nil":
+            return "(" + col + " IS NULL)"
+        if op in ["even", "odd"]:
+            number = "TRY_CAST(" + text + " AS DOUBLE)"
+            return "(" + number + " % 1 = 0 AND abs(" + number + " % 2) = " + ("0" if op == "even" else "1") + ")"
+        if op == "bool":
+            return "(" + col + " IS NOT NULL)" if pd.api.types.is_bool_dtype(series.dtype) else "FALSE"
+        if op == "num":
+            numeric = pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype)
+            return "(" + col + " IS NOT NULL)" if numeric else "FALSE"
+        if op == "str":
+            textual = pd.api.types.is_string_dtype(series.dtype) or series.dtype == "object"
+            return "(" + col + " IS NOT NULL)" if textual else "FALSE"
+        return "FALSE"
+
+    def relational(self, column, op, value, quoted, case_insensitive):
+        series = self.df[column]
+        col = _sql_ident(column)
+        text = _sql_text(series, col)
+        if op in ["contains", "datestartswith"]:
+            if op == "datestartswith":
+                return "(" + col + " IS NOT NULL AND starts_with(" + text + ", " + _sql_literal(value) + "))"
+            if case_insensitive:
+                return "(" + col + " IS NOT NULL AND contains(lower(" + text + "), " + _sql_literal(str(value).lower()) + "))"
+            return "(" + col + " IS NOT NULL AND contains(" + text + ", " + _sql_literal(value) + "))"
+
+        value = _coerce_value(series, value, quoted)
+        if isinstance(value, str):
+            lhs = "lower(" + text + ")" if case_insensitive else text
+            value = value.lower() if case_insensitive else value
+        elif value is pd.NaT:
+            return "FALSE"
+        else:
+            lhs = col
+        symbol = {"eq": "=", "ne": "=", "lt": "<", "le": "<=", "gt": ">", "ge": ">="}[op]
+        comparison = "(" + lhs + " " + symbol + " " + _sql_literal(value) + ")"
+        if op == "ne":
+            return "(" + col + " IS NULL OR NOT " + comparison + ")"
+        return "(" + col + " IS NOT NULL AND " + comparison + ")"
+
+
+class _Parser:
+    def __init__(self, df, tokens, builder=None):
+        self.df = df
+        self.tokens = tokens
+        self.builder = _MaskBuilder(df) if builder is None else builder
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        mask = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise FilterQueryError("Unexpected token in filter query: " + str(self.peek()[1]))
+        return mask
+
+    def parse_or(self):
+        mask = self.parse_and()
+        while self.peek() == ("logical", "||"):
+            self.take()
+            mask = self.builder.or_(mask, self.parse_and())
+        return mask
+
+    def parse_and(self):
+        mask = self.parse_unary()
+        while self.peek() == ("logical", "&&"):
+            self.take()
+            mask = self.builder.and_(mask, self.parse_unary())
+        return mask
+
+    def parse_unary(self):
+        kind, text = self.peek()
+        if (kind, text) == ("symbol", "!"):
+            self.take()
+            return self.builder.not_(self.parse_unary())
+        if (kind, text) == ("paren", "("):
+            self.take()
+            mask = self.parse_or()
+            if self.take() != ("paren", ")"):
+                raise FilterQueryError("Unbalanced parentheses in filter query")
+            return mask
+        return self.parse_term()
+
+    def parse_term(self):
+        kind, column = self.take()
+        if kind != "column":
+            raise FilterQueryError("Expected {column} in filter query, got: " + str(column))
+        if column not in self.df.columns:
+            raise FilterQueryError("Unknown column in filter query: " + str(column))
+
+        kind, op = self.take()
+        if op is None:
+            raise FilterQueryError("Missing operator after {" + column + "}")
+
+        if op.lower() == "is":
+            _, unary = self.take()
+            if unary is None or unary.lower() not in _unary_ops:
+                raise FilterQueryError("Unknown unary operator: is " + str(unary))
+            return self.builder.unary(column, unary.lower())
+
+        relational, case_insensitive = _split_case(op)
+        if relational is None:
+            raise FilterQueryError("Unknown operator in filter query: " + str(op))
+
+        kind, value = self.take()
+        if kind not in ["string", "word"]:
+            raise FilterQueryError("Missing value after {" + column + "} " + str(op))
+        return self.builder.relational(column, relational, value, kind == "string", case_insensitive)
+
+
+def filter_mask(df, filter_query):
+    if filter_query is None or len(filter_query.strip()) == 0:
+        return pd.Series(True, index=df.index)
+    return _Parser(df, tokenize(filter_query)).parse()
+
+
+def filter_columns(filter_query):
+    if filter_query is None or len(filter_query.strip()) == 0:
+        return []
+    return list(dict.fromkeys(text for kind, text in tokenize(filter_query) if kind == "column"))
+
+
+def filter_sql(df, filter_query):
+    # The filter as a SQL WHERE expression over df's columns, "TRUE" when there is none
+    if filter_query is None or len(filter_query.strip()) == 0:
+        return "TRUE"
+    return _Parser(df, tokenize(filter_query), _SqlBuilder(df)).parse()
+
+
+def order_by_sql(df, sort_by):
+    sort_by = [s for s in (sort_by or []) if s.get("column_id") in df.columns]
+    return [_sql_ident(s["column_id"]) + (" ASC" if s.get("direction", "asc") == "asc" else " DESC") + " NULLS LAST"
+            for s in sort_by]
+
+
+def apply_filter(df, filter_query):
+    if filter_query is None or len(filter_query.strip()) == 0:
+        return df
+    return df[filter_mask(df, filter_query).to_numpy()]
+
+
+def apply_sort(df, sort_by):
+    sort_by = [s for s in (sort_by or []) if s.get("column_id") in df.columns]
+    if len(sort_by) == 0:
+        return df
+    return df.sort_values(
+        by=[s["column_id"] for s in sort_by],
+        ascending=[s.get("direction", "asc") == "asc" for s in sort_by],
+        kind="mergesort",
+        na_position="last",
+    )
+
+
+# The last filtered / sorted view is kept so that flipping through pages only slices it
+_last_query = {}
+_last_query_lock = threading.Lock()
+
+
+def query_frame(df, filter_query=None, sort_by=None, run=None):
+    # run(df, filter_query, sort_by) replaces the pandas implementation, e.g. with a query engine
+    key = (filter_query or "", json.dumps(sort_by or [], sort_keys=True))
+    with _last_query_lock:
+        ref = _last_query.get("df")
+        if ref is not None and ref() is df and _last_query.get("key") == key:
+            return _last_query["result"]
+
+    if run is None:
+        result = apply_sort(apply_filter(df, filter_query), sort_by)
+    else:
+        result = run(df, filter_query, sort_by)
+
+    with _last_query_lock:
+        _last_query.update({"df": weakref.ref(df), "key": key, "result": result})
+    return result
+
+
+def page_count(total_rows, page_size):
+    return max(1, int(math.ceil(total_rows / float(page_size))))
+
+
+def get_page(df, page_current, page_size):
+    page_current = min(max(int(page_current or 0), 0), page_count(len(df), page_size) - 1)
+    start = page_current * page_size
+    return df.iloc[start:start + page_size], page_current
@@ -0,0 +1,194 @@
+import io
+import itertools
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+import utils.partialagg as pa
+import utils.typeinfer as ti
+
+
+# Tail-follow for append-only CSV files, e.g. logs that grow during the day.
+# After a full read the byte offset of the end of the file, its row count and a fingerprint of
+# the bytes before that offset are remembered. When the file has only grown since, just the
+# appended lines are parsed (with the dtypes of the frame they extend) and concatenated onto the
+# cached frame. Anything else - a rewritten, truncated or rotated file - gets a full read.
+# Group-bys keep their partial states (see utils/partialagg.py) and merge in the states of the
+# appended rows, so every Aggregation Method, including Mean / Variance / Standard Deviation
+# through the running moments, is updated without regrouping the rows already seen.
+
+enabled = False
+encoding = "Latin-1"
+fingerprint_bytes = 4096
+states_max_bytes = 256 * 1024 ** 2
+
+_lineages = itertools.count(1)
+_reads = {}  # abs path -> {"frame": weakref, "lineage", "offset", "rows", "header", "head", "tail", "date_formats"}
+_reads_lock = threading.Lock()
+_states = OrderedDict()  # (abs path, group-by) -> (lineage, rows covered, partial states, nbytes)
+_states_bytes = 0
+_states_lock = threading.Lock()
+
+
+def _fingerprint(f, offset):
+    # First and last bytes before offset: a file that was rewritten rather than appended to differs in one of them
+    f.seek(0)
+    head = f.read(min(fingerprint_bytes, offset))
+    f.seek(max(0, offset - fingerprint_bytes))
+    return head, f.read(offset - max(0, offset - fingerprint_bytes))
+
+
+def _record(path, df, lineage, offset, header, date_formats):
+    with open(path, "rb") as f:
+        head, tail = _fingerprint(f, offset)
+    with _reads_lock:
+        _reads[os.path.abspath(path)] = {"frame": weakref.ref(df), "lineage": lineage, "offset": offset,
+                                         "rows": len(df), "header": header, "head": head, "tail": tail,
+                                         "date_formats": date_formats}
+
+
+def _followed(path, df):
+    # The read entry of df when it's the frame last built for path
+    with _reads_lock:
+        entry = _reads.get(os.path.abspath(path))
+    if df is None or entry is None or entry["frame"]() is not df:
+        return None
+    return entry
+
+
+def _appended(path, entry):
+    # (bytes of the complete lines appended since entry, new offset), None unless the file only grew
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < entry["offset"] or _fingerprint(f, entry["offset"]) != (entry["head"], entry["tail"]):
+            return None
+        f.seek(entry["offset"])
+        data = f.read(size - entry["offset"])
+    # A line still being written is left for the next refresh
+    end = data.rfind(b"\n") + 1
+    return data[:end], entry["offset"] + end
+
+
+def _parse(data, entry, previous):
+    # Appended lines, typed like the columns they extend
+    columns = list(previous.columns)
+    text = [c for c in columns if not pd.api.types.is_numeric_dtype(previous[c].dtype) or
+            pd.api.types.is_bool_dtype(previous[c].dtype)]
+    chunk = pd.read_csv(io.BytesIO(data), header=None, names=entry["header"], encoding=encoding,
+                        dtype={c: str for c in text if not pd.api.types.is_bool_dtype(previous[c].dtype)})
+    chunk = chunk[columns]
+
+    converted = {}
+    for c in columns:
+        dtype = previous[c].dtype
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            fmt = entry["date_formats"].get(c) or ti.detect_date_format(chunk[c].dropna().iloc[:ti.sample_size])
+            converted[c] = pd.to_datetime(chunk[c], format=fmt, errors="coerce")
+        elif pd.api.types.is_bool_dtype(dtype):
+            continue
+        elif pd.api.types.is_numeric_dtype(dtype):
+            converted[c] = pd.to_numeric(chunk[c], errors="coerce")
+    return chunk.assign(**converted) if len(converted) > 0 else chunk
+
+
+def _extend(previous, chunk):
+    df = pd.concat([previous, chunk], ignore_index=True, sort=False)
+    for c in previous.columns:
+        dtype = previous[c].dtype
+        if isinstance(dtype, pd.CategoricalDtype) and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            # New values widen the categories rather than turning the column into objects
+            df[c] = pd.api.types.union_categoricals([previous[c], chunk[c].astype("category")],
+                                                     ignore_order=True)
+        elif pd.api.types.is_numeric_dtype(dtype) and df[c].dtype != dtype:
+            # Downcast ints / floats are widened by the concat, narrow them again if the new values fit
+            df[c] = ti.downcast_numeric(df[c])
+    return df
+
+
+def load(path, read, previous=None):
+    # read(path) -> frame of the whole file. previous is the frame of an older version of the file
+    entry = _followed(path, previous)
+    if entry is not None:
+        try:
+            appended = _appended(path, entry)
+            if appended is not None:
+                data, offset = appended
+                # Nothing complete appended (touched, or a line half written): the same rows
+                df = _extend(previous, _parse(data, entry, previous)) if len(data) > 0 else previous
+                _record(path, df, entry["lineage"], offset, entry["header"], entry["date_formats"])
+                return df
+        except Exception:
+            # e.g. a quoted value spanning the cut, read the whole file instead
+            pass
+
+    size = os.path.getsize(path)
+    df = read(path)
+    # Only followed when the frame matches the file as measured: nothing appended during the read
+    # and no half-written last line
+    with open(path, "rb") as f:
+        f.seek(max(0, size - 1))
+        last = f.read(1)
+        grown = f.read(1) != b""
+    if not grown and last == b"\n":
+        header = list(pd.read_csv(path, nrows=0, encoding=encoding).columns)
+        schema = ti.get_schema(path)
+        _record(path, df, next(_lineages), size, header, (schema or {}).get("date_formats") or {})
+    else:
+        with _reads_lock:
+            _reads.pop(os.path.abspath(path), None)
+    return df
+
+
+def follows(path, df):
+    return _followed(path, df) is not None
+
+
+def _cached_states(cache_key, lineage):
+    with _states_lock:
+        entry = _states.get(cache_key)
+        if entry is None or entry[0] != lineage:
+            return None
+        _states.move_to_end(cache_key)
+        return entry
+
+
+def _cache_states(cache_key, lineage, rows, states):
+    global _states_bytes
+    nbytes = int(states.memory_usage(index=True, deep=True).sum())
+    with _states_lock:
+        old = _states.pop(cache_key, None)
+        if old is not None:
+            _states_bytes -= old[3]
+        _states[cache_key] = (lineage, rows, states, nbytes)
+        _states_bytes += nbytes
+        while _states_bytes > states_max_bytes and len(_states) > 1:
+            _, dropped = _states.popitem(last=False)
+            _states_bytes -= dropped[3]
+
+
+def states(path, df, group_by):
+    # Partial states of a followed frame, merging the states of the rows seen before with those
+    # of the appended rows; None if df isn't a followed frame
+    entry = _followed(path, df)
+    if entry is None:
+        return None
+    group_by = list(group_by)
+    cache_key = (os.path.abspath(path), tuple(group_by))
+    cached = _cached_states(cache_key, entry["lineage"])
+    if cached is not None and cached[1] <= len(df):
+        merged = cached[2]
+        if cached[1] < len(df):
+            merged = pa.merge_states(merged, pa.partial_states(df.iloc[cached[1]:], group_by))
+    else:
+        merged = pa.partial_states(df, group_by)
+    _cache_states(cache_key, entry["lineage"], len(df), merged)
+    return merged
+
+
+def states_stats():
+    with _states_lock:
+        return {"entries": len(_states), "current_bytes": _states_bytes, "max_bytes": states_max_bytes}
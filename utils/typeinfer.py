@@ -0,0 +1,184 @@
+import threading
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+
+import utils.datacache as dc
+
+
+# Sampled type inference for files read without a dtype_dict.
+# Each object column is tested on a bounded sample first; only columns whose sample clearly
+# parses as dates (with an explicit format) or numbers are converted in full. Numeric columns
+# are downcast and low-cardinality text becomes 'category'. The result is a schema of the same
+# shape read_df() accepts ({"dtype_dict": ..., "col_order": ..., "date_formats": ...}),
+# cached per file so it can be inspected and reused.
+
+sample_size = 1000
+parse_threshold = 0.99  # fraction of the sample that has to parse for a column to be converted
+category_max_ratio = 0.5  # distinct / non-null values at or below which text becomes 'category'
+category_max_distinct = 10000
+
+date_formats = [
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%SZ",
+    "%Y/%m/%d",
+    "%Y/%m/%d %H:%M:%S",
+    "%m/%d/%Y",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %I:%M:%S %p",
+    "%m/%d/%y",
+    "%d/%m/%Y",
+    "%d/%m/%Y %H:%M:%S",
+    "%d.%m.%Y",
+    "%d-%b-%Y",
+    "%d %b %Y",
+    "%b %d, %Y",
+    "%B %d, %Y",
+]
+
+numeric_dtypes = ['int64', 'float64', 'int32', 'float32', 'int16', 'int8', 'double']
+
+
+def _sample(series, n=None):
+    n = sample_size if n is None else n
+    values = series.dropna()
+    if len(values) > n:
+        # Head plus an evenly spaced spread, so sorted files don't only show their first rows
+        step = len(values) // (n // 2)
+        values = pd.concat([values.iloc[:n // 2], values.iloc[::step].iloc[:n - n // 2]])
+    return values
+
+
+def detect_date_format(sample):
+    if len(sample) == 0:
+        return None
+    text = sample.astype(str).str.strip()
+    # Cheap rejection before trying formats: dates contain digits and are short
+    if text.str.contains(r"\d", regex=True).mean() < parse_threshold or text.str.len().max() > 40:
+        return None
+    probe = text.iloc[:20]
+    for fmt in date_formats:
+        # Screen every format on a few values, confirm on the whole sample only when they parse
+        if pd.to_datetime(probe, format=fmt, errors="coerce").notna().mean() < parse_threshold:
+            continue
+        parsed = pd.to_datetime(text, format=fmt, errors="coerce")
+        if parsed.notna().mean() >= parse_threshold:
+            return fmt
+    return None
+
+
+def looks_numeric(sample):
+    if len(sample) == 0:
+        return False
+    return pd.to_numeric(sample, errors="coerce").notna().mean() >= parse_threshold
+
+
+def downcast_numeric(series):
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return series
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return pd.to_numeric(series, downcast="integer")
+    if pd.api.types.is_float_dtype(series.dtype) and series.dtype != np.float32:
+        as_float32 = series.astype(np.float32)
+        # Only keep float32 when no value changes
+        if ((as_float32.astype(series.dtype) == series) | series.isna()).all():
+            return as_float32
+    return series
+
+
+def infer_column(series):
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return str(series.dtype), None
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return str(downcast_numeric(series).dtype), None
+    if series.dtype != "object":
+        return str(series.dtype), None
+
+    sample = _sample(series)
+    fmt = detect_date_format(sample)
+    if fmt is not None:
+        return "datetime64", fmt
+    if looks_numeric(sample):
+        return "float64", None
+
+    # Estimate cardinality on the sample first, only count the full column for likely candidates
+    if len(sample) > 0 and sample.nunique() <= category_max_ratio * len(sample):
+        non_null = series.count()
+        distinct = series.nunique()
+        if distinct <= category_max_distinct and distinct <= category_max_ratio * non_null:
+            return "category", None
+    return "object", None
+
+
+def infer_schema(df):
+    dtype_dict = {}
+    formats = {}
+    for col in df.columns:
+        dtype, fmt = infer_column(df[col])
+        dtype_dict[col] = dtype
+        if fmt is not None:
+            formats[col] = fmt
+    return {"dtype_dict": dtype_dict, "col_order": list(df.columns), "date_formats": formats}
+
+
+def apply_dtypes(df, dtype_dict, date_formats=None, downcast=False):
+    # downcast: the dtypes were inferred (see infer_schema), their float64 columns may become float32.
+    # Dtypes given explicitly are applied as they are.
+    date_formats = date_formats or {}
+    converted = {}
+    for k, v in dtype_dict.items():
+        try:
+            if k not in df.columns:
+                raise KeyError("COLUMN NOT FOUND --- " + str(k))
+            if str(df[k].dtype) == v:
+                continue
+            if(v == 'string'):
+                converted[k] = df[k].astype('string')
+            elif(v in ['object', 'category', 'bool']):
+                converted[k] = df[k].astype(v)
+            elif(v in numeric_dtypes):
+                values = pd.to_numeric(df[k], errors='coerce')
+                if(v.startswith('int') and values.isna().any()):
+                    v = 'float64'  # ints can't hold the NaNs left by coercion
+                converted[k] = downcast_numeric(values) if downcast and v == 'float64' else values.astype(v if v != 'double' else 'float64')
+            elif('date' in v):
+                converted[k] = pd.to_datetime(df[k], format=date_formats.get(k), errors='coerce')
+            else:
+                raise Exception("INVALID DTYPE GIVEN FOR COLUMN --- " + str(k))
+        except Exception as e:
+            warn(str(e))
+
+    if len(converted) > 0:
+        df = df.assign(**converted)
+    return df
+
+
+_schemas = {}  # abs path -> (file key, schema)
+_schemas_lock = threading.Lock()
+
+
+def get_schema(path, df=None):
+    key = dc.file_key(path)
+    with _schemas_lock:
+        entry = _schemas.get(key[0])
+        if entry is not None and entry[0] == key:
+            return entry[1]
+    if df is None:
+        return None
+
+    schema = infer_schema(df)
+    with _schemas_lock:
+        _schemas[key[0]] = (key, schema)
+    return schema
+
+
+def cached_schemas():
+    with _schemas_lock:
+        return {path: schema for path, (_, schema) in _schemas.items()}
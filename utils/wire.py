@@ -0,0 +1,174 @@
+import base64
+import json
+import math
+from warnings import warn
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+try:
+    from flask_compress import Compress
+except ImportError:  # pragma: no cover - responses are sent uncompressed without it
+    Compress = None
+
+
+# Column-oriented wire format for table rows. df.to_dict('records') repeats every column name
+# on every row; here each column is sent once, numeric columns as base64 little-endian typed
+# arrays (whichever of that and plain JSON is shorter) and datetimes formatted once per column.
+# decode_js turns a payload back into DataTable records in the browser.
+#
+#   {"length": rows, "columns": [[name, {"dtype": "i2", "b64": "..."}], [name, {"values": [...]}], ...]}
+
+_int_dtypes = [("i1", np.int8), ("i2", np.int16), ("i4", np.int32)]
+_max_safe_integer = 2 ** 53  # larger integers don't survive a JS number
+probe_rows = 1000  # values serialized both ways to pick a column's encoding
+
+
+def _typed(values, dtype):
+    data = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {"dtype": dtype, "b64": base64.b64encode(data.tobytes()).decode("ascii")}
+
+
+def _numeric_dtype(series):
+    # Smallest typed array holding the column exactly, None when JSON has to carry it
+    values = series.to_numpy()
+    kind = values.dtype.kind
+    if kind in "iu":
+        if len(values) == 0:
+            return "i1"
+        low, high = values.min(), values.max()
+        for name, dtype in _int_dtypes:
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return name
+        return "f8" if -_max_safe_integer <= low and high <= _max_safe_integer else None
+    if kind == "f":
+        return "f4" if values.dtype == np.float32 else "f8"
+    return None
+
+
+def _datetimes(series):
+    # The strings to_dict('records') + Timestamp.isoformat() would give, formatted once per column
+    if series.dt.tz is not None:
+        return [None if pd.isna(v) else v.isoformat() for v in series]
+    values = series.to_numpy()
+    text = np.datetime_as_string(values, unit="s").astype(object)
+    fractional = (values.astype("datetime64[us]") - values.astype("datetime64[s]")).astype("int64") != 0
+    if fractional.any():
+        text[fractional] = np.datetime_as_string(values[fractional], unit="us")
+    text[np.isnat(values)] = None
+    return text.tolist()
+
+
+def _values(series):
+    values = series.to_numpy(dtype=object)
+    missing = pd.isna(values)
+    if missing.any():
+        values = values.copy()
+        values[missing] = None
+    return values.tolist()
+
+
+def encode_column(series):
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return {"values": _datetimes(series)}
+    if pd.api.types.is_bool_dtype(series.dtype) or not pd.api.types.is_numeric_dtype(series.dtype):
+        return {"values": _values(series)}
+
+    if pd.api.types.is_extension_array_dtype(series.dtype):
+        # Nullable Int64 / Float64, missing values become NaN which decodes to null
+        series = series.astype("float64")
+    dtype = _numeric_dtype(series)
+    if dtype is None:
+        return {"values": _values(series)}
+
+    # Typed arrays cost 4/3 chars per byte; short numbers (counts, prices) can be shorter as JSON
+    probe = series.iloc[:probe_rows]
+    typed_chars = math.ceil(len(probe) * np.dtype(dtype).itemsize / 3.0) * 4
+    if len(json.dumps(probe.tolist())) <= typed_chars:
+        return {"values": _values(series)}
+    return _typed(series.to_numpy(), dtype)
+
+
+def encode(df):
+    return {"length": len(df), "columns": [[str(c), encode_column(df[c])] for c in df.columns]}
+
+
+def records_size(df):
+    # Bytes of the same rows in the records format, for comparisons
+    return len(to_json_plotly(df.to_dict("records")).encode("utf-8"))
+
+
+def encoded_size(df):
+    return len(to_json_plotly(encode(df)).encode("utf-8"))
+
+
+# dash_clientside function: payload -> DataTable records
+decode_js = """
+function(payload) {
+    if (!payload) {
+        return window.dash_clientside.no_update;
+    }
+    // Start of the render time render_timing_js reports
+    window.dataExplorerPayloadTime = performance.now();
+    var arrays = {i1: Int8Array, i2: Int16Array, i4: Int32Array, f4: Float32Array, f8: Float64Array};
+    var rows = new Array(payload.length);
+    for (var i = 0; i < payload.length; i++) {
+        rows[i] = {};
+    }
+    payload.columns.forEach(function(column) {
+        var name = column[0], encoded = column[1], values = encoded.values;
+        if (encoded.dtype) {
+            var text = atob(encoded.b64), bytes = new Uint8Array(text.length);
+            for (var b = 0; b < text.length; b++) {
+                bytes[b] = text.charCodeAt(b);
+            }
+            values = new arrays[encoded.dtype](bytes.buffer);
+        }
+        for (var i = 0; i < payload.length; i++) {
+            var v = values[i];
+            rows[i][name] = (typeof v === "number" && isNaN(v)) ? null : v;
+        }
+    });
+    return rows;
+}
+"""
+
+
+# dash_clientside function: once the table has painted the rows decode_js returned, posts the time
+# since the payload arrived to /render-timing. Two animation frames: the first runs before the
+# browser paints the new rows, the second after.
+render_timing_js = """
+function(data, virtualization, columns) {
+    var start = window.dataExplorerPayloadTime;
+    if (!data || start === undefined || !navigator.sendBeacon) {
+        return window.dash_clientside.no_update;
+    }
+    window.dataExplorerPayloadTime = undefined;
+    requestAnimationFrame(function() {
+        requestAnimationFrame(function() {
+            navigator.sendBeacon("render-timing", JSON.stringify({
+                seconds: (performance.now() - start) / 1000, rows: data.length,
+                columns: (columns || []).length, virtualized: !!virtualization
+            }));
+        });
+    });
+    return window.dash_clientside.no_update;
+}
+"""
+
+
+def compress(server, algorithms, level=6):
+    # gzip / brotli for callback responses and assets. Streamed downloads are left alone, they are
+    # already compressed where it helps (csv.gz, parquet) and buffering them would defeat streaming.
+    if not algorithms:
+        return None
+    if Compress is None:
+        warn("Flask-Compress isn't installed, responses are sent uncompressed")
+        return None
+    server.config["COMPRESS_ALGORITHM"] = list(algorithms)
+    server.config["COMPRESS_LEVEL"] = level
+    server.config["COMPRESS_BR_LEVEL"] = min(level, 11)
+    server.config["COMPRESS_STREAMS"] = False
+    return Compress(server)